@@ -3,19 +3,17 @@ import sys
 
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
+import pandas as pd
 import streamlit as st
 from streamlit_feedback import streamlit_feedback
 from langchain_core.messages import AIMessage, HumanMessage
 
-from src.config.assistant_config import IeeeAssistant
-from src.core.database import add_to_chroma, clear_database
-from src.core.loader import load_pdf_directory, split_documents
+from src.config.assistant_config import get_shared_assistant
+from src.core.retriever import get_retriever, reload_retriever
+from src.core.sessions import get_session_store
+from src.core.tracing import get_tracer
+from src.core.utils import get_settings
 from datetime import datetime
-from streamlit_gsheets import GSheetsConnection
-
-import uuid
-
-import pandas as pd
 
 # Configuração da página do Streamlit
 st.set_page_config(
@@ -24,6 +22,12 @@ st.set_page_config(
 st.title('💬 Fale com a Iracema.IA')
 st.sidebar.title('Configurações')
 
+# Abre o Chroma, aquece o retriever e monta o assistente (cliente do
+# Gemini e cadeia do prompt) uma única vez por processo
+get_retriever()
+get_shared_assistant()
+
+
 def _get_session():
     from streamlit.runtime import get_instance
     from streamlit.runtime.scriptrunner import get_script_run_ctx
@@ -34,33 +38,81 @@ def _get_session():
         raise RuntimeError("Couldn't get your Streamlit Session object.")
     return session_id
 
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+
+# O histórico fica no SessionStore do processo, com memória limitada, e
+# não no session_state de cada aba
+sessions = get_session_store()
+session_id = _get_session()
+render_messages = get_settings('sessions').get('render_messages', 20)
+
 
 def current_time():
     return datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
 
+
 def reset_chat():
-    st.session_state.pop('chat_history', None)
+    sessions.clear(_get_session())
+    st.session_state.pop('shown_messages', None)
 
 
-def populate_database():
-    documents = load_pdf_directory()
-    chunks = split_documents(documents)
-    add_to_chroma(chunks)
+def show_older_messages():
+    st.session_state.shown_messages = (
+        st.session_state.get('shown_messages', render_messages)
+        + render_messages
+    )
 
 
-def get_response(user_input, chat_history=st.session_state.chat_history):
-    if 'assistant' not in st.session_state:
-        st.session_state.assistant = IeeeAssistant()
-        st.session_state.assistant.get_assistant()
-    return st.session_state.assistant.run_assistant(user_input, chat_history)
+def populate_database():
+    # A ingestão (pypdf, chunker) só é importada quando usada
+    from src.core.indexer import index_directory
+
+    index_directory()
+    reload_retriever()
+
+
+def get_response(user_input, chat_history=None):
+    if chat_history is None:
+        chat_history = sessions.history(_get_session())
+    return get_shared_assistant().run_assistant(
+        user_input, chat_history, _get_session()
+    )
+
+
+def feedback_credentials():
+    # Credenciais da planilha de feedback, se configuradas nos secrets
+    try:
+        return dict(st.secrets['connections']['gsheets'])
+    except (KeyError, FileNotFoundError):
+        return None
+
+
+def latency_panel():
+    summary = get_tracer().summary()
+    with st.sidebar.expander('⏱️ Latência por etapa'):
+        if not summary:
+            st.caption('Nenhuma requisição registrada ainda.')
+            return
+        table = pd.DataFrame.from_dict(summary, orient='index')
+        st.dataframe(
+            table[['count', 'p50', 'p95', 'p99']].round(3),
+            use_container_width=True,
+        )
+        st.download_button(
+            'Exportar JSONL', get_tracer().to_jsonl(), 'traces.jsonl'
+        )
+        st.download_button(
+            'Exportar Prometheus', get_tracer().to_prometheus(), 'metrics.txt'
+        )
 
-st.sidebar.button('Resetar Chat', on_click=reset_chat)
 
-conn = st.connection("gsheets", type=GSheetsConnection)
+st.sidebar.button('Resetar Chat', on_click=reset_chat)
 
-for message in st.session_state.chat_history:
+# Só as mensagens mais recentes são desenhadas a cada rerun
+shown = st.session_state.get('shown_messages', render_messages)
+total = sessions.length(session_id)
+if total > shown:
+    st.button('Mostrar mensagens anteriores', on_click=show_older_messages)
+for message in sessions.history(session_id, start=total - shown):
     if isinstance(message, AIMessage):
         with st.chat_message('AI', avatar="assets/carcarA4.png"):
             st.write(message.content)
@@ -71,15 +123,15 @@ for message in st.session_state.chat_history:
 user_query = st.chat_input('Digite sua mensagem:', key='user_input')
 
 if user_query is not None and user_query != '':
-    st.session_state.chat_history.append(HumanMessage(content=user_query))
+    sessions.append(session_id, 'human', user_query)
 
     with st.chat_message('Human'):
         st.markdown(user_query)
 
     with st.chat_message('AI',avatar="assets/carcarA4.png"):
-        stream = get_response(user_query, st.session_state.chat_history)
+        stream = get_response(user_query, sessions.history(session_id))
         response = st.write_stream(stream)
-    st.session_state.chat_history.append(AIMessage(content=response))
+    sessions.append(session_id, 'ai', response)
 
     streamlit_feedback(
     feedback_type="thumbs",
@@ -87,18 +139,30 @@ if user_query is not None and user_query != '':
     key="feedback")
 
 if "feedback" in st.session_state and st.session_state["feedback"] is not None:
+    feedback = st.session_state["feedback"]
+    last_turn = sessions.history(
+        session_id, start=sessions.length(session_id) - 2
+    )
     user_feedback = {
     "session_id": _get_session(),
     "inserted_at": current_time(),
-    "user_message": st.session_state["chat_history"][-2].content,
-    "assistant_message": st.session_state["chat_history"][-1].content,
+    "user_message": last_turn[-2].content,
+    "assistant_message": last_turn[-1].content,
     "feedback_score": 1 if st.session_state["feedback"]["score"] == "👍" else 0,
     "feedback_text": st.session_state["feedback"]["text"]}
 
+    # O valor do widget persiste entre reruns: registra cada avaliação uma vez
+    feedback_key = (
+        sessions.length(session_id),
+        feedback["score"],
+        feedback["text"],
+    )
+    if st.session_state.get("logged_feedback") != feedback_key:
+        st.session_state.logged_feedback = feedback_key
+        from src.core.feedback import get_feedback_logger
 
-    update = pd.concat([conn.read(worksheet="feedback", max_entries=None), pd.DataFrame(user_feedback, index=[0])], ignore_index=True)
-    conn.update(worksheet="feedback", data=update,)
+        get_feedback_logger(feedback_credentials()).log(user_feedback)
 
-st.cache_data.clear()
-conn.reset()
+if get_settings('tracing').get('sidebar', False):
+    latency_panel()
     
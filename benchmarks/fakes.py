@@ -0,0 +1,104 @@
+"""Offline stand-ins for the remote services, used by the benchmarks."""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    ChatResult,
+)
+
+from src.config.assistant_config import IeeeAssistant
+
+ANSWER_WORDS = (
+    'Encontrei essa informação no documento Estatuto do Ramo Estudantil '
+    'IEEE UFC Fortaleza na página indicada, conforme o contexto fornecido.'
+).split()
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Deterministic chat model that streams a fixed answer word by word.
+
+    Attributes:
+        first_token_latency (float): Seconds before the first word, which
+        stands for the prompt processing of the remote model.
+        token_latency (float): Seconds between two words.
+        answer_tokens (int): Number of words of every answer.
+    """
+
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 100
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-streaming'
+
+    def _words(self) -> List[str]:
+        return [
+            ANSWER_WORDS[index % len(ANSWER_WORDS)] + ' '
+            for index in range(self.answer_tokens)
+        ]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = ''.join(
+            chunk.message.content
+            for chunk in self._stream(messages, stop, run_manager)
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))]
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for index, word in enumerate(self._words()):
+            if index:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for index, word in enumerate(self._words()):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class FakeAssistant(IeeeAssistant):
+    """
+    IeeeAssistant answering with a FakeStreamingChatModel instead of Gemini.
+    The prompt, retrieval and context assembly are the real ones.
+
+    Attributes:
+        llm (FakeStreamingChatModel): The model used by the assistant.
+    """
+
+    def __init__(self, llm: FakeStreamingChatModel):
+        super().__init__()
+        self.llm = llm
+
+    def get_llm_model(self) -> BaseChatModel:
+        return self.llm
@@ -0,0 +1,333 @@
+"""Offline end-to-end benchmark of the ingestion and serving paths.
+
+The embedding model is replaced by the deterministic `stub` backend and the
+LLM by FakeStreamingChatModel, both with configurable latency, so the
+numbers only depend on this code. Everything runs in a scratch directory
+with its own settings file, Chroma collection and caches; the real ones
+are never touched.
+
+Run from the repository root with `task bench` or
+`python -m benchmarks.run --output results.json`.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import yaml
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import FakeAssistant, FakeStreamingChatModel
+from src.core.database import add_to_chroma
+from src.core.loader import load_pdf_directory, split_documents
+from src.core.retriever import get_retriever
+from src.core.tracing import get_tracer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_FILE = os.path.join('src', 'config', 'ieee_assistant.yaml')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    Nearest-rank p50/p95/p99 of the values, in milliseconds.
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        f'p{int(quantile * 100)}_ms': 1000
+        * values[max(0, math.ceil(quantile * len(values)) - 1)]
+        for quantile in QUANTILES
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def prepare_workdir(workdir: str, args: argparse.Namespace):
+    """
+    Creates the scratch directory: a link to the PDFs and a copy of the
+    settings using the offline embeddings, without persistent caches.
+    """
+    with open(os.path.join(ROOT, SETTINGS_FILE), encoding='utf-8') as file:
+        settings = yaml.safe_load(file)
+    settings['embeddings'] = {
+        'backend': 'stub',
+        'dimension': args.dimension,
+        'latency': args.embedding_latency,
+    }
+    settings['vector_store'] = {'backend': args.vector_store}
+    settings['embedding_cache'] = {
+        **settings.get('embedding_cache', {}),
+        'persist': False,
+    }
+    # Every answer must reach the LLM to measure it
+    settings['answer_cache'] = {'enabled': False}
+    settings['feedback'] = {'backend': 'jsonl'}
+    settings['tracing'] = {'enabled': True, 'capacity': 100000}
+
+    os.makedirs(os.path.join(workdir, 'src', 'config'))
+    with open(
+        os.path.join(workdir, SETTINGS_FILE), 'w', encoding='utf-8'
+    ) as file:
+        yaml.safe_dump(settings, file, allow_unicode=True)
+    os.symlink(os.path.abspath(args.docs), os.path.join(workdir, 'docs'))
+
+
+def bench_ingestion() -> Tuple[Dict[str, Any], list]:
+    started_at = time.perf_counter()
+    pages = load_pdf_directory()
+    load_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    chunks = split_documents(pages)
+    split_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    add_to_chroma(chunks)
+    add_seconds = time.perf_counter() - started_at
+
+    return {
+        'pages': len(pages),
+        'chunks': len(chunks),
+        'load_pdf_directory': {
+            'seconds': load_seconds,
+            'pages_per_second': len(pages) / load_seconds,
+        },
+        'split_documents': {
+            'seconds': split_seconds,
+            'chunks_per_second': len(chunks) / split_seconds,
+        },
+        'add_to_chroma': {
+            'seconds': add_seconds,
+            'chunks_per_second': len(chunks) / add_seconds,
+        },
+    }, chunks
+
+
+def make_questions(chunks: list, count: int, seed: int) -> List[str]:
+    """
+    Builds distinct questions from words of random chunks, so the query
+    embeddings are not served by the cache.
+    """
+    generator = random.Random(seed)
+    questions = []
+    for index in range(count):
+        words = generator.choice(chunks).page_content.split()
+        start = generator.randrange(max(1, len(words) - 8))
+        questions.append(f'{" ".join(words[start : start + 8])} ({index})')
+    return questions
+
+
+def bench_retrieval(questions: List[str]) -> Dict[str, Any]:
+    retriever = get_retriever()
+    latencies = []
+    paths = {}
+    for question in questions:
+        started_at = time.perf_counter()
+        retriever.query_rag(question)
+        latencies.append(time.perf_counter() - started_at)
+    for span in get_tracer().spans('retriever.query'):
+        path = span.attributes.get('path', 'error')
+        paths[path] = paths.get(path, 0) + 1
+    return {
+        'queries': len(questions),
+        'latency': percentiles(latencies),
+        'paths': paths,
+    }
+
+
+def run_session(assistant, questions: List[str], session_id: str) -> list:
+    """
+    Asks the questions of one simulated session in sequence and returns
+    the time to first token, duration and size of every answer.
+    """
+    history = []
+    results = []
+    for question in questions:
+        history.append(HumanMessage(content=question))
+        started_at = time.perf_counter()
+        first_token = None
+        pieces = []
+        for piece in assistant.run_assistant(question, history, session_id):
+            if first_token is None:
+                first_token = time.perf_counter() - started_at
+            pieces.append(piece)
+        results.append(
+            (first_token, time.perf_counter() - started_at, len(pieces))
+        )
+        history.append(AIMessage(content=''.join(pieces)))
+    return results
+
+
+def bench_assistant(
+    assistant, questions: List[str], concurrency: int, turns: int
+) -> Dict[str, Any]:
+    sessions = [
+        questions[index * turns : (index + 1) * turns]
+        for index in range(concurrency)
+    ]
+    session_ids = [
+        f'bench-{concurrency}-{index}' for index in range(concurrency)
+    ]
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(
+            executor.map(
+                run_session, [assistant] * concurrency, sessions, session_ids
+            )
+        )
+    elapsed = time.perf_counter() - started_at
+
+    answers = [answer for session in results for answer in session]
+    tokens = sum(size for _, _, size in answers)
+    return {
+        'concurrency': concurrency,
+        'requests': len(answers),
+        'seconds': elapsed,
+        'time_to_first_token': percentiles(
+            [first for first, _, _ in answers if first is not None]
+        ),
+        'request_latency': percentiles([total for _, total, _ in answers]),
+        'requests_per_second': len(answers) / elapsed,
+        'tokens_per_second': tokens / elapsed,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    ingestion, chunks = bench_ingestion()
+    if not chunks:
+        raise SystemExit('No chunks were produced; check --docs')
+
+    sessions = max(args.concurrency)
+    questions = make_questions(
+        chunks, args.queries + sessions * args.turns, args.seed
+    )
+    retrieval = bench_retrieval(questions[: args.queries])
+
+    assistant = FakeAssistant(
+        FakeStreamingChatModel(
+            first_token_latency=args.first_token_latency,
+            token_latency=args.token_latency,
+            answer_tokens=args.answer_tokens,
+        )
+    )
+    assistant.get_assistant()
+    serving = [
+        bench_assistant(
+            assistant, questions[args.queries :], concurrency, args.turns
+        )
+        for concurrency in args.concurrency
+    ]
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {
+            key: value
+            for key, value in vars(args).items()
+            if key not in {'output', 'keep'}
+        },
+        'ingestion': ingestion,
+        'retrieval': retrieval,
+        'assistant': serving,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmark of ingestion, retrieval and answers.'
+    )
+    parser.add_argument('--docs', default=os.path.join(ROOT, 'docs'))
+    parser.add_argument(
+        '--output',
+        default='benchmark-results.json',
+        help='JSON file for the results',
+    )
+    parser.add_argument(
+        '--vector-store', choices=('chroma', 'numpy'), default='chroma'
+    )
+    parser.add_argument('--dimension', type=int, default=768)
+    parser.add_argument(
+        '--embedding-latency',
+        type=float,
+        default=0.05,
+        help='seconds per embedding call',
+    )
+    parser.add_argument(
+        '--first-token-latency',
+        type=float,
+        default=0.3,
+        help='seconds before the first token of an answer',
+    )
+    parser.add_argument(
+        '--token-latency',
+        type=float,
+        default=0.01,
+        help='seconds between two answer tokens',
+    )
+    parser.add_argument('--answer-tokens', type=int, default=100)
+    parser.add_argument(
+        '--queries', type=int, default=200, help='retrieval queries'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        nargs='+',
+        default=[1, 8, 64],
+        help='simulated concurrent sessions',
+    )
+    parser.add_argument(
+        '--turns', type=int, default=2, help='questions per session'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--keep', action='store_true', help='keep the scratch directory'
+    )
+    args = parser.parse_args()
+    args.docs = os.path.abspath(args.docs)
+    args.output = os.path.abspath(args.output)
+
+    workdir = tempfile.mkdtemp(prefix='iracema-bench-')
+    prepare_workdir(workdir, args)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run(args)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f'Scratch directory kept at {workdir}')
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, ensure_ascii=False)
+        file.write('\n')
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Local stand-in for the Gemini REST API, used to test the model gateway.
+
+Serves `generateContent`, `streamGenerateContent`, `embedContent` and
+`batchEmbedContents` with configurable latency and quota errors, and counts
+the connections and concurrent requests it sees. Point the gateway at it
+with the settings `gateway.transport: rest` and
+`gateway.endpoint: http://127.0.0.1:<port>` (any GOOGLE_API_KEY works).
+
+Run with `python -m benchmarks.stub_gemini --port 8089`.
+"""
+
+import argparse
+import dataclasses
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from src.core.embeddings import HashingEmbeddings
+
+ANSWER_WORDS = (
+    'Encontrei essa informação no documento indicado, conforme o contexto.'
+).split()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing their kept-alive connections are not errors
+        pass
+
+
+def _candidate(text: str, finished: bool) -> dict:
+    candidate = {
+        'content': {'parts': [{'text': text}], 'role': 'model'},
+        'index': 0,
+    }
+    if finished:
+        candidate['finishReason'] = 'STOP'
+    return {'candidates': [candidate]}
+
+
+@dataclasses.dataclass(eq=False)
+class StubGeminiServer:
+    """
+    Threaded HTTP server answering like the Gemini REST API.
+
+    Attributes:
+        host (str): Address the server listens on.
+        port (int): Port the server listens on, any free one if 0.
+        latency (float): Seconds before every response (or first chunk).
+        token_latency (float): Seconds between two streamed words.
+        answer_tokens (int): Words of every generated answer.
+        error_rate (float): Probability of answering 429.
+        dimension (int): Size of the embedding vectors.
+        stats (Dict[str, int]): Requests, connections, errors and the
+        maximum number of concurrent requests seen.
+    """
+
+    host: str = '127.0.0.1'
+    port: int = 0
+    _: dataclasses.KW_ONLY
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 20
+    error_rate: float = 0.0
+    dimension: int = 768
+
+    def __post_init__(self):
+        self.embeddings = HashingEmbeddings(self.dimension)
+        self.stats: Dict[str, int] = {
+            'requests': 0,
+            'connections': 0,
+            'errors': 0,
+            'active': 0,
+            'max_active': 0,
+        }
+        self._lock = threading.Lock()
+        self._server = _Server((self.host, self.port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self.stats[key] += delta
+            self.stats['max_active'] = max(
+                self.stats['max_active'], self.stats['active']
+            )
+
+    def _words(self):
+        return [
+            ANSWER_WORDS[index % len(ANSWER_WORDS)] + ' '
+            for index in range(self.answer_tokens)
+        ]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                stub._count('connections')
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data: str):
+                encoded = data.encode('utf-8')
+                self.wfile.write(f'{len(encoded):x}\r\n'.encode() + encoded)
+                self.wfile.write(b'\r\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                stub._count('requests')
+                stub._count('active')
+                try:
+                    time.sleep(stub.latency)
+                    if stub.error_rate and random.random() < stub.error_rate:
+                        stub._count('errors')
+                        self._send_json(
+                            429,
+                            {
+                                'error': {
+                                    'code': 429,
+                                    'message': 'Resource has been exhausted',
+                                    'status': 'RESOURCE_EXHAUSTED',
+                                }
+                            },
+                        )
+                        return
+                    self._answer(self.path.split('?')[0], request)
+                finally:
+                    stub._count('active', -1)
+
+            def _answer(self, path: str, request: dict):
+                if path.endswith(':batchEmbedContents'):
+                    texts = [
+                        part['text']
+                        for item in request.get('requests', [])
+                        for part in item['content']['parts']
+                    ]
+                    vectors = stub.embeddings.embed_documents(texts)
+                    self._send_json(
+                        200,
+                        {'embeddings': [{'values': v} for v in vectors]},
+                    )
+                elif path.endswith(':embedContent'):
+                    text = request['content']['parts'][0]['text']
+                    vector = stub.embeddings.embed_query(text)
+                    self._send_json(200, {'embedding': {'values': vector}})
+                elif path.endswith(':generateContent'):
+                    self._send_json(
+                        200, _candidate(''.join(stub._words()), True)
+                    )
+                elif path.endswith(':streamGenerateContent'):
+                    self._stream()
+                else:
+                    self._send_json(404, {'error': {'code': 404}})
+
+            def _stream(self):
+                # The REST transport reads a JSON array, element by element
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                words = stub._words()
+                for index, word in enumerate(words):
+                    if index:
+                        time.sleep(stub.token_latency)
+                    chunk = json.dumps(
+                        _candidate(word, index == len(words) - 1)
+                    )
+                    self._send_chunk(('[' if index == 0 else ',') + chunk)
+                self._send_chunk(']')
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        Serves on a background thread and returns the endpoint.
+        """
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self.endpoint
+
+    def serve_forever(self):
+        """
+        Serves on the current thread until interrupted.
+        """
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve a local stand-in for the Gemini REST API.'
+    )
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--token-latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubGeminiServer(
+        port=args.port,
+        latency=args.latency,
+        token_latency=args.token_latency,
+        error_rate=args.error_rate,
+    )
+    print(f'Stub Gemini API listening on {server.endpoint}')
+    server.serve_forever()
@@ -0,0 +1,133 @@
+import argparse
+import json
+
+from src.core.database import Database, hnsw_settings
+from src.core.index_tuning import (
+    SweepGrid,
+    evaluate,
+    exact_neighbours,
+    load_vectors,
+    sample_queries,
+    sweep,
+)
+
+
+def _megabytes(size):
+    return f'{size / 2**20:.1f} MB'
+
+
+def _print_row(row):
+    print(
+        f"  space={row['space']} M={row['M']} "
+        f"construction_ef={row['construction_ef']} "
+        f"search_ef={row['search_ef']}: recall={row['recall']:.3f} "
+        f"p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms "
+        f"p99={row['p99_ms']:.2f}ms"
+        + (
+            f" build={row['build_seconds']:.1f}s"
+            if 'build_seconds' in row
+            else ''
+        )
+    )
+
+
+def rebuild_index(db):
+    stats = db.rebuild_index()
+    print(
+        f"Rebuilt {stats['chunks']} chunks in {stats['seconds']:.1f}s: "
+        f"{stats['params_before']} -> {stats['params_after']}, "
+        f"{_megabytes(stats['size_before'])} -> "
+        f"{_megabytes(stats['size_after'])}"
+    )
+    return stats
+
+
+def evaluate_index(db, queries, k, seed):
+    params = db.index_params()
+    ids, vectors = load_vectors(db.database._collection)
+    query_vectors = sample_queries(vectors, queries, seed)
+    truth = exact_neighbours(vectors, query_vectors, k, params['space'])
+    row = {
+        **params,
+        **evaluate(db.database._collection, ids, query_vectors, truth, k),
+    }
+    print(f'Current collection ({len(ids)} chunks, recall@{k}):')
+    _print_row(row)
+    return row
+
+
+def sweep_index(db, args):
+    params = db.index_params()
+    ids, vectors = load_vectors(db.database._collection)
+    query_vectors = sample_queries(vectors, args.queries, args.seed)
+    grid = SweepGrid(
+        space=params['space'],
+        m_values=args.m,
+        construction_efs=args.construction_ef,
+        search_efs=args.search_ef,
+    )
+    rows = sweep(ids, vectors, query_vectors, args.k, grid)
+    print(f'In-memory copies ({len(ids)} chunks, recall@{args.k}):')
+    for row in rows:
+        _print_row(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=(
+            'Maintain the HNSW index of the Chroma collection from the '
+            'stored vectors, without calling the embedding API.'
+        )
+    )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='rebuild and compact the collection with the vector_store.hnsw '
+        'settings',
+    )
+    parser.add_argument(
+        '--evaluate',
+        action='store_true',
+        help='report recall against exact search and query latency',
+    )
+    parser.add_argument(
+        '--sweep',
+        action='store_true',
+        help='evaluate in-memory copies built with the parameters below',
+    )
+    parser.add_argument('--m', type=int, nargs='+', default=[16])
+    parser.add_argument(
+        '--construction-ef', type=int, nargs='+', default=[100]
+    )
+    parser.add_argument(
+        '--search-ef', type=int, nargs='+', default=[10, 50, 100]
+    )
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if not (args.rebuild or args.evaluate or args.sweep):
+        parser.error('choose at least one of --rebuild, --evaluate, --sweep')
+
+    results = {'configured': hnsw_settings()}
+    db = Database(backend='chroma')
+    try:
+        if args.rebuild:
+            print('Rebuilding index...')
+            results['rebuild'] = rebuild_index(db)
+        if args.evaluate:
+            results['evaluate'] = evaluate_index(
+                db, args.queries, args.k, args.seed
+            )
+        if args.sweep:
+            results['sweep'] = sweep_index(db, args)
+    finally:
+        db.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results written to {args.json}')
@@ -1,24 +1,93 @@
-from src.core.database import clear_database, add_to_chroma
-from src.core.loader import load_pdf_directory, split_documents
-import time
+import argparse
+
+from src.core.artifact import export_index, import_index
+from src.core.database import clear_database, convert_to_numpy
+from src.core.indexer import index_directory
+
+
 def populate_database():
-    documents = load_pdf_directory()
-    chunks = split_documents(documents)
-    add_to_chroma(chunks)
-    print('Database populated!')
+    stats = index_directory()
+    print(f'Database populated! {stats}')
+
 
 def clear_db():
     clear_database()
     print('Database cleared!')
 
+
+def convert_db(quantize):
+    count = convert_to_numpy(quantize)
+    print(f'Converted {count} chunks to the NumPy vector store!')
+
+
+def export_db(path):
+    stats = export_index(path)
+    print(
+        f'Exported {stats["chunks"]} chunks to {path} '
+        f'({stats["size"]} bytes, sha256 {stats["sha256"]})'
+    )
+
+
+def import_db(path):
+    stats = import_index(path)
+    print(
+        f'Imported {stats["chunks"]} chunks from {path} '
+        f'in {stats["seconds"]:.1f}s'
+    )
+
+
 if __name__ == '__main__':
-    print('Clearing database...')
-    print('This may take a while...')
-    clear_db()
-    time.sleep(5)
-    clear_db()
-    time.sleep(5)
+    parser = argparse.ArgumentParser(
+        description='Incrementally index the PDFs in docs/ into Chroma.'
+    )
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='clear the collection and index every document from scratch',
+    )
+    parser.add_argument(
+        '--to-numpy',
+        action='store_true',
+        help='copy the Chroma collection into the NumPy vector store',
+    )
+    parser.add_argument(
+        '--quantize',
+        action='store_true',
+        default=None,
+        help='store int8 vectors when converting with --to-numpy',
+    )
+    parser.add_argument(
+        '--export',
+        metavar='PATH',
+        help='package the collection into a checksummed .tar.gz artifact',
+    )
+    parser.add_argument(
+        '--import',
+        dest='import_path',
+        metavar='PATH',
+        help='replace the collection with an artifact, without embedding',
+    )
+    args = parser.parse_args()
+
+    if args.export:
+        print('Exporting database...')
+        export_db(args.export)
+        raise SystemExit(0)
+
+    if args.import_path:
+        print('Importing database...')
+        import_db(args.import_path)
+        raise SystemExit(0)
+
+    if args.to_numpy:
+        print('Converting database...')
+        convert_db(args.quantize)
+        raise SystemExit(0)
+
+    if args.rebuild:
+        print('Clearing database...')
+        clear_db()
     print('Populating database...')
-    print('This may take a while...')
+    print('Only new or changed pages are embedded.')
     populate_database()
-    print('Done!')
\ No newline at end of file
+    print('Done!')
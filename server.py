@@ -0,0 +1,181 @@
+"""ASGI server that streams Iracema's answers over Server-Sent Events.
+
+Every request shares the same retriever and assistants (LLM clients and
+prompt chains), created when the server starts; an assistant whose YAML
+file changes is rebuilt without restarting.
+
+Run with `task serve` or `uvicorn server:app`.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import uuid
+
+try:
+    __import__('pysqlite3')
+    import sys
+
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+except ImportError:
+    pass
+
+from langchain_core.messages import AIMessage, HumanMessage
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from starlette.routing import Route
+
+from src.config.assistant_config import IeeeAssistant, get_shared_assistant
+from src.core.gateway import GatewayOverloadedError, get_gateway
+from src.core.retriever import get_retriever
+from src.core.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+_ROLES = {'human': HumanMessage, 'user': HumanMessage, 'ai': AIMessage}
+
+
+def format_event(event: str, data: dict) -> str:
+    """
+    Formats one Server-Sent Event.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+def parse_history(history: list) -> list:
+    """
+    Converts `[{"role": "human" | "ai", "content": ...}]` into messages.
+
+    Raises:
+        ValueError: If a message has an unknown role.
+    """
+    messages = []
+    for message in history or []:
+        role = str(message.get('role', '')).lower()
+        if role not in _ROLES:
+            raise ValueError(f'Invalid role: {role}')
+        messages.append(_ROLES[role](content=message.get('content', '')))
+    return messages
+
+
+async def stream_answer(
+    request: Request,
+    assistant: IeeeAssistant,
+    question: str,
+    history: list,
+    session_id: str,
+):
+    """
+    Streams the answer of a shared assistant as SSE events. If the client
+    disconnects, the generation is cancelled so it stops using quota.
+    """
+    answer = assistant.arun_assistant(question, history, session_id)
+    try:
+        async for piece in answer:
+            if await request.is_disconnected():
+                logger.info(
+                    'Client disconnected, cancelling session %s', session_id
+                )
+                break
+            yield format_event('token', {'text': piece})
+        else:
+            yield format_event('done', {'session_id': session_id})
+    except asyncio.CancelledError:
+        logger.info('Request cancelled, stopping session %s', session_id)
+        raise
+    except GatewayOverloadedError as e:
+        logger.warning(
+            'Model gateway overloaded, session %s: %s', session_id, e
+        )
+        yield format_event(
+            'error',
+            {'message': 'Service overloaded', 'retry_after': e.retry_after},
+        )
+    except Exception:
+        logger.exception('An error occurred while generating the answer')
+        yield format_event('error', {'message': 'Generation failed'})
+    finally:
+        await answer.aclose()
+
+
+async def chat(request: Request):
+    """
+    POST /chat with `{"question": str, "history": [...], "session_id": str,
+    "assistant": str}`; `assistant` picks one of the configured assistants
+    and defaults to the main one. Responds with a `text/event-stream` of
+    `token` events followed by one `done` (or `error`) event, or with 503
+    when the model gateway is already refusing calls.
+    """
+    try:
+        body = await request.json()
+        question = str(body['question']).strip()
+        history = parse_history(body.get('history'))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return JSONResponse({'error': f'Invalid request: {e}'}, 400)
+    if not question:
+        return JSONResponse({'error': 'Empty question'}, 400)
+    gateway = get_gateway()
+    if gateway.saturated():
+        return JSONResponse(
+            {'error': 'Service overloaded'},
+            503,
+            headers={'Retry-After': str(math.ceil(gateway.retry_after()))},
+        )
+    try:
+        # The version current now is kept until the answer ends
+        assistant = get_shared_assistant(body.get('assistant'))
+    except KeyError as e:
+        return JSONResponse({'error': e.args[0]}, 404)
+
+    session_id = str(body.get('session_id') or uuid.uuid4())
+    history.append(HumanMessage(content=question))
+    return StreamingResponse(
+        stream_answer(request, assistant, question, history, session_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+async def health(request: Request):
+    """
+    GET /health, used by load balancers.
+    """
+    return JSONResponse({'status': 'ok'})
+
+
+async def metrics(request: Request):
+    """
+    GET /metrics, stage latencies and model gateway queues in the
+    Prometheus text format.
+    """
+    return PlainTextResponse(
+        get_tracer().to_prometheus() + get_gateway().to_prometheus(),
+        media_type='text/plain; version=0.0.4',
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    # One retriever and set of assistants for the whole process
+    await asyncio.to_thread(get_shared_assistant)
+    await asyncio.to_thread(get_retriever)
+    logger.info('Assistant initialized!')
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
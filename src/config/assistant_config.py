@@ -1,24 +1,39 @@
 """This module contains the IeeeAssistant class, which initializes and manages
 the configuration and execution of an assistant model."""
 
+import asyncio
 import dataclasses
+import hashlib
+import json
 import os
-from typing import Any, Dict, List
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from dotenv import load_dotenv
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chat_models.base import BaseChatModel
 from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import (
     ChatPromptTemplate,
     HumanMessagePromptTemplate,
     PromptTemplate,
     SystemMessagePromptTemplate,
 )
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-from src.core.retriever import Retriever
-from src.core.utils import read_yaml_file
+from src.core.answer_cache import get_answer_cache
+from src.core.context import (
+    document_tokens,
+    estimate_tokens,
+    get_context_assembler,
+)
+from src.core.dedupe import cite_occurrences
+from src.core.embeddings import get_embedding_function
+from src.core.gateway import get_gateway
+from src.core.retriever import get_retriever
+from src.core.tracing import get_tracer
+from src.core.utils import Shared, get_settings, read_yaml_file
 
 load_dotenv()
 
@@ -55,6 +70,9 @@ class IeeeAssistant:
         llm_model (str): Language model identifier.
         llm_temperature (float): Temperature setting for the language model.
         tools (Any): Tools configuration.
+        name (Optional[str]): Name of the assistant in the registry.
+        cache_scope (str): The name and a digest of the assistant
+        configuration, which scopes its answers in the answer cache.
 
     Methods:
         get_configs(config_path: str) -> List[dict[str, Any]]:
@@ -76,10 +94,19 @@ class IeeeAssistant:
 
         run_assistant(inputs: str):
             Runs the assistant with the given input and retrieves the response.
+
+        arun_assistant(inputs: str):
+            Asynchronous, streaming version of `run_assistant`.
     """
 
-    def __init__(self):
-        self.configs = self.get_configs(config_path=ASSISTANT_CONFIG_PATH)
+    def __init__(
+        self,
+        configs: Optional[List[Dict[str, Any]]] = None,
+        name: Optional[str] = None,
+    ):
+        if configs is None:
+            configs = self.get_configs(config_path=ASSISTANT_CONFIG_PATH)
+        self.configs = configs
         self.assistant_config = self.get_assistant_config()
         self.llm_config = LlmConfig(
             sys_prompt=self.assistant_config.get('system_message'),
@@ -87,6 +114,13 @@ class IeeeAssistant:
             temperature=self.assistant_config.get('temperature'),
         )
         self.tools = self.assistant_config.get('tools')
+        self.name = name
+        digest = hashlib.sha256(
+            json.dumps(
+                self.assistant_config, sort_keys=True, default=str
+            ).encode('utf-8')
+        ).hexdigest()
+        self.cache_scope = f'{name or ""}:{digest[:16]}'
 
     @staticmethod
     def get_configs(config_path: str) -> List[Dict[str, Any]]:
@@ -121,7 +155,8 @@ class IeeeAssistant:
     @staticmethod
     def documents_retriever(query: str) -> list[Document]:
         """
-        Retrieve documents based on the given query.
+        Retrieve documents based on the given query, using the retriever
+        shared by the whole process.
 
         Args:
             query (str): The search query to retrieve documents.
@@ -129,7 +164,7 @@ class IeeeAssistant:
         Returns:
             list: A list of documents retrieved based on the query.
         """
-        docs = Retriever().query_rag(query)
+        docs = get_retriever().query_rag(query)
         return docs
 
     def get_assistant_config(self) -> List[dict[str, Any]]:
@@ -147,10 +182,9 @@ class IeeeAssistant:
         """
         Returns the appropriate LLM model instance based on the configuration.
 
-        If the model specified in the configuration is 'gemini', it returns an
-        instance
-        of ChatGoogleGenerativeAI with the specified model and temperature
-        settings.
+        If the model specified in the configuration is 'gemini', it returns the
+        process-wide ChatGoogleGenerativeAI client with the specified model
+        and temperature settings, whose calls go through the model gateway.
         Otherwise, it raises a ValueError indicating that the model is invalid
         or not supported.
 
@@ -162,24 +196,23 @@ class IeeeAssistant:
             or not supported.
         """
         if 'gemini' in self.llm_config.model:
-            return ChatGoogleGenerativeAI(
-                model=f'{self.llm_config.model}',
-                temperature=self.llm_config.temperature,
+            return get_gateway().chat_model(
+                f'{self.llm_config.model}', self.llm_config.temperature
             )
         else:
             raise ValueError(
                 f'Invalid LLM model: {self.llm_config.model}, or not supported'
             )
 
-    def get_assistant(self):
+    def get_assistant(self, llm: Optional[BaseChatModel] = None):
         """
         Initializes the assistant by setting up the language model (LLM) and
         creating a prompt template.
 
         This method performs the following steps:
 
-        1. Retrieves the LLM model using the `get_llm_model` method and
-        assigns it to `self._llm`.
+        1. Retrieves the LLM model using the `get_llm_model` method, unless
+        an already created `llm` is given, and assigns it to `self._llm`.
 
         2. Constructs a list of message templates for the assistant's prompt,
         including system and human message templates.
@@ -196,7 +229,8 @@ class IeeeAssistant:
             None
         """
         if not hasattr(self, 'assistant') or not hasattr(self, '_llm'):
-            llm = self.get_llm_model()
+            if llm is None:
+                llm = self.get_llm_model()
             self._llm = llm
 
             messages = [
@@ -219,15 +253,27 @@ class IeeeAssistant:
                 self._llm, _prompt, document_prompt=_document_prompt
             )
 
-    def run_assistant(self, inputs: str, chat_history):
+    def run_assistant(
+        self, inputs: str, chat_history, session_id: Optional[str] = None
+    ):
         """
         Runs the assistant with the given input string.
 
         This method retrieves relevant documents based on the input string and
-        invokes the assistant with the input and the retrieved context.
+        invokes the assistant with the input and the retrieved context. The
+        context and chat history are trimmed to the token budget of the
+        `context` settings first.
+
+        Questions that open a conversation are looked up in the shared
+        answer cache first; a hit is replayed through the same streaming
+        interface instead of calling the LLM.
 
         Args:
             inputs (str): The input string to process.
+            chat_history (List[BaseMessage]): The conversation so far.
+            session_id (Optional[str]): Identifies the conversation whose
+            rolling history summary is reused. Defaults to the identity of
+            the `chat_history` list.
 
         Returns:
             The response from the assistant.
@@ -237,14 +283,342 @@ class IeeeAssistant:
         """
         if not hasattr(self, 'assistant'):
             raise ValueError('Assistant not initialized')
-        docs = self.documents_retriever(inputs)
-        # print('Contexto:', docs)
+        tracer = get_tracer()
+        with tracer.trace():
+            started_at = time.perf_counter()
+            with tracer.span('assistant.retrieve'):
+                docs = self.documents_retriever(inputs)
+            # print('Contexto:', docs)
+
+            answer_cache, chunk_ids = self._answer_cache_for(
+                chat_history, docs
+            )
+            if answer_cache is not None:
+                cached = self._lookup_answer(
+                    answer_cache, inputs, chunk_ids, self.cache_scope
+                )
+                if cached is not None:
+                    return answer_cache.replay(cached)
+
+            response = tracer.trace_stream(
+                self.assistant.stream(
+                    self._prompt_inputs(inputs, chat_history, session_id, docs)
+                ),
+                started_at,
+            )
 
-        response = self.assistant.stream({
-            'input': inputs,
-            'context': docs,
-            'chat_history': chat_history,
-        })
+        if answer_cache is not None:
+            response = answer_cache.record(
+                inputs, chunk_ids, response, started_at, self.cache_scope
+            )
 
         # print(response)
         return response
+
+    async def arun_assistant(
+        self, inputs: str, chat_history, session_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronous version of `run_assistant`, for serving many
+        conversations from one event loop.
+
+        Retrieval runs on a worker thread and the answer is streamed with
+        the chain's `astream`, so the event loop is never blocked. Closing
+        the returned generator (e.g. when the client disconnects) cancels
+        the generation.
+
+        Args:
+            inputs (str): The input string to process.
+            chat_history (List[BaseMessage]): The conversation so far.
+            session_id (Optional[str]): Identifies the conversation whose
+            rolling history summary is reused.
+
+        Yields:
+            str: Pieces of the response.
+
+        Raises:
+            ValueError: If the assistant is not initialized.
+        """
+        if not hasattr(self, 'assistant'):
+            raise ValueError('Assistant not initialized')
+        tracer = get_tracer()
+        replay = None
+        with tracer.trace():
+            started_at = time.perf_counter()
+            with tracer.span('assistant.retrieve'):
+                docs = await get_retriever().aquery_rag(inputs)
+
+            answer_cache, chunk_ids = self._answer_cache_for(
+                chat_history, docs
+            )
+            if answer_cache is not None:
+                cached = await asyncio.to_thread(
+                    self._lookup_answer,
+                    answer_cache,
+                    inputs,
+                    chunk_ids,
+                    self.cache_scope,
+                )
+                if cached is not None:
+                    replay = answer_cache.replay(cached)
+
+            if replay is None:
+                response = tracer.atrace_stream(
+                    self.assistant.astream(
+                        self._prompt_inputs(
+                            inputs, chat_history, session_id, docs
+                        )
+                    ),
+                    started_at,
+                )
+
+        if replay is not None:
+            for piece in replay:
+                yield piece
+            return
+
+        if answer_cache is not None:
+            response = answer_cache.arecord(
+                inputs, chunk_ids, response, started_at, self.cache_scope
+            )
+        async for piece in response:
+            yield piece
+
+    @staticmethod
+    def _answer_cache_for(chat_history, docs):
+        """
+        Returns the answer cache with the retrieved chunk IDs, or Nones when
+        the cache does not apply.
+
+        Only questions that open a conversation are cached, since follow-up
+        answers depend on the chat history.
+        """
+        answer_cache = get_answer_cache()
+        first_turn = not any(
+            isinstance(message, AIMessage) for message in chat_history or []
+        )
+        if answer_cache is None or not first_turn or not docs:
+            return None, None
+        return answer_cache, [doc.metadata.get('id') for doc in docs]
+
+    @staticmethod
+    def _lookup_answer(answer_cache, inputs: str, chunk_ids, scope: str):
+        # Embeddings are cached, so this never embeds the query twice
+        embed = get_embedding_function().embed_query
+        with get_tracer().span('assistant.answer_cache') as span:
+            cached = answer_cache.lookup(inputs, embed, chunk_ids, scope)
+            span['cache_hit'] = cached is not None
+        if cached is not None:
+            stats = answer_cache.stats()
+            print(
+                f'Answer cache hit ({stats["hit_rate"]:.0%} hit rate, '
+                f'{stats["latency_saved"]:.1f}s saved so far)'
+            )
+        return cached
+
+    @staticmethod
+    def _prompt_inputs(
+        inputs: str, chat_history, session_id: Optional[str], docs
+    ) -> Dict[str, Any]:
+        with get_tracer().span('assistant.context') as span:
+            context, history = get_context_assembler().assemble(
+                docs, chat_history, inputs, session_id or str(id(chat_history))
+            )
+            context = cite_occurrences(context)
+            span['chunks'] = len(context)
+            span['prompt_tokens'] = sum(
+                map(document_tokens, context)
+            ) + estimate_tokens(history)
+        return {
+            'input': inputs,
+            'context': context,
+            'chat_history': history,
+        }
+
+
+class AssistantRegistry:
+    """
+    Process-wide registry of the assistants configured in a directory.
+
+    Every YAML file with a `config` section defines one assistant, named by
+    its `assistant_name` key (or the file name). The files are parsed once;
+    afterwards their modification times are checked at most every
+    `reload_interval` seconds and a changed file is compiled into a new
+    IeeeAssistant (prompt template and chain) that atomically replaces the
+    previous one. Requests already streaming keep the assistant they
+    started with. Assistants with the same model and temperature share one
+    LLM client. The new version has another `cache_scope`, so the answers
+    cached for the previous one are not replayed.
+
+    Only the assistant definitions are reloaded; the other settings
+    sections are still read once per process.
+
+    Attributes:
+        config_dir (str): Directory with the assistant YAML files.
+        default_path (str): File of the assistant returned by default.
+        reload_interval (float): Minimum seconds between two checks of the
+        modification times; 0 checks on every call and a negative value
+        disables reloading.
+    """
+
+    def __init__(
+        self,
+        config_dir: str = os.path.dirname(ASSISTANT_CONFIG_PATH),
+        default_path: str = ASSISTANT_CONFIG_PATH,
+        reload_interval: float = 2.0,
+    ):
+        self.config_dir = config_dir
+        self.default_path = os.path.normpath(default_path)
+        self.reload_interval = reload_interval
+        # path -> (mtime, name, assistant), replaced as a whole on reload
+        self._entries: Dict[str, tuple] = {}
+        self._llms: Dict[tuple, BaseChatModel] = {}
+        # path -> mtime of a version that failed to load
+        self._failed: Dict[str, float] = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _modification_times(self) -> Dict[str, float]:
+        times = {}
+        for entry in os.scandir(self.config_dir):
+            if entry.is_file() and entry.name.endswith('.yaml'):
+                times[os.path.normpath(entry.path)] = entry.stat().st_mtime
+        return times
+
+    def _llm_for(self, assistant: IeeeAssistant) -> BaseChatModel:
+        key = (assistant.llm_config.model, assistant.llm_config.temperature)
+        if key not in self._llms:
+            self._llms[key] = assistant.get_llm_model()
+        return self._llms[key]
+
+    def _build(self, path: str) -> Optional[tuple]:
+        config = read_yaml_file(path) or {}
+        if not config.get('config'):
+            return None
+        name = config.get('assistant_name') or os.path.splitext(
+            os.path.basename(path)
+        )[0]
+        assistant = IeeeAssistant(configs=[config], name=name)
+        assistant.get_assistant(llm=self._llm_for(assistant))
+        return name, assistant
+
+    def reload(self, force: bool = False) -> List[str]:
+        """
+        Compiles the assistants whose file was added or changed since the
+        last check and drops those whose file was removed. A file that
+        fails to load keeps its previous assistant.
+
+        Args:
+            force (bool): Check now, even within `reload_interval`.
+
+        Returns:
+            List[str]: Names of the assistants (re)built.
+        """
+        now = time.monotonic()
+        checked_at = self._checked_at
+        if not force and checked_at is not None and (
+            self.reload_interval < 0
+            or now - checked_at < self.reload_interval
+        ):
+            return []
+        with self._lock:
+            if not force and self._checked_at != checked_at:
+                return []
+            self._checked_at = now
+            times = self._modification_times()
+            entries = {
+                path: entry
+                for path, entry in self._entries.items()
+                if path in times
+            }
+            rebuilt = []
+            for path, mtime in sorted(times.items()):
+                previous = entries.get(path)
+                if self._failed.get(path) == mtime or (
+                    previous is not None and previous[0] == mtime
+                ):
+                    continue
+                try:
+                    built = self._build(path)
+                except Exception as e:
+                    print(f'An error occurred while loading {path}: {e}')
+                    self._failed[path] = mtime
+                    continue
+                self._failed.pop(path, None)
+                if built is None:
+                    entries.pop(path, None)
+                    continue
+                entries[path] = (mtime, *built)
+                rebuilt.append(built[0])
+            self._entries = entries
+        if rebuilt and checked_at is not None:
+            print(f'Reloaded assistants: {", ".join(rebuilt)}')
+        return rebuilt
+
+    def names(self) -> List[str]:
+        """
+        Returns the names of the loaded assistants.
+        """
+        self.reload()
+        return [name for _, name, _ in self._entries.values()]
+
+    def get(self, name: Optional[str] = None) -> IeeeAssistant:
+        """
+        Returns the current version of an assistant.
+
+        Args:
+            name (Optional[str]): The `assistant_name`; defaults to the
+            assistant of `default_path`.
+
+        Returns:
+            IeeeAssistant: The initialized assistant. It is shared and must
+            be treated as read-only.
+
+        Raises:
+            KeyError: If no assistant has that name.
+        """
+        self.reload()
+        entries = self._entries
+        if name is None:
+            if self.default_path in entries:
+                return entries[self.default_path][2]
+            raise KeyError(f'Assistant not found: {self.default_path}')
+        for _, entry_name, assistant in entries.values():
+            if entry_name == name:
+                return assistant
+        raise KeyError(f'Assistant not found: {name}')
+
+
+_shared_registry = Shared()
+
+
+def get_assistant_registry() -> AssistantRegistry:
+    """
+    Returns the process-wide AssistantRegistry configured by the
+    `assistant_registry` settings.
+    """
+    return _shared_registry.get(_create_assistant_registry)
+
+
+def _create_assistant_registry() -> AssistantRegistry:
+    settings = get_settings('assistant_registry')
+    return AssistantRegistry(
+        reload_interval=settings.get('reload_interval', 2.0)
+    )
+
+
+def get_shared_assistant(name: Optional[str] = None) -> IeeeAssistant:
+    """
+    Returns the current version of a shared assistant, with its LLM client
+    and prompt chain already built. The instance is shared by every session
+    and request, so it must be treated as read-only: per-conversation state
+    travels in the arguments of `run_assistant`.
+
+    Args:
+        name (Optional[str]): The `assistant_name`; defaults to the assistant
+        of ASSISTANT_CONFIG_PATH.
+
+    Returns:
+        IeeeAssistant: The shared, initialized assistant.
+    """
+    return get_assistant_registry().get(name)
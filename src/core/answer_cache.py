@@ -0,0 +1,279 @@
+import dataclasses
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+import numpy as np
+
+from src.core.database import get_corpus_version
+from src.core.utils import Shared, get_settings
+
+_REPLAY_PIECES = re.compile(r'\S+\s*|\s+')
+
+
+@dataclasses.dataclass
+class CachedAnswer:
+    """
+    CachedAnswer holds one generated answer and what it was generated from.
+
+    Attributes:
+        query (str): The question that produced the answer.
+        scope (str): The assistant version that generated it.
+        vector (Optional[np.ndarray]): The normalized query embedding, or
+        None until a lookup needs it.
+        chunk_ids (frozenset): IDs of the chunks retrieved for the question.
+        answer (str): The full generated answer.
+        corpus_version (str): Corpus version stamp at generation time.
+        latency (float): Seconds it took to retrieve and generate the answer.
+    """
+
+    query: str
+    scope: str
+    vector: Optional[np.ndarray]
+    chunk_ids: frozenset
+    answer: str
+    corpus_version: str
+    latency: float
+
+
+class AnswerCache:
+    """
+    Semantic cache of generated answers, keyed on the query embedding.
+
+    A question is answered from the cache when its cosine similarity to a
+    cached question reaches `similarity_threshold`, the retriever returned
+    the same chunk IDs for both and both were asked in the same scope (see
+    `IeeeAssistant.cache_scope`), so answers written by another assistant or
+    under an older prompt, model or temperature are never replayed. Every
+    entry is tied to the corpus version stamp written by `add_to_chroma`, so
+    the cache empties itself as soon as the collection changes.
+
+    Answers are stored without embedding their question, so answers served
+    by the lexical fast path stay embedding-free. Questions are embedded by
+    the first lookup that retrieved the same chunk IDs, which is the only
+    time the vectors are compared.
+
+    Attributes:
+        similarity_threshold (float): Minimum cosine similarity for a hit.
+        max_entries (int): Maximum number of cached answers.
+    """
+
+    def __init__(
+        self, similarity_threshold: float = 0.95, max_entries: int = 256
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._corpus_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _check_version(self) -> str:
+        version = get_corpus_version()
+        if version != self._corpus_version:
+            self._entries.clear()
+            self._corpus_version = version
+        return version
+
+    def lookup(
+        self,
+        query: str,
+        embed: Callable[[str], List[float]],
+        chunk_ids: Iterable[str],
+        scope: str = '',
+    ) -> Optional[CachedAnswer]:
+        """
+        Looks for a cached answer to a semantically equivalent question.
+
+        Args:
+            query (str): The question.
+            embed (Callable[[str], List[float]]): Embeds a question. It is
+            only called when an entry was cached for the same chunks, so
+            retrievals that did not embed the query stay embedding-free.
+            chunk_ids (Iterable[str]): IDs of the chunks retrieved for the
+            query.
+            scope (str): The assistant version asked.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None on a miss.
+        """
+        chunk_ids = frozenset(chunk_ids)
+        with self._lock:
+            self._check_version()
+            candidates = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if entry.scope == scope and entry.chunk_ids == chunk_ids
+            ]
+        query_vector = self._normalize(embed(query)) if candidates else None
+        for _, entry in candidates:
+            if entry.vector is None:
+                entry.vector = self._normalize(embed(entry.query))
+        with self._lock:
+            best, best_score = None, self.similarity_threshold
+            for key, entry in candidates:
+                if key not in self._entries:
+                    continue
+                score = float(np.dot(query_vector, entry.vector))
+                if score >= best_score:
+                    best, best_score = key, score
+
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            entry = self._entries[best]
+            self.hits += 1
+            self.latency_saved += entry.latency
+            return entry
+
+    def store(
+        self,
+        query: str,
+        chunk_ids: Iterable[str],
+        answer: str,
+        latency: float,
+        scope: str = '',
+    ):
+        """
+        Adds a generated answer to the cache. The question is embedded by
+        the first lookup that needs it.
+
+        Args:
+            query (str): The question.
+            chunk_ids (Iterable[str]): IDs of the retrieved chunks.
+            answer (str): The full generated answer.
+            latency (float): Seconds spent retrieving and generating it.
+            scope (str): The assistant version that generated it.
+        """
+        key = (scope, query)
+        with self._lock:
+            version = self._check_version()
+            self._entries[key] = CachedAnswer(
+                query=query,
+                scope=scope,
+                vector=None,
+                chunk_ids=frozenset(chunk_ids),
+                answer=answer,
+                corpus_version=version,
+                latency=latency,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def replay(entry: CachedAnswer) -> Iterator[str]:
+        """
+        Streams a cached answer word by word, through the same generator
+        interface as the assistant chain.
+
+        Args:
+            entry (CachedAnswer): The cached answer to replay.
+
+        Yields:
+            str: Pieces of the answer.
+        """
+        yield from _REPLAY_PIECES.findall(entry.answer)
+
+    def record(
+        self,
+        query: str,
+        chunk_ids: Iterable[str],
+        stream: Iterable[str],
+        started_at: float,
+        scope: str = '',
+    ) -> Iterator[str]:
+        """
+        Passes a response stream through unchanged and caches the answer once
+        the stream has been fully consumed. The question is not embedded.
+
+        Args:
+            query (str): The question.
+            chunk_ids (Iterable[str]): IDs of the retrieved chunks.
+            stream (Iterable[str]): The response stream of the assistant.
+            started_at (float): `time.perf_counter()` value taken when the
+            question was received.
+            scope (str): The assistant version that generates the answer.
+
+        Yields:
+            str: The pieces of the response stream.
+        """
+        chunk_ids = list(chunk_ids)
+        pieces = []
+        for piece in stream:
+            pieces.append(piece)
+            yield piece
+        latency = time.perf_counter() - started_at
+        self.store(query, chunk_ids, ''.join(pieces), latency, scope)
+
+    async def arecord(
+        self,
+        query: str,
+        chunk_ids: Iterable[str],
+        stream: AsyncIterator[str],
+        started_at: float,
+        scope: str = '',
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronous version of `record`. The answer is only cached if the
+        stream completes; a cancelled stream is not stored.
+        """
+        chunk_ids = list(chunk_ids)
+        pieces = []
+        async for piece in stream:
+            pieces.append(piece)
+            yield piece
+        latency = time.perf_counter() - started_at
+        self.store(query, chunk_ids, ''.join(pieces), latency, scope)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hit rate and the generation time saved by the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'latency_saved': self.latency_saved,
+                'entries': len(self._entries),
+            }
+
+
+_shared_cache = Shared()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """
+    Returns the process-wide answer cache configured by the `answer_cache`
+    settings, or None if the cache is disabled.
+    """
+    settings = get_settings('answer_cache')
+    if not settings.get('enabled', True):
+        return None
+    return _shared_cache.get(
+        lambda: AnswerCache(
+            similarity_threshold=settings.get('similarity_threshold', 0.95),
+            max_entries=settings.get('max_entries', 256),
+        )
+    )
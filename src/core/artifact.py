@@ -0,0 +1,261 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.core.database import (
+    LEXICAL_INDEX_FILE,
+    Database,
+    EmbeddingModelMismatchError,
+    bump_corpus_version,
+    clear_database,
+    get_corpus_version,
+)
+from src.core.docstore import PAGE_STORE_FILE
+from src.core.embeddings import get_embedding_function
+from src.core.indexer import DUPLICATE_INDEX_FILE, MANIFEST_FILE
+from src.core.router import ROUTER_FILE
+
+ARTIFACT_FORMAT = 1
+MANIFEST_MEMBER = 'manifest.json'
+VECTORS_MEMBER = 'vectors.npy'
+RECORDS_MEMBER = 'records.json'
+# Files kept beside the collection, so incremental indexing, BM25, routing
+# and page expansion work right after an import
+SIDECAR_FILES = (
+    LEXICAL_INDEX_FILE,
+    MANIFEST_FILE,
+    DUPLICATE_INDEX_FILE,
+    ROUTER_FILE,
+    PAGE_STORE_FILE,
+)
+
+
+class InvalidArtifactError(ValueError):
+    """
+    Raised when an index artifact is corrupted or has an unknown format.
+    """
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def corpus_hash(
+    ids: List[str], documents: List[str], metadatas: List[dict]
+) -> str:
+    """
+    Returns a digest of the indexed chunks (IDs, texts and metadata) that
+    does not depend on their storage order.
+    """
+    digest = hashlib.sha256()
+    for chunk_id, document, metadata in sorted(
+        zip(ids, documents, metadatas), key=lambda item: item[0]
+    ):
+        digest.update(
+            json.dumps(
+                [chunk_id, document, metadata],
+                ensure_ascii=False,
+                sort_keys=True,
+            ).encode('utf-8')
+        )
+    return digest.hexdigest()
+
+
+def export_index(
+    path: str, db: Optional[Database] = None, batch_size: int = 1000
+) -> Dict[str, Any]:
+    """
+    Packages the collection into one compressed, checksummed artifact: the
+    vectors, documents, metadata and chunk IDs, the embedding model and
+    dimension, a corpus hash and the BM25, manifest, near-duplicate, router
+    and page store files kept beside the collection. The SHA-256 of every
+    member is recorded in the artifact's manifest, and the SHA-256 of the
+    artifact in `<path>.sha256`.
+
+    Args:
+        path (str): The artifact file (.tar.gz) to write.
+        db (Optional[Database]): The database to export, defaults to the
+        configured one.
+        batch_size (int): Chunks read per call from Chroma.
+
+    Returns:
+        Dict[str, Any]: The artifact manifest, with its size in bytes, its
+        SHA-256 and the seconds taken.
+    """
+    started_at = time.perf_counter()
+    owned = db is None
+    db = db or Database()
+    try:
+        ids, vectors, documents, metadatas = db.read_all(batch_size)
+        embedding_model = db._embedding_model()
+        hnsw = db.index_params()
+    finally:
+        if owned:
+            db.close()
+
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(vectors, dtype=np.float32))
+    members = {
+        VECTORS_MEMBER: buffer.getvalue(),
+        RECORDS_MEMBER: json.dumps(
+            {'ids': ids, 'documents': documents, 'metadatas': metadatas},
+            ensure_ascii=False,
+        ).encode('utf-8'),
+    }
+    for sidecar in SIDECAR_FILES:
+        if os.path.exists(sidecar):
+            with open(sidecar, 'rb') as file:
+                members[os.path.basename(sidecar)] = file.read()
+
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'embedding_model': embedding_model,
+        'chunks': len(ids),
+        'hnsw': hnsw,
+        'corpus_hash': corpus_hash(ids, documents, metadatas),
+        'corpus_version': get_corpus_version(),
+        'members': {
+            name: {'sha256': _sha256(data), 'size': len(data)}
+            for name, data in members.items()
+        },
+    }
+    members = {
+        MANIFEST_MEMBER: json.dumps(manifest, indent=1).encode('utf-8'),
+        **members,
+    }
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with tarfile.open(tmp_path, 'w:gz', compresslevel=6) as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(data))
+    os.replace(tmp_path, path)
+
+    with open(path, 'rb') as file:
+        digest = hashlib.file_digest(file, 'sha256').hexdigest()
+    with open(f'{path}.sha256', 'w', encoding='utf-8') as file:
+        file.write(f'{digest}  {os.path.basename(path)}\n')
+    return {
+        **manifest,
+        'size': os.path.getsize(path),
+        'sha256': digest,
+        'seconds': time.perf_counter() - started_at,
+    }
+
+
+def _read_member(archive: tarfile.TarFile, name: str) -> bytes:
+    try:
+        return archive.extractfile(name).read()
+    except (KeyError, AttributeError) as e:
+        raise InvalidArtifactError(f'The artifact has no {name}') from e
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    """
+    Returns the manifest of an artifact without reading the rest of it.
+
+    Raises:
+        InvalidArtifactError: If the artifact has an unknown format.
+    """
+    with tarfile.open(path, 'r:gz') as archive:
+        manifest = json.loads(_read_member(archive, MANIFEST_MEMBER))
+    if manifest.get('format') != ARTIFACT_FORMAT:
+        raise InvalidArtifactError(
+            f'Unknown artifact format: {manifest.get("format")}'
+        )
+    return manifest
+
+
+def import_index(
+    path: str, backend: Optional[str] = None, batch_size: int = 5000
+) -> Dict[str, Any]:
+    """
+    Replaces the collection with the contents of an artifact written by
+    `export_index`. The stored vectors are bulk loaded, so nothing is
+    embedded. Run it while nothing is serving from CHROMA_PATH.
+
+    The artifact is checked before anything is deleted: its embedding model
+    must be the one `get_embedding_function` is configured for, and every
+    member must match its checksum.
+
+    Args:
+        path (str): The artifact file.
+        backend (Optional[str]): 'chroma' or 'numpy', defaults to the
+        `vector_store` settings.
+        batch_size (int): Chunks written per call to Chroma.
+
+    Returns:
+        Dict[str, Any]: The artifact manifest and the seconds taken.
+
+    Raises:
+        EmbeddingModelMismatchError: If the artifact was built with another
+        embedding model or dimension.
+        InvalidArtifactError: If the artifact is corrupted.
+    """
+    started_at = time.perf_counter()
+    manifest = read_manifest(path)
+    embeddings = get_embedding_function()
+    configured = {
+        'model': getattr(embeddings, 'model', None),
+        'dimension': getattr(embeddings, 'dimension', None),
+    }
+    recorded = manifest['embedding_model']
+    if recorded != configured:
+        raise EmbeddingModelMismatchError(
+            f'The artifact was built with {recorded["model"]} '
+            f'({recorded["dimension"]} dimensions), but the configured '
+            f'embeddings are {configured["model"]} '
+            f'({configured["dimension"]} dimensions).'
+        )
+
+    members = {}
+    with tarfile.open(path, 'r:gz') as archive:
+        for name, expected in manifest['members'].items():
+            data = _read_member(archive, name)
+            if _sha256(data) != expected['sha256']:
+                raise InvalidArtifactError(f'Checksum mismatch for {name}')
+            members[name] = data
+    vectors = np.load(io.BytesIO(members.pop(VECTORS_MEMBER)))
+    records = json.loads(members.pop(RECORDS_MEMBER))
+    ids = records['ids']
+    if not len(ids) == len(vectors) == manifest['chunks']:
+        raise InvalidArtifactError('The artifact has inconsistent counts')
+
+    clear_database()
+    db = Database(backend=backend)
+    try:
+        # The NumPy store rewrites its files on every call
+        step = max(len(ids), 1) if db.backend == 'numpy' else batch_size
+        for start in range(0, len(ids), step):
+            db.upsert(
+                ids[start : start + step],
+                [
+                    Document(page_content=document, metadata=metadata)
+                    for document, metadata in zip(
+                        records['documents'][start : start + step],
+                        records['metadatas'][start : start + step],
+                    )
+                ],
+                vectors[start : start + step],
+            )
+    finally:
+        db.close()
+
+    for sidecar in SIDECAR_FILES:
+        data = members.get(os.path.basename(sidecar))
+        if data is not None:
+            with open(sidecar, 'wb') as file:
+                file.write(data)
+    bump_corpus_version()
+    return {**manifest, 'seconds': time.perf_counter() - started_at}
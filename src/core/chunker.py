@@ -0,0 +1,193 @@
+import copy
+import dataclasses
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.core.embeddings import get_embedding_function
+from src.core.utils import get_settings
+
+SENTENCE_SPLIT_REGEX = r'(?<=[.?!])\s+'
+# Headings that always start a new chunk in the statutes and regimentos
+SECTION_SPLIT_REGEX = (
+    r'\n\s*(?=(?:Art\.|Artigo|CAP[IÍ]TULO|Cap[ií]tulo|T[IÍ]TULO|'
+    r'T[ií]tulo|SE[CÇ][AÃ]O|Se[cç][aã]o)\s)'
+)
+
+POOLING_STRATEGIES = ('mean', 'max')
+
+
+@dataclasses.dataclass(eq=False)
+class ReusingSemanticChunker:
+    """
+    Semantic chunker that keeps the sentence embeddings it computes to find
+    breakpoints and derives the chunk vectors from them, so the chunks do
+    not need to be embedded a second time.
+
+    Text is first cut locally at section headings (articles, chapters,
+    titles and sections). Segments up to `max_segment_chars` characters
+    become chunks as they are, without any embedding call; only longer
+    segments, whose inner boundaries are ambiguous, have their sentences
+    embedded and split where the distance between consecutive sentence
+    windows exceeds the `breakpoint_percentile` percentile, like
+    SemanticChunker does.
+
+    Attributes:
+        embeddings (Embeddings): The embedding function.
+        pooling (str): How sentence vectors are combined into a chunk
+        vector: 'mean' or 'max'.
+        buffer_size (int): Sentences added on each side of a sentence to
+        build the window that is embedded.
+        breakpoint_percentile (float): Percentile of the distances above
+        which a boundary becomes a breakpoint.
+        max_segment_chars (int): Longest segment kept whole without looking
+        for semantic breakpoints.
+        min_segment_chars (int): Segments shorter than this are merged with
+        the next one.
+    """
+
+    embeddings: Embeddings
+    _: dataclasses.KW_ONLY
+    pooling: str = 'mean'
+    buffer_size: int = 1
+    breakpoint_percentile: float = 95
+    max_segment_chars: int = 1000
+    min_segment_chars: int = 200
+
+    def __post_init__(self):
+        if self.pooling not in POOLING_STRATEGIES:
+            raise ValueError(f'Invalid pooling strategy: {self.pooling}')
+
+    def _pool(self, vectors: np.ndarray) -> List[float]:
+        if self.pooling == 'max':
+            pooled = vectors.max(axis=0)
+        else:
+            pooled = vectors.mean(axis=0)
+        norm = np.linalg.norm(pooled)
+        return (pooled / norm if norm else pooled).tolist()
+
+    def _windows(self, sentences: List[str]) -> List[str]:
+        windows = []
+        for index in range(len(sentences)):
+            start = max(0, index - self.buffer_size)
+            stop = index + self.buffer_size + 1
+            windows.append(' '.join(sentences[start:stop]))
+        return windows
+
+    def split_text(self, text: str) -> List[Tuple[str, Optional[List[float]]]]:
+        """
+        Splits a text into chunks.
+
+        Args:
+            text (str): The text to split.
+
+        Returns:
+            List[Tuple[str, Optional[List[float]]]]: The chunks in order,
+            each with its pooled vector, or None when the chunk was cut
+            locally and still needs to be embedded.
+        """
+        segments = []
+        for part in re.split(SECTION_SPLIT_REGEX, text):
+            segment = part.strip()
+            if not segment:
+                continue
+            # Headings and very short articles are merged with what follows
+            if segments and len(segments[-1]) < self.min_segment_chars:
+                segments[-1] = f'{segments[-1]}\n{segment}'
+            else:
+                segments.append(segment)
+        sentences_per_segment = [
+            re.split(SENTENCE_SPLIT_REGEX, segment)
+            if len(segment) > self.max_segment_chars
+            else None
+            for segment in segments
+        ]
+
+        # One embedding call for every ambiguous segment of the text
+        windows = [
+            window
+            for sentences in sentences_per_segment
+            if sentences is not None and len(sentences) > 1
+            for window in self._windows(sentences)
+        ]
+        vectors = (
+            np.asarray(self.embeddings.embed_documents(windows))
+            if windows
+            else np.empty((0, 0))
+        )
+
+        chunks = []
+        offset = 0
+        for segment, sentences in zip(segments, sentences_per_segment):
+            if sentences is None or len(sentences) == 1:
+                chunks.append((segment, None))
+                continue
+            segment_vectors = vectors[offset : offset + len(sentences)]
+            offset += len(sentences)
+            chunks.extend(self._split_segment(sentences, segment_vectors))
+        return chunks
+
+    def _split_segment(
+        self, sentences: List[str], vectors: np.ndarray
+    ) -> List[Tuple[str, List[float]]]:
+        normalized = vectors / np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        distances = 1 - np.sum(normalized[:-1] * normalized[1:], axis=1)
+        threshold = np.percentile(distances, self.breakpoint_percentile)
+        breakpoints = [
+            index for index, distance in enumerate(distances)
+            if distance > threshold
+        ]
+
+        chunks = []
+        start = 0
+        for end in [*breakpoints, len(sentences) - 1]:
+            chunks.append((
+                ' '.join(sentences[start : end + 1]),
+                self._pool(vectors[start : end + 1]),
+            ))
+            start = end + 1
+        return chunks
+
+    def split_documents(
+        self, documents: List[Document]
+    ) -> List[Tuple[Document, Optional[List[float]]]]:
+        """
+        Splits documents into chunks that keep the metadata of their
+        document.
+
+        Args:
+            documents (List[Document]): The documents to split.
+
+        Returns:
+            List[Tuple[Document, Optional[List[float]]]]: The chunks with
+            their precomputed vectors (None if the chunk must be embedded).
+        """
+        chunks = []
+        for document in documents:
+            for text, vector in self.split_text(document.page_content):
+                chunk = Document(
+                    page_content=text,
+                    metadata=copy.deepcopy(document.metadata),
+                )
+                chunks.append((chunk, vector))
+        return chunks
+
+
+def get_chunker() -> ReusingSemanticChunker:
+    """
+    Builds a ReusingSemanticChunker configured by the `chunking` settings.
+    """
+    settings = get_settings('chunking')
+    return ReusingSemanticChunker(
+        get_embedding_function(),
+        pooling=settings.get('pooling', 'mean'),
+        buffer_size=settings.get('buffer_size', 1),
+        breakpoint_percentile=settings.get('breakpoint_percentile', 95),
+        max_segment_chars=settings.get('max_segment_chars', 1000),
+        min_segment_chars=settings.get('min_segment_chars', 200),
+    )
@@ -0,0 +1,312 @@
+import dataclasses
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from src.core.utils import Shared, get_settings
+
+# Rough size of a token for Portuguese text with the Gemini tokenizer
+CHARS_PER_TOKEN = 4
+# A turn is a question and its answer
+TURN_MESSAGES = 2
+
+_WORD = re.compile(r'\w+')
+_FIRST_SENTENCE = re.compile(r'^(.+?[.?!])(?:\s|$)', re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without calling a tokenizer.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def document_tokens(document: Document) -> int:
+    """
+    Estimates the tokens a chunk takes in the prompt, including the source
+    and page rendered by the document prompt.
+    """
+    metadata = document.metadata
+    return estimate_tokens(
+        f'Documento:{metadata.get("source")}, '
+        f'pagina:{metadata.get("page")}, conteudo: {document.page_content}'
+    )
+
+
+def _parse_chunk_id(document: Document) -> Optional[Tuple[str, int]]:
+    # Chunk IDs look like "docs/file.pdf:<page>:<index>"
+    source, _, index = str(document.metadata.get('id', '')).rpartition(':')
+    if not source or not index.isdigit():
+        return None
+    return source, int(index)
+
+
+def _words(text: str) -> set:
+    return set(_WORD.findall(text.casefold()))
+
+
+def _overlap(a: set, b: set) -> float:
+    """
+    Fraction of the smaller word set contained in the other one.
+    """
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _format_message(message: BaseMessage) -> str:
+    speaker = 'Humano' if isinstance(message, HumanMessage) else 'Iracema'
+    return f'{speaker}: {message.content}'
+
+
+def _prior_messages(
+    chat_history: List[BaseMessage], query: str
+) -> List[BaseMessage]:
+    # The prompt already carries the current question
+    messages = list(chat_history or [])
+    if (
+        messages
+        and isinstance(messages[-1], HumanMessage)
+        and messages[-1].content == query
+    ):
+        messages.pop()
+    return messages
+
+
+def _summarize_turn(question: str, answer: str, max_chars: int) -> str:
+    match = _FIRST_SENTENCE.match(answer.strip())
+    gist = match.group(1) if match else answer.strip()
+    line = f'- Humano perguntou: {question.strip()} | Resposta: {gist}'
+    return line if len(line) <= max_chars else line[: max_chars - 1] + '…'
+
+
+@dataclasses.dataclass(kw_only=True, eq=False)
+class ContextAssembler:
+    """
+    Builds the `{context}` and `{chat_history}` inputs of the prompt within
+    a token budget.
+
+    Retrieved chunks are taken in rank order; a chunk is dropped when it is
+    a near duplicate of a chunk already taken, or when it is the
+    neighbour, on the same page, of a chunk already taken and mostly repeats
+    it. Chunks stop being added once `max_context_tokens` is reached.
+
+    The last `history_turns` turns of the conversation are kept verbatim.
+    Older turns are collapsed into an extractive rolling summary (each
+    question with the first sentence of its answer), which is cached per
+    session and only extended with the turns that left the window since
+    the previous request.
+
+    Attributes:
+        max_context_tokens (int): Token budget of the retrieved chunks.
+        max_history_tokens (int): Token budget of the chat history,
+        summary included.
+        history_turns (int): Number of recent turns kept verbatim.
+        summary_max_tokens (int): Token budget of the rolling summary.
+        duplicate_threshold (float): Word overlap above which two chunks
+        are near duplicates.
+        adjacent_overlap_threshold (float): Word overlap above which a chunk
+        adjacent to a taken chunk of the same page is dropped.
+        max_sessions (int): Number of session summaries kept in memory.
+    """
+
+    max_context_tokens: int = 2000
+    max_history_tokens: int = 600
+    history_turns: int = 3
+    summary_max_tokens: int = 200
+    duplicate_threshold: float = 0.8
+    adjacent_overlap_threshold: float = 0.5
+    max_sessions: int = 256
+    # session -> (number of messages summarized, summary lines)
+    _summaries: OrderedDict = dataclasses.field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def select_documents(self, documents: List[Document]) -> List[Document]:
+        """
+        Drops redundant chunks and keeps the best ranked ones that fit in
+        the context budget.
+
+        Args:
+            documents (List[Document]): Retrieved chunks, best first.
+
+        Returns:
+            List[Document]: The chunks to put in the prompt, in rank order.
+        """
+        selected = []
+        taken = []
+        used = 0
+        for document in documents:
+            words = _words(document.page_content)
+            chunk_id = _parse_chunk_id(document)
+            redundant = False
+            for other_id, other_words in taken:
+                overlap = _overlap(words, other_words)
+                adjacent = (
+                    chunk_id is not None
+                    and other_id is not None
+                    and chunk_id[0] == other_id[0]
+                    and abs(chunk_id[1] - other_id[1]) == 1
+                )
+                if overlap >= self.duplicate_threshold or (
+                    adjacent and overlap >= self.adjacent_overlap_threshold
+                ):
+                    redundant = True
+                    break
+            if redundant:
+                continue
+
+            tokens = document_tokens(document)
+            if selected and used + tokens > self.max_context_tokens:
+                break
+            selected.append(document)
+            taken.append((chunk_id, words))
+            used += tokens
+        return selected
+
+    def _summary(
+        self, session_id: str, older: List[BaseMessage], dropped: int = 0
+    ) -> List[str]:
+        with self._lock:
+            # Counted from the start of the conversation, including the
+            # `dropped` messages the history no longer has
+            summarized, lines = self._summaries.get(session_id, (0, []))
+            # The history was reset or edited: start the summary again
+            if summarized > dropped + len(older):
+                summarized, lines = 0, []
+            lines = list(lines)
+            max_chars = self.summary_max_tokens * CHARS_PER_TOKEN
+            pending = older[max(0, summarized - dropped) :]
+            for index in range(0, len(pending) - 1, 2):
+                question, answer = pending[index], pending[index + 1]
+                lines.append(
+                    _summarize_turn(
+                        question.content, answer.content, max_chars // 2
+                    )
+                )
+            summarized = max(summarized, dropped) + len(pending)
+            summarized -= len(pending) % 2
+            # Keep the most recent lines that fit in the summary budget
+            while lines and sum(len(line) + 1 for line in lines) > max_chars:
+                lines.pop(0)
+            self._summaries[session_id] = (summarized, lines)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+            return lines
+
+    def build_history(
+        self,
+        chat_history: List[BaseMessage],
+        query: str,
+        session_id: str,
+    ) -> str:
+        """
+        Renders the chat history for the prompt: a rolling summary of the
+        older turns followed by the most recent turns verbatim.
+
+        Args:
+            chat_history (List[BaseMessage]): The whole conversation.
+            query (str): The current question; it is removed from the end
+            of the history, since the prompt already carries it.
+            session_id (str): Key of the cached rolling summary.
+
+        Returns:
+            str: The rendered history, or an empty string.
+        """
+        # A SessionHistory may have dropped the oldest messages
+        dropped = getattr(chat_history, 'dropped', 0)
+        messages = _prior_messages(chat_history, query)
+
+        cut = max(0, len(messages) - TURN_MESSAGES * self.history_turns)
+        if cut < len(messages) and isinstance(messages[cut], AIMessage):
+            cut += 1
+        recent = messages[cut:]
+        lines = [_format_message(message) for message in recent]
+        # Older verbatim turns that do not fit the budget go to the summary
+        while len(lines) > TURN_MESSAGES and estimate_tokens(
+            '\n'.join(lines)
+        ) > self.max_history_tokens - self.summary_max_tokens:
+            lines = lines[TURN_MESSAGES:]
+            cut += TURN_MESSAGES
+
+        summary = (
+            self._summary(session_id, messages[:cut], dropped) if cut else []
+        )
+        parts = []
+        if summary:
+            parts.append('Resumo da conversa anterior:\n' + '\n'.join(summary))
+        parts.extend(lines)
+        return '\n'.join(parts)
+
+    def assemble(
+        self,
+        documents: List[Document],
+        chat_history: List[BaseMessage],
+        query: str,
+        session_id: str,
+    ) -> Tuple[List[Document], str]:
+        """
+        Builds the context chunks and the chat history of one request and
+        logs how many prompt tokens were saved, compared with every
+        retrieved chunk and every message of the history rendered verbatim.
+
+        Args:
+            documents (List[Document]): Retrieved chunks, best first.
+            chat_history (List[BaseMessage]): The whole conversation.
+            query (str): The current question.
+            session_id (str): Key of the cached rolling summary.
+
+        Returns:
+            Tuple[List[Document], str]: The selected chunks and the rendered
+            chat history.
+        """
+        selected = self.select_documents(documents or [])
+        history = self.build_history(chat_history, query, session_id)
+
+        full_history = '\n'.join(
+            map(_format_message, _prior_messages(chat_history, query))
+        )
+        before = sum(map(document_tokens, documents or [])) + estimate_tokens(
+            full_history
+        )
+        after = sum(map(document_tokens, selected)) + estimate_tokens(history)
+        print(
+            f'Context: {len(selected)}/{len(documents or [])} chunks, '
+            f'~{after} tokens ({max(0, before - after)} saved)'
+        )
+        return selected, history
+
+
+_shared_assembler = Shared()
+
+
+def get_context_assembler() -> ContextAssembler:
+    """
+    Returns the process-wide ContextAssembler configured by the `context`
+    settings. Sharing it keeps every session's rolling summary in one place.
+    """
+    return _shared_assembler.get(_create_context_assembler)
+
+
+def _create_context_assembler() -> ContextAssembler:
+    settings = get_settings('context')
+    return ContextAssembler(
+        max_context_tokens=settings.get('max_context_tokens', 2000),
+        max_history_tokens=settings.get('max_history_tokens', 600),
+        history_turns=settings.get('history_turns', 3),
+        summary_max_tokens=settings.get('summary_max_tokens', 200),
+        duplicate_threshold=settings.get('duplicate_threshold', 0.8),
+        adjacent_overlap_threshold=settings.get(
+            'adjacent_overlap_threshold', 0.5
+        ),
+        max_sessions=settings.get('max_sessions', 256),
+    )
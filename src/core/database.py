@@ -1,23 +1,442 @@
+import json
 import os
 import shutil
-from typing import List
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+from chromadb.api.shared_system_client import SharedSystemClient
 from dotenv import load_dotenv
 from langchain_chroma.vectorstores import Chroma
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
-from src.core.embeddings import get_embedding_function
+from src.core.embedding_pipeline import CHECKPOINT_FILE, embed_and_upsert
+from src.core.embeddings import EMBEDDING_MODEL, get_embedding_function
+from src.core.lexical import LexicalIndex
+from src.core.tracing import traced
+from src.core.utils import get_settings
+from src.core.vector_store import (
+    NumpyVectorStore,
+    convert_chroma_collection,
+)
 
 load_dotenv()
 
 CHROMA_PATH = 'chroma/'
+CORPUS_VERSION_FILE = os.path.join(CHROMA_PATH, 'corpus_version')
+LEXICAL_INDEX_FILE = os.path.join(CHROMA_PATH, 'lexical_index.json.gz')
+EMBEDDING_MODEL_FILE = os.path.join(CHROMA_PATH, 'embedding_model.json')
+NUMPY_STORE_PATH = os.path.join(CHROMA_PATH, 'numpy_store')
+VECTOR_STORE_BACKENDS = ('chroma', 'numpy')
+# Chroma's own defaults, used for the parameters missing from the settings
+HNSW_DEFAULTS = {
+    'space': 'l2',
+    'M': 16,
+    'construction_ef': 100,
+    'search_ef': 10,
+}
+# Indexes built before the model was recorded used the remote model
+LEGACY_EMBEDDING_MODEL = {'model': EMBEDDING_MODEL, 'dimension': 768}
+
+
+class EmbeddingModelMismatchError(ValueError):
+    """
+    Raised when the index was built with a different embedding model or
+    dimension than the configured backend.
+    """
+
+
+def hnsw_settings() -> Dict[str, Any]:
+    """
+    Returns the HNSW parameters of the `vector_store.hnsw` settings, with
+    Chroma's defaults for the missing ones.
+    """
+    settings = get_settings('vector_store').get('hnsw') or {}
+    return {**HNSW_DEFAULTS, **settings}
+
+
+def hnsw_metadata() -> Dict[str, Any]:
+    """
+    Returns the configured HNSW parameters as Chroma collection metadata.
+    """
+    return {f'hnsw:{key}': value for key, value in hnsw_settings().items()}
+
+
+def _hnsw_params(metadata: Optional[dict]) -> Dict[str, Any]:
+    # The `hnsw:` keys of a collection's metadata, over Chroma's defaults
+    return {
+        **HNSW_DEFAULTS,
+        **{
+            key.removeprefix('hnsw:'): value
+            for key, value in (metadata or {}).items()
+            if key.startswith('hnsw:')
+        },
+    }
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _release_client(client):
+    # Stops the client when its last Database is released, and forgets it
+    # so the next Database opens a new one
+    identifier = client._identifier
+    with Database._lock:
+        Database._clients[identifier] -= 1
+        if Database._clients[identifier]:
+            return
+        del Database._clients[identifier]
+        client._system.stop()
+        SharedSystemClient._identifier_to_system.pop(identifier, None)
+
 
 class Database:
-    def __init__(self):
-        self.database = Chroma(
-    persist_directory=CHROMA_PATH,
-    embedding_function=get_embedding_function(),
-)
+    """
+    Wraps the persistent vector store used by the application: a Chroma
+    collection or, when the `vector_store` settings select the 'numpy'
+    backend, a memory-mapped NumpyVectorStore.
+
+    Chroma shares one client between every instance opened on CHROMA_PATH.
+    The instances using it are counted, and the client is stopped when the
+    last one is closed or garbage collected, so `open_clients` shows whether
+    the serving path keeps a single client alive.
+
+    The embedding model name and dimension are recorded beside the
+    collection on the first write, and opening a collection built with
+    another model or dimension raises EmbeddingModelMismatchError.
+
+    A new Chroma collection gets the HNSW parameters of the
+    `vector_store.hnsw` settings. Chroma cannot change them afterwards, so
+    an existing collection keeps its own until `rebuild_index` is called.
+    """
+
+    # Persist directory of each open Chroma client -> instances using it
+    _clients: Dict[str, int] = {}
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        embedding_function: Optional[Embeddings] = None,
+        backend: Optional[str] = None,
+    ):
+        settings = get_settings('vector_store')
+        self.backend = backend or settings.get('backend', 'chroma')
+        if self.backend not in VECTOR_STORE_BACKENDS:
+            raise ValueError(f'Invalid vector store backend: {self.backend}')
+        self.embedding_function = (
+            embedding_function or get_embedding_function()
+        )
+        if self.backend == 'numpy':
+            self.database = NumpyVectorStore(
+                NUMPY_STORE_PATH,
+                self.embedding_function,
+                quantize=settings.get('quantize', False),
+            )
+            self._release = None
+        else:
+            with Database._lock:
+                self.database = self._open_chroma()
+                identifier = self.database._client._identifier
+                Database._clients[identifier] = (
+                    Database._clients.get(identifier, 0) + 1
+                )
+            # Runs once, on `close` or when the instance is garbage collected
+            self._release = weakref.finalize(
+                self, _release_client, self.database._client
+            )
+        self._check_embedding_model()
+
+    @staticmethod
+    def open_clients() -> int:
+        """
+        Returns how many Chroma clients are open in this process.
+        """
+        with Database._lock:
+            return len(Database._clients)
+
+    def _open_chroma(self):
+        database = Chroma(
+            persist_directory=CHROMA_PATH,
+            embedding_function=self.embedding_function,
+            collection_metadata=hnsw_metadata(),
+        )
+        current = _hnsw_params(database._collection.metadata)
+        if current != hnsw_settings():
+            print(
+                f'The collection uses the HNSW parameters {current}, not the '
+                f'configured {hnsw_settings()}. Apply them with '
+                '`python db/db_maintenance.py --rebuild`.'
+            )
+        return database
+
+    def index_params(self) -> Dict[str, Any]:
+        """
+        Returns the HNSW parameters of the Chroma collection, or an empty
+        dict for the exact NumPy backend.
+        """
+        if self.backend == 'numpy':
+            return {}
+        return _hnsw_params(self.database._collection.metadata)
+
+    def read_all(
+        self, batch_size: int = 1000
+    ) -> Tuple[List[str], np.ndarray, List[str], List[dict]]:
+        """
+        Reads every stored chunk with its vector, without embedding
+        anything.
+
+        Args:
+            batch_size (int): Chunks read per call from Chroma.
+
+        Returns:
+            Tuple[List[str], np.ndarray, List[str], List[dict]]: The IDs, a
+            float32 matrix of the vectors, the texts and the metadata.
+        """
+        include = ['embeddings', 'documents', 'metadatas']
+        if self.backend == 'numpy':
+            items = self.database.get(include=include)
+            return (
+                items['ids'],
+                items['embeddings'],
+                items['documents'],
+                items['metadatas'],
+            )
+        collection = self.database._collection
+        ids, vectors, documents, metadatas = [], [], [], []
+        for offset in range(0, collection.count(), batch_size):
+            items = collection.get(
+                limit=batch_size, offset=offset, include=include
+            )
+            ids.extend(items['ids'])
+            vectors.extend(items['embeddings'])
+            documents.extend(items['documents'])
+            metadatas.extend(items['metadatas'])
+        return ids, np.asarray(vectors, dtype=np.float32), documents, metadatas
+
+    def rebuild_index(self, batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Rebuilds the Chroma collection in place with the HNSW parameters of
+        the settings, copying the stored vectors, so nothing is embedded
+        again. The new index has no deleted elements left, and the SQLite
+        file (full-text index included) is compacted afterwards.
+
+        The copy is built under a temporary name and swapped in only when
+        complete; the old collection is deleted last.
+
+        Args:
+            batch_size (int): Chunks copied per call.
+
+        Returns:
+            Dict[str, Any]: The chunk count, the old and new parameters, the
+            size of CHROMA_PATH before and after (bytes) and the seconds
+            taken.
+
+        Raises:
+            ValueError: If the backend is not Chroma.
+        """
+        if self.backend != 'chroma':
+            raise ValueError('Only the Chroma backend has an HNSW index')
+        started_at = time.perf_counter()
+        size_before = _directory_size(CHROMA_PATH)
+        params_before = self.index_params()
+        client = self.database._client
+        source = self.database._collection
+        name = source.name
+        staging, previous = f'{name}_rebuild', f'{name}_previous'
+        existing = {
+            collection.name for collection in client.list_collections()
+        }
+        for leftover in (staging, previous):
+            if leftover in existing:
+                client.delete_collection(leftover)
+
+        target = client.create_collection(
+            staging,
+            metadata=hnsw_metadata(),
+        )
+        count = source.count()
+        for offset in range(0, count, batch_size):
+            items = source.get(
+                limit=batch_size,
+                offset=offset,
+                include=['embeddings', 'documents', 'metadatas'],
+            )
+            target.add(
+                ids=items['ids'],
+                embeddings=items['embeddings'],
+                documents=items['documents'],
+                metadatas=items['metadatas'],
+            )
+        if target.count() != count:
+            client.delete_collection(staging)
+            raise RuntimeError(
+                f'Copied {target.count()} of {count} chunks, '
+                'the collection was left unchanged'
+            )
+
+        source.modify(name=previous)
+        target.modify(name=name)
+        client.delete_collection(previous)
+        self.database = self._open_chroma()
+
+        sqlite_file = os.path.join(CHROMA_PATH, 'chroma.sqlite3')
+        connection = sqlite3.connect(sqlite_file)
+        try:
+            # Full-text deletes are only markers until the index is merged
+            connection.execute(
+                'INSERT INTO embedding_fulltext_search'
+                "(embedding_fulltext_search) VALUES('optimize')"
+            )
+            connection.commit()
+        except sqlite3.OperationalError as e:
+            print(f'Could not optimize the full-text index: {e}')
+        try:
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+
+        return {
+            'chunks': count,
+            'params_before': params_before,
+            'params_after': self.index_params(),
+            'size_before': size_before,
+            'size_after': _directory_size(CHROMA_PATH),
+            'seconds': time.perf_counter() - started_at,
+        }
+
+    def _embedding_model(self) -> dict:
+        return {
+            'model': getattr(self.embedding_function, 'model', None),
+            'dimension': getattr(self.embedding_function, 'dimension', None),
+        }
+
+    def _check_embedding_model(self):
+        recorded = get_embedding_model()
+        if recorded is None and self.count():
+            recorded = LEGACY_EMBEDDING_MODEL
+        current = self._embedding_model()
+        if recorded is not None and recorded != current:
+            raise EmbeddingModelMismatchError(
+                f'The index was built with {recorded["model"]} '
+                f'({recorded["dimension"]} dimensions), but the configured '
+                f'embeddings are {current["model"]} '
+                f'({current["dimension"]} dimensions). Rebuild it with '
+                '`python db/db_management.py --rebuild`.'
+            )
+
+    def count(self) -> int:
+        """
+        Returns the number of chunks in the store.
+        """
+        if self.backend == 'numpy':
+            return self.database.count()
+        return self.database._collection.count()
+
+    def search_by_vectors(
+        self, vectors: List[List[float]], k: int
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Runs one batched nearest-neighbour search for several query vectors.
+
+        Args:
+            vectors (List[List[float]]): The query embeddings.
+            k (int): Number of chunks per query.
+
+        Returns:
+            List[List[Tuple[Document, float]]]: For every query, the chunks
+            with their relevance score (higher is closer), best first.
+        """
+        if not vectors:
+            return []
+        if self.backend == 'numpy':
+            return self.database.search_by_vectors(vectors, k)
+        result = self.database._collection.query(
+            query_embeddings=vectors,
+            n_results=k,
+            include=['documents', 'metadatas', 'distances'],
+        )
+        relevance = self.database._select_relevance_score_fn()
+        return [
+            [
+                (
+                    Document(page_content=text, metadata=metadata or {}),
+                    relevance(distance),
+                )
+                for text, metadata, distance in zip(*columns)
+            ]
+            for columns in zip(
+                result['documents'], result['metadatas'], result['distances']
+            )
+        ]
+
+    def close(self):
+        """
+        Releases the Chroma client held by this instance; the client itself
+        is stopped when no other instance uses it.
+        """
+        if self._release is not None:
+            self._release()
+        self.database = None
+
+    def upsert(
+        self,
+        ids: List[str],
+        chunks: List[Document],
+        embeddings: List[List[float]],
+    ):
+        """
+        Inserts or replaces chunks whose embeddings were already computed,
+        without calling the embedding function again.
+
+        Args:
+            ids (List[str]): The chunk IDs.
+            chunks (List[Document]): The chunks to store.
+            embeddings (List[List[float]]): One embedding per chunk.
+        """
+        if not os.path.exists(EMBEDDING_MODEL_FILE):
+            os.makedirs(CHROMA_PATH, exist_ok=True)
+            with open(EMBEDDING_MODEL_FILE, 'w', encoding='utf-8') as file:
+                json.dump(self._embedding_model(), file)
+        store = (
+            self.database
+            if self.backend == 'numpy'
+            else self.database._collection
+        )
+        store.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=[chunk.page_content for chunk in chunks],
+            metadatas=[chunk.metadata for chunk in chunks],
+        )
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]):
+        """
+        Merges new metadata keys into stored chunks without embedding them
+        again.
+
+        Args:
+            ids (List[str]): The chunk IDs.
+            metadatas (List[dict]): The keys to set on each chunk.
+        """
+        if not ids:
+            return
+        store = (
+            self.database
+            if self.backend == 'numpy'
+            else self.database._collection
+        )
+        store.update(ids=ids, metadatas=metadatas)
+
 
 def assign_chunk_ids(chunks: List[Document]) -> List[Document]:
     """
@@ -56,6 +475,7 @@ def assign_chunk_ids(chunks: List[Document]) -> List[Document]:
     return chunks
 
 
+@traced('ingest.add_to_chroma')
 def add_to_chroma(chunks: List[Document]):
     """
     Adds a list of Document chunks to the Chroma database if they do not
@@ -66,22 +486,123 @@ def add_to_chroma(chunks: List[Document]):
         database.
     """
     db = Database()
-    chunks_with_ids = assign_chunk_ids(chunks)
-    existing_items = db.database.get(include=[])  # IDs are always included by default
-    existing_ids = set(existing_items['ids'])
-    print(f'Number of existing documents in DB: {len(existing_ids)}')
+    try:
+        chunks_with_ids = assign_chunk_ids(chunks)
+        # Only the candidate IDs are looked up, not the whole collection
+        candidate_ids = [chunk.metadata['id'] for chunk in chunks_with_ids]
+        existing_items = db.database.get(ids=candidate_ids, include=[])
+        existing_ids = set(existing_items['ids'])
+        print(f'Number of chunks already in DB: {len(existing_ids)}')
 
-    new_chunks = []
-    for chunk in chunks_with_ids:
-        if 'id' in chunk.metadata and chunk.metadata['id'] not in existing_ids:
-            new_chunks.append(chunk)
+        new_chunks = []
+        for chunk in chunks_with_ids:
+            if (
+                'id' in chunk.metadata
+                and chunk.metadata['id'] not in existing_ids
+            ):
+                new_chunks.append(chunk)
 
-    if new_chunks:
-        print(f'👉 Adding new documents: {len(new_chunks)}')
-        new_chunk_ids = [chunk.metadata['id'] for chunk in new_chunks]
-        db.database.add_documents(new_chunks, ids=new_chunk_ids)
-    else:
-        print('✅ No new documents to add')
+        if new_chunks:
+            print(f'👉 Adding new documents: {len(new_chunks)}')
+            embed_and_upsert(new_chunks, db)
+            lexical_index = load_lexical_index(db)
+            lexical_index.add(new_chunks)
+            lexical_index.save(LEXICAL_INDEX_FILE)
+            bump_corpus_version()
+        else:
+            print('✅ No new documents to add')
+    finally:
+        db.close()
+
+
+def load_lexical_index(db: Optional[Database] = None) -> LexicalIndex:
+    """
+    Loads the BM25 index kept beside the collection. If it does not exist
+    yet and a Database is given, it is built from the stored chunks and
+    saved, so the next start loads it instead of building it again.
+
+    Args:
+        db (Optional[Database]): Database used to build a missing index.
+
+    Returns:
+        LexicalIndex: The lexical index, possibly empty.
+    """
+    index = LexicalIndex.load(LEXICAL_INDEX_FILE)
+    if index is None and db is not None:
+        index = LexicalIndex.from_collection(db)
+        if len(index):
+            index.save(LEXICAL_INDEX_FILE)
+    return index if index is not None else LexicalIndex()
+
+
+def get_embedding_model() -> Optional[dict]:
+    """
+    Returns the embedding model recorded for the index, as a dict with
+    'model' and 'dimension' keys, or None if none was recorded.
+    """
+    if not os.path.exists(EMBEDDING_MODEL_FILE):
+        return None
+    with open(EMBEDDING_MODEL_FILE, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def get_corpus_version() -> str:
+    """
+    Returns the version stamp of the indexed corpus.
+
+    The stamp changes every time the collection is modified, so anything
+    derived from the collection (e.g. cached answers) can check whether it
+    is still valid.
+
+    Returns:
+        str: The current version stamp, or 'empty' if the collection has
+        never been populated.
+    """
+    try:
+        with open(CORPUS_VERSION_FILE, 'r', encoding='utf-8') as file:
+            return file.read().strip() or 'empty'
+    except FileNotFoundError:
+        return 'empty'
+
+
+def bump_corpus_version() -> str:
+    """
+    Writes a new, random corpus version stamp next to the collection.
+
+    Returns:
+        str: The new version stamp.
+    """
+    version = uuid.uuid4().hex
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    tmp_path = f'{CORPUS_VERSION_FILE}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(version)
+    os.replace(tmp_path, CORPUS_VERSION_FILE)
+    return version
+
+
+def convert_to_numpy(quantize: Optional[bool] = None) -> int:
+    """
+    Copies the Chroma collection, vectors included, into the NumPy store
+    used by the 'numpy' backend. Nothing is embedded again.
+
+    Args:
+        quantize (Optional[bool]): Whether to store int8 vectors, defaults
+        to the `vector_store` settings.
+
+    Returns:
+        int: Number of chunks converted.
+    """
+    if quantize is None:
+        quantize = get_settings('vector_store').get('quantize', False)
+    db = Database(backend='chroma')
+    try:
+        store = convert_chroma_collection(
+            db.database, NUMPY_STORE_PATH, db.embedding_function, quantize
+        )
+    finally:
+        db.close()
+    return store.count()
 
 
 def clear_database():
@@ -89,10 +610,14 @@ def clear_database():
     Deletes the directory specified by the CHROMA_PATH constant if it exists.
 
     This function checks if the directory at CHROMA_PATH exists. If it does,
-    the directory and all its contents are removed using shutil.rmtree.
+    the directory and all its contents are removed using shutil.rmtree. The
+    ingestion checkpoint is deleted too, since the chunks it records are
+    gone.
 
     Raises:
         OSError: If the directory cannot be removed.
     """
     if os.path.exists(CHROMA_PATH):
         shutil.rmtree(CHROMA_PATH)
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
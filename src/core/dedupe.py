@@ -0,0 +1,469 @@
+import base64
+import gzip
+import json
+import os
+import re
+import threading
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.core.lexical import (
+    OCCURRENCE_KEY_PREFIX,
+    fold_accents,
+    occurrence_key,
+)
+
+_WORD = re.compile(r'\w+')
+# Mersenne prime of the universal hash family; shingle hashes are 32-bit,
+# so a * hash + b always fits in 64 bits
+_PRIME = (1 << 31) - 1
+
+
+def occurrences(document: Document) -> List[Tuple[str, object]]:
+    """
+    Returns every (source, page) where the text of a chunk appears: the
+    'occurrences' metadata of a deduplicated chunk, or its own source and
+    page.
+    """
+    recorded = document.metadata.get('occurrences')
+    if recorded:
+        return [tuple(occurrence) for occurrence in json.loads(recorded)]
+    return [(document.metadata.get('source'), document.metadata.get('page'))]
+
+
+def cite_occurrences(documents: List[Document]) -> List[Document]:
+    """
+    Returns the chunks with the sources and pages of all their occurrences
+    in the 'source' and 'page' metadata, separated by '; ', so the
+    citations in the answer can name every document that has the clause.
+    """
+    cited = []
+    for document in documents:
+        found = occurrences(document)
+        if len(found) <= 1:
+            cited.append(document)
+            continue
+        metadata = {
+            **document.metadata,
+            'source': '; '.join(str(source) for source, _ in found),
+            'page': '; '.join(str(page) for _, page in found),
+        }
+        cited.append(
+            Document(page_content=document.page_content, metadata=metadata)
+        )
+    return cited
+
+
+def _similarity(a: np.ndarray, b: np.ndarray) -> float:
+    # Fraction of equal values, which estimates the Jaccard similarity
+    return float(np.mean(a == b))
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of the word n-grams (shingles) of a text,
+    after folding case and accents.
+
+    Attributes:
+        num_perm (int): Number of hash functions, i.e. signature length.
+        shingle_size (int): Words per shingle.
+        seed (int): Seed of the hash functions; signatures are only
+        comparable between hashers with the same parameters.
+    """
+
+    def __init__(
+        self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1
+    ):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = generator.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = _WORD.findall(fold_accents(text).casefold())
+        size = min(self.shingle_size, len(words))
+        grams = (
+            {
+                ' '.join(words[start : start + size])
+                for start in range(len(words) - size + 1)
+            }
+            if words
+            else set()
+        )
+        return np.fromiter(
+            (zlib.crc32(gram.encode('utf-8')) for gram in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Returns the signature of a text, or None if it has no words.
+        """
+        hashes = self._shingles(text)
+        if not hashes.size:
+            return None
+        permuted = (
+            self._a[:, None] * hashes[None, :] + self._b[:, None]
+        ) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """
+    Finds near-duplicate chunks at ingest time with MinHash and LSH banding.
+
+    Every stored chunk is a canonical chunk. A new chunk becomes one of its
+    members instead of being embedded and stored when their estimated
+    Jaccard similarity reaches `threshold`; the sources and pages of the
+    members are written to the 'occurrences' metadata of the canonical
+    chunk. Candidates are the canonical chunks sharing at least one band of
+    `num_perm / bands` signature values. Copies of a clause that only differ
+    in line breaks, hyphenation or a word score above 0.9, while clauses of
+    sibling documents that name another group or article score about 0.8.
+
+    When a page changes or disappears, its canonical chunks and members are
+    discarded. Members left without their canonical chunk become orphans,
+    which the indexer assigns again, storing the ones that no longer match
+    anything. The members' texts are kept for that purpose.
+
+    Attributes:
+        threshold (float): Estimated Jaccard similarity of near duplicates.
+        bands (int): Number of LSH bands.
+        hasher (MinHasher): Computes the signatures.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 3,
+    ):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self._rows = num_perm // bands
+        # canonical ID -> source, page, signature and members
+        self._canonicals: Dict[str, dict] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = defaultdict(set)
+        self._orphans: List[Document] = []
+        self._touched: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._canonicals)
+
+    def duplicates(self) -> int:
+        """
+        Returns how many chunks are stored as members of another chunk.
+        """
+        return sum(
+            len(entry['members']) for entry in self._canonicals.values()
+        )
+
+    def _bands(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (
+                band,
+                signature[
+                    band * self._rows : (band + 1) * self._rows
+                ].tobytes(),
+            )
+            for band in range(self.bands)
+        ]
+
+    def _register(self, chunk_id: str, source, page, signature):
+        self._canonicals[chunk_id] = {
+            'source': source,
+            'page': page,
+            'signature': signature,
+            'members': [],
+        }
+        for band in self._bands(signature):
+            self._buckets[band].add(chunk_id)
+
+    def _unregister(self, chunk_id: str) -> dict:
+        entry = self._canonicals.pop(chunk_id)
+        for key in self._bands(entry['signature']):
+            bucket = self._buckets[key]
+            bucket.discard(chunk_id)
+            if not bucket:
+                del self._buckets[key]
+        return entry
+
+    def _find(self, signature: np.ndarray) -> Optional[str]:
+        candidates = set()
+        for band in self._bands(signature):
+            candidates.update(self._buckets.get(band, ()))
+        for candidate in sorted(candidates):
+            entry = self._canonicals[candidate]
+            if _similarity(entry['signature'], signature) >= self.threshold:
+                return candidate
+        return None
+
+    def assign(self, chunk: Document) -> Optional[str]:
+        """
+        Registers a chunk, either as a member of a near-duplicate canonical
+        chunk or as a new canonical chunk.
+
+        Args:
+            chunk (Document): Chunk with 'id', 'source' and 'page' metadata.
+
+        Returns:
+            Optional[str]: The ID of the canonical chunk it duplicates, or
+            None if the chunk must be stored.
+        """
+        signature = self.hasher.signature(chunk.page_content)
+        if signature is None:
+            return None
+        chunk_id = chunk.metadata['id']
+        with self._lock:
+            if chunk_id in self._canonicals:
+                self._unregister(chunk_id)
+            canonical = self._find(signature)
+            if canonical is None:
+                self._register(
+                    chunk_id,
+                    chunk.metadata.get('source'),
+                    chunk.metadata.get('page'),
+                    signature,
+                )
+                return None
+            self._canonicals[canonical]['members'].append({
+                'text': chunk.page_content,
+                'metadata': chunk.metadata,
+            })
+            self._touched.add(canonical)
+            return canonical
+
+    def discard_page(self, source: str, page):
+        """
+        Forgets the canonical chunks and members of a page that changed or
+        disappeared. Members of its canonical chunks on other pages become
+        orphans.
+        """
+        page = str(page)
+
+        def on_page(metadata: dict) -> bool:
+            return (
+                metadata.get('source') == source
+                and str(metadata.get('page')) == page
+            )
+
+        with self._lock:
+            self._orphans = [
+                orphan
+                for orphan in self._orphans
+                if not on_page(orphan.metadata)
+            ]
+            for chunk_id, entry in list(self._canonicals.items()):
+                members = [
+                    member
+                    for member in entry['members']
+                    if not on_page(member['metadata'])
+                ]
+                if len(members) != len(entry['members']):
+                    entry['members'] = members
+                    self._touched.add(chunk_id)
+                if on_page(entry):
+                    self._unregister(chunk_id)
+                    self._touched.discard(chunk_id)
+                    self._orphans.extend(
+                        Document(
+                            page_content=member['text'],
+                            metadata=member['metadata'],
+                        )
+                        for member in members
+                    )
+
+    def take_orphans(self) -> List[Document]:
+        """
+        Returns and forgets the members whose canonical chunk was discarded.
+        """
+        with self._lock:
+            orphans, self._orphans = self._orphans, []
+        return orphans
+
+    def take_touched(self) -> Set[str]:
+        """
+        Returns and forgets the canonical chunks whose members changed.
+        """
+        with self._lock:
+            touched, self._touched = self._touched, set()
+        return {
+            chunk_id for chunk_id in touched if chunk_id in self._canonicals
+        }
+
+    def occurrences(self, chunk_id: str) -> List[list]:
+        """
+        Returns the [source, page] of a canonical chunk and its members.
+        """
+        entry = self._canonicals[chunk_id]
+        found = [[entry['source'], entry['page']]]
+        for member in entry['members']:
+            occurrence = [
+                member['metadata'].get('source'),
+                member['metadata'].get('page'),
+            ]
+            if occurrence not in found:
+                found.append(occurrence)
+        return found
+
+    def save(self, path: str):
+        """
+        Atomically writes the index as compressed JSON.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        payload = {
+            'params': self._params(),
+            'canonicals': {
+                chunk_id: [
+                    entry['source'],
+                    entry['page'],
+                    base64.b64encode(entry['signature'].tobytes()).decode(),
+                    entry['members'],
+                ]
+                for chunk_id, entry in self._canonicals.items()
+            },
+        }
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _params(self) -> dict:
+        return {
+            'num_perm': self.hasher.num_perm,
+            'shingle_size': self.hasher.shingle_size,
+            'seed': self.hasher.seed,
+            'bands': self.bands,
+        }
+
+    def load(self, path: str) -> bool:
+        """
+        Loads the chunks saved by `save` into this (empty) index.
+
+        Returns:
+            bool: False if the file does not exist or was written with other
+            signature parameters, which makes its signatures unusable.
+        """
+        if not os.path.exists(path):
+            return False
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            payload = json.load(file)
+        if payload.get('params') != self._params():
+            print('The duplicate index was built with other parameters')
+            return False
+        # Indexes saved by earlier versions also have a text digest
+        for chunk_id, (source, page, signature, members, *_) in payload[
+            'canonicals'
+        ].items():
+            self._register(
+                chunk_id,
+                source,
+                page,
+                np.frombuffer(base64.b64decode(signature), dtype=np.uint32),
+            )
+            self._canonicals[chunk_id]['members'] = members
+        return True
+
+    def check_members(self) -> int:
+        """
+        Compares every member with its canonical chunk again, so members
+        merged under a lower `threshold`, or by an earlier version, stop
+        being duplicates once they no longer reach it. They become orphans,
+        which the indexer stores again, and their canonical chunks are
+        marked as touched, so their occurrences are written again.
+
+        Returns:
+            int: Number of members turned into orphans.
+        """
+        released = 0
+        with self._lock:
+            for chunk_id, entry in self._canonicals.items():
+                members = [
+                    member
+                    for member in entry['members']
+                    if (signature := self.hasher.signature(member['text']))
+                    is not None
+                    and _similarity(entry['signature'], signature)
+                    >= self.threshold
+                ]
+                if len(members) == len(entry['members']):
+                    continue
+                self._orphans.extend(
+                    Document(
+                        page_content=member['text'],
+                        metadata=member['metadata'],
+                    )
+                    for member in entry['members']
+                    if member not in members
+                )
+                released += len(entry['members']) - len(members)
+                entry['members'] = members
+                self._touched.add(chunk_id)
+        return released
+
+    def add_collection(self, db):
+        """
+        Registers every chunk stored in a Database as a canonical chunk, for
+        collections indexed before deduplication was enabled.
+        """
+        items = db.database.get(include=['documents', 'metadatas'])
+        for chunk_id, text, metadata in zip(
+            items['ids'], items['documents'], items['metadatas']
+        ):
+            signature = self.hasher.signature(text)
+            if signature is not None:
+                self._register(
+                    chunk_id,
+                    metadata.get('source'),
+                    metadata.get('page'),
+                    signature,
+                )
+
+
+def update_occurrences(
+    duplicates: DuplicateIndex, chunk_ids: Iterable[str], db, lexical_index
+):
+    """
+    Writes the 'occurrences' metadata of canonical chunks to the Database
+    and the BM25 index, without embedding anything. Every source of an
+    occurrence is also flagged with its `occurrence_key`, so routed searches
+    can filter on it; flags of sources the chunk no longer appears in are
+    set to False, since metadata updates only merge keys.
+    """
+    chunk_ids = sorted(chunk_ids)
+    if not chunk_ids:
+        return
+    items = db.database.get(ids=chunk_ids, include=['documents', 'metadatas'])
+    metadatas = []
+    for chunk_id, metadata in zip(items['ids'], items['metadatas']):
+        found = duplicates.occurrences(chunk_id)
+        flags = {
+            key: False
+            for key in metadata
+            if key.startswith(OCCURRENCE_KEY_PREFIX)
+        }
+        flags.update((occurrence_key(source), True) for source, _ in found)
+        metadatas.append({
+            **metadata,
+            **flags,
+            'occurrences': json.dumps(found, ensure_ascii=False),
+        })
+    db.update_metadatas(items['ids'], metadatas)
+    lexical_index.add(
+        Document(page_content=text, metadata={**metadata, 'id': chunk_id})
+        for chunk_id, text, metadata in zip(
+            items['ids'], items['documents'], metadatas
+        )
+    )
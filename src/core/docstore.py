@@ -0,0 +1,270 @@
+import gzip
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from src.core.context import CHARS_PER_TOKEN
+from src.core.database import CHROMA_PATH
+from src.core.utils import get_settings
+
+PAGE_STORE_FILE = os.path.join(CHROMA_PATH, 'page_store.json.gz')
+EXPANSION_MODES = ('page', 'neighbours')
+
+# Words matched to find where a chunk starts and ends in its page
+_ANCHOR_WORDS = 8
+# Characters left for the source and page the prompt renders before a hit
+_HEADER_CHARS = 160
+
+
+def page_key(chunk_id: str) -> Tuple[str, int]:
+    """
+    Splits a chunk ID "source:page:index" into its "source:page" prefix and
+    its index on the page.
+
+    Raises:
+        ValueError: If the ID does not end with an index.
+    """
+    key, _, index = chunk_id.rpartition(':')
+    return key, int(index)
+
+
+def _anchor(words: List[str]) -> 're.Pattern':
+    return re.compile(r'\s+'.join(map(re.escape, words)))
+
+
+def locate(text: str, chunk: str, start: int = 0) -> Optional[List[int]]:
+    """
+    Finds the span of a chunk in the text of its page. Chunkers may change
+    the whitespace between words, so the first and last words of the chunk
+    are matched instead of the exact text.
+
+    Args:
+        text (str): The page text.
+        chunk (str): The chunk text.
+        start (int): Where to start looking, e.g. the end of the previous
+        chunk.
+
+    Returns:
+        Optional[List[int]]: The [start, end) span, or None if the chunk
+        was not found.
+    """
+    words = chunk.split()
+    if not words:
+        return None
+    head = _anchor(words[:_ANCHOR_WORDS])
+    match = head.search(text, start) or head.search(text)
+    if match is None:
+        return None
+    # The last words may repeat inside the chunk: take the occurrence that
+    # ends closest to where the chunk should end
+    expected_end = match.start() + len(chunk)
+    end = match.end()
+    for tail in _anchor(words[-_ANCHOR_WORDS:]).finditer(text, match.start()):
+        if abs(tail.end() - expected_end) < abs(end - expected_end):
+            end = tail.end()
+        if tail.end() >= expected_end:
+            break
+    return [match.start(), end]
+
+
+class PageStore:
+    """
+    Local docstore of the pages behind the stored chunks, for small-to-big
+    retrieval: the small chunks are searched, and each hit is expanded to
+    its whole page or to a window of adjacent chunks of the same page.
+
+    Pages are keyed by the "source:page" prefix of the chunk IDs and hold
+    the page text and the [start, end) span of every chunk in it, in chunk
+    order, so the neighbours of a hit are found by its index, without any
+    vector query or embedding call.
+
+    Attributes:
+        mode (str): 'page' expands a hit to its whole page when the page
+        fits in `max_chars`, and to adjacent chunks otherwise;
+        'neighbours' always expands to adjacent chunks.
+        window (int): Adjacent chunks added on each side of a hit in
+        'neighbours' mode.
+        max_chars (int): Longest expanded text.
+    """
+
+    def __init__(
+        self, mode: str = 'page', window: int = 1, max_chars: int = 2400
+    ):
+        if mode not in EXPANSION_MODES:
+            raise ValueError(f'Invalid expansion mode: {mode}')
+        self.mode = mode
+        self.window = window
+        self.max_chars = max_chars
+        # "source:page" -> (page text, chunk spans)
+        self._pages: Dict[str, Tuple[str, List[Optional[List[int]]]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def add_page(self, page: Document, chunks: Iterable[Document]):
+        """
+        Stores a page and the spans of its chunks, replacing the previous
+        version of the page.
+
+        Args:
+            page (Document): The page, with 'source' and 'page' metadata.
+            chunks (Iterable[Document]): Its chunks, with positional IDs.
+        """
+        text = page.page_content
+        spans: List[Optional[List[int]]] = []
+        position = 0
+        for chunk in chunks:
+            _, index = page_key(chunk.metadata['id'])
+            spans.extend([None] * (index + 1 - len(spans)))
+            span = locate(text, chunk.page_content, position)
+            spans[index] = span
+            if span is not None:
+                position = span[1]
+        key = f'{page.metadata["source"]}:{page.metadata["page"]}'
+        with self._lock:
+            self._pages[key] = (text, spans)
+
+    def retain(self, keys: Iterable[str]):
+        """
+        Forgets the pages whose key is not in `keys`, e.g. the pages of
+        removed files.
+        """
+        keys = set(keys)
+        with self._lock:
+            for key in list(self._pages):
+                if key not in keys:
+                    del self._pages[key]
+
+    def _window(
+        self, spans: List[Optional[List[int]]], index: int
+    ) -> Optional[Tuple[int, int]]:
+        if index >= len(spans) or spans[index] is None:
+            return None
+        low = high = index
+        start, end = spans[index]
+        reach = len(spans) if self.mode == 'page' else self.window
+        for step in range(1, reach + 1):
+            grown = False
+            for neighbour in (index + step, index - step):
+                if not 0 <= neighbour < len(spans) or not spans[neighbour]:
+                    continue
+                new_start = min(start, spans[neighbour][0])
+                new_end = max(end, spans[neighbour][1])
+                if new_end - new_start > self.max_chars:
+                    continue
+                start, end = new_start, new_end
+                low, high = min(low, neighbour), max(high, neighbour)
+                grown = True
+            if not grown:
+                break
+        return low, high
+
+    def expand(self, documents: List[Document]) -> List[Document]:
+        """
+        Replaces retrieved chunks with their page or adjacent chunks, in
+        rank order. A hit already covered by the expansion of a better
+        ranked hit of the same page is dropped. Chunks of unknown pages are
+        kept as they are.
+
+        Args:
+            documents (List[Document]): Retrieved chunks, best first.
+
+        Returns:
+            List[Document]: The expanded chunks, with an 'expanded'
+            metadata of 'page' or 'neighbours'.
+        """
+        expanded = []
+        covered: Dict[str, List[Tuple[int, int]]] = {}
+        for document in documents:
+            try:
+                key, index = page_key(document.metadata.get('id') or '')
+            except ValueError:
+                key, index = None, 0
+            entry = self._pages.get(key)
+            if entry is None:
+                expanded.append(document)
+                continue
+            if any(low <= index <= high for low, high in covered.get(key, ())):
+                continue
+            text, spans = entry
+            if self.mode == 'page' and len(text) <= self.max_chars:
+                low, high, content, how = 0, len(spans), text, 'page'
+            else:
+                window = self._window(spans, index)
+                if window is None:
+                    expanded.append(document)
+                    continue
+                low, high = window
+                content = text[spans[low][0] : spans[high][1]]
+                how = 'neighbours'
+            covered.setdefault(key, []).append((low, high))
+            expanded.append(
+                Document(
+                    page_content=content,
+                    metadata={**document.metadata, 'expanded': how},
+                )
+            )
+        return expanded
+
+    def save(self, path: str):
+        """
+        Atomically writes the pages as compressed JSON.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._lock:
+            payload = {key: list(entry) for key, entry in self._pages.items()}
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Loads the pages saved by `save`.
+
+        Returns:
+            bool: False if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return False
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            payload = json.load(file)
+        self._pages = {
+            key: (text, spans) for key, (text, spans) in payload.items()
+        }
+        return True
+
+
+def load_page_store(k: Optional[int] = None) -> PageStore:
+    """
+    Loads the page store kept beside the collection, configured by the
+    `docstore` settings. It is empty if the collection was indexed before
+    the store existed; the next `index_directory` run fills it.
+
+    For retrieval, the expanded texts are capped at an equal share of the
+    `max_context_tokens` budget for each of the `k` hits, so expanding
+    them never makes the ContextAssembler drop the lower ranked ones.
+
+    Args:
+        k (Optional[int]): Number of hits retrieved per query, or None
+        when the store is only filled, e.g. by the indexer.
+    """
+    settings = get_settings('docstore')
+    max_chars = settings.get('max_chars', 2400)
+    if k:
+        budget = get_settings('context').get('max_context_tokens', 2000)
+        max_chars = min(
+            max_chars, budget * CHARS_PER_TOKEN // k - _HEADER_CHARS
+        )
+    store = PageStore(
+        mode=settings.get('mode', 'page'),
+        window=settings.get('window', 1),
+        max_chars=max_chars,
+    )
+    store.load(PAGE_STORE_FILE)
+    return store
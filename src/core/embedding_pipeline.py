@@ -0,0 +1,270 @@
+import dataclasses
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.core.embeddings import CACHE_PATH
+from src.core.gateway import TokenBucket, is_rate_limit_error
+from src.core.pipeline import Stage, run_pipeline
+from src.core.tracing import get_tracer
+from src.core.utils import get_settings
+
+CHECKPOINT_FILE = os.path.join(CACHE_PATH, 'ingestion_checkpoint.jsonl')
+
+
+class EmbeddingCheckpoint:
+    """
+    Append-only record of the chunks already embedded and stored, so an
+    interrupted ingestion can resume where it stopped.
+
+    Entries are digests of the chunk ID and text, so a chunk whose text
+    changed after the interruption is embedded again. The checkpoint is
+    deleted with the collection (see `clear_database`), and committed
+    chunks missing from the collection are embedded again anyway.
+
+    Attributes:
+        path (str): The JSON lines file holding the committed digests.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+        self._committed: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        self._committed.update(json.loads(line))
+
+    @staticmethod
+    def digest(chunk: Document) -> str:
+        """
+        Returns the checkpoint digest of a chunk.
+        """
+        raw = f'{chunk.metadata.get("id")}\x00{chunk.page_content}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def is_committed(self, chunk: Document) -> bool:
+        """
+        Whether the chunk was already stored by a previous run.
+        """
+        return self.digest(chunk) in self._committed
+
+    def commit(self, chunks: List[Document]):
+        """
+        Durably records a batch of stored chunks.
+        """
+        digests = [self.digest(chunk) for chunk in chunks]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(digests) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self._committed.update(digests)
+
+    def clear(self):
+        """
+        Removes the checkpoint once an ingestion finished successfully.
+        """
+        self._committed.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """
+    RetryPolicy tells `embed_with_retry` how to retry quota errors.
+
+    Attributes:
+        max_retries (int): How many times a quota error is retried.
+        base_delay (float): Delay before the first retry, in seconds; it
+        doubles on every retry.
+        sleep (Callable[[float], None]): Sleep function, for tests.
+    """
+
+    max_retries: int = 6
+    base_delay: float = 1.0
+    sleep: Callable[[float], None] = time.sleep
+
+
+def embed_with_retry(
+    embeddings: Embeddings,
+    texts: List[str],
+    bucket: TokenBucket,
+    retry: Optional[RetryPolicy] = None,
+) -> List[List[float]]:
+    """
+    Embeds one batch of texts, waiting for the rate limiter before each
+    attempt and retrying quota errors with exponential backoff and jitter.
+
+    Args:
+        embeddings (Embeddings): The embedding function.
+        texts (List[str]): The batch to embed.
+        bucket (TokenBucket): The shared rate limiter.
+        retry (Optional[RetryPolicy]): How quota errors are retried.
+
+    Returns:
+        List[List[float]]: One embedding per text.
+
+    Raises:
+        Exception: The last error, if it is not a quota error or the
+        retries are exhausted.
+    """
+    retry = retry or RetryPolicy()
+    for attempt in range(retry.max_retries + 1):
+        bucket.acquire()
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == retry.max_retries or not is_rate_limit_error(e):
+                raise
+            delay = retry.base_delay * 2**attempt
+            print(f'Rate limited, retrying in {delay:.1f}s: {e}')
+            retry.sleep(delay * (1 + random.random() / 2))
+    return []
+
+
+def embedding_stages(
+    db,
+    *,
+    checkpoint: Optional[EmbeddingCheckpoint] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Stage]:
+    """
+    Builds the embed and upsert stages of the ingestion pipeline.
+
+    The embed stage takes `(chunk, vector)` pairs and sends the chunks
+    without a precomputed vector, in batches, through a bounded pool of
+    workers, behind a shared token bucket and with retries on quota errors.
+    The upsert stage stores the embedded chunks in fixed-size batches and
+    writes a checkpoint after every committed batch. Chunks recorded in the
+    checkpoint by an interrupted run, and still in the collection, are
+    neither embedded nor upserted again, but still yielded by the upsert
+    stage so callers record them. Batch sizes, workers, the rate limit and
+    retries are read from the `ingestion` settings.
+
+    Args:
+        db (Database): The database the chunks are upserted into, with its
+        embedding function.
+        checkpoint (Optional[EmbeddingCheckpoint]): Resume checkpoint.
+        stats (Optional[Dict[str, int]]): If given, its 'embedded_chunks'
+        counter is increased by the chunks upserted by this run.
+
+    Returns:
+        List[Stage]: The stages; the last one yields every chunk stored by
+        this run or by the interrupted one.
+    """
+    settings = get_settings('ingestion')
+    embeddings = db.embedding_function
+    checkpoint = checkpoint or EmbeddingCheckpoint()
+    bucket = TokenBucket(settings.get('requests_per_minute', 1500))
+    retry = RetryPolicy(max_retries=settings.get('max_retries', 6))
+
+    def stored_ids(chunks: List[Document]) -> Set[str]:
+        committed = [
+            chunk.metadata['id']
+            for chunk in chunks
+            if checkpoint.is_committed(chunk)
+        ]
+        if not committed:
+            return set()
+        # A checkpoint may outlive the chunks it records
+        return set(db.database.get(ids=committed, include=[])['ids'])
+
+    def embed(batch: List[Tuple[Document, Optional[List[float]]]]):
+        stored = stored_ids([chunk for chunk, _ in batch])
+        pending = [
+            (chunk, vector)
+            for chunk, vector in batch
+            if chunk.metadata['id'] not in stored
+        ]
+        missing = [chunk for chunk, vector in pending if vector is None]
+        if missing:
+            with get_tracer().span('ingest.embed_batch', texts=len(missing)):
+                computed = iter(
+                    embed_with_retry(
+                        embeddings,
+                        [chunk.page_content for chunk in missing],
+                        bucket,
+                        retry,
+                    )
+                )
+            pending = [
+                (chunk, next(computed) if vector is None else vector)
+                for chunk, vector in pending
+            ]
+        # Stored chunks go on without a vector, to be recorded only
+        return pending + [
+            (chunk, None)
+            for chunk, _ in batch
+            if chunk.metadata['id'] in stored
+        ]
+
+    def upsert(batch: List[tuple]):
+        fresh = [pair for pair in batch if pair[1] is not None]
+        if fresh:
+            chunks = [chunk for chunk, _ in fresh]
+            with get_tracer().span('ingest.upsert', chunks=len(chunks)):
+                db.upsert(
+                    [chunk.metadata['id'] for chunk in chunks],
+                    chunks,
+                    [vector for _, vector in fresh],
+                )
+                checkpoint.commit(chunks)
+            if stats is not None:
+                stats['embedded_chunks'] += len(chunks)
+        return [chunk for chunk, _ in batch]
+
+    return [
+        Stage(
+            'embed',
+            embed,
+            workers=settings.get('max_workers', 4),
+            batch_size=settings.get('batch_size', 64),
+        ),
+        Stage(
+            'upsert',
+            upsert,
+            batch_size=settings.get('upsert_batch_size', 256),
+        ),
+    ]
+
+
+def embed_and_upsert(
+    chunks: List[Document],
+    db,
+    checkpoint: Optional[EmbeddingCheckpoint] = None,
+) -> int:
+    """
+    Embeds and upserts a list of chunks through the embedding stages.
+
+    If the ingestion is interrupted, the next call skips the chunks that
+    were already stored.
+
+    Args:
+        chunks (List[Document]): Chunks with an 'id' metadata key.
+        db (Database): The database the chunks are upserted into.
+        checkpoint (Optional[EmbeddingCheckpoint]): Records the stored
+        chunks; defaults to the ingestion checkpoint file.
+
+    Returns:
+        int: Number of chunks embedded and stored by this call.
+    """
+    checkpoint = checkpoint or EmbeddingCheckpoint()
+    stats = {'embedded_chunks': 0}
+    stages = embedding_stages(db, checkpoint=checkpoint, stats=stats)
+    queue_size = get_settings('ingestion').get('queue_size', 8)
+    pairs = ((chunk, None) for chunk in chunks)
+    for _ in run_pipeline(pairs, stages, queue_size):
+        pass
+    stored = stats['embedded_chunks']
+    if stored < len(chunks):
+        print(f'⏩ {len(chunks) - stored} chunks were already stored')
+    checkpoint.clear()
+    return stored
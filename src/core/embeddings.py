@@ -1,19 +1,474 @@
-# TODO: Improve the embeddings and add more models
+import dataclasses
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import numpy as np
+from langchain_core.embeddings import Embeddings
 
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # Optional: only the 'local' embedding backend needs it
+    SentenceTransformer = None
 
-def get_embedding_function() -> GoogleGenerativeAIEmbeddings:
+from src.core.gateway import get_gateway
+from src.core.tracing import get_tracer
+from src.core.utils import Shared, get_settings
+
+EMBEDDING_MODEL = 'models/text-embedding-004'
+CACHE_PATH = 'cache/'
+EMBEDDING_CACHE_FILE = os.path.join(CACHE_PATH, 'embeddings.sqlite3')
+
+_TRAILING_PUNCTUATION = re.compile(r'[\s?!.;:,]+$')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str, fold_case: bool = True) -> str:
+    """
+    Normalizes a text so that trivially different strings share a cache key.
+
+    Whitespace is collapsed and the text is put in NFC form. When `fold_case`
+    is set (used for queries) the text is also case folded and trailing
+    punctuation is dropped, so "O que é o WIE?" and "o que é o WIE" match.
+
+    Args:
+        text (str): The text to normalize.
+        fold_case (bool): Whether to apply the query normalization.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = unicodedata.normalize('NFC', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    if fold_case:
+        text = _TRAILING_PUNCTUATION.sub('', text.casefold())
+    return text
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, dependency-free embeddings: every normalized token and
+    pair of consecutive tokens is hashed into one of `dimension` buckets
+    with a random sign, and the vectors are L2-normalized. The quality is
+    far below a trained model, but it needs no network nor model files,
+    which makes it suitable for air-gapped CI boxes.
+
+    Attributes:
+        dimension (int): Size of the vectors.
+    """
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        tokens = normalize_text(text).split()
+        return tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.md5(feature.encode('utf-8')).digest()
+                rows.append(row)
+                columns.append(
+                    int.from_bytes(digest[:4], 'little') % self.dimension
+                )
+                signs.append(1.0 if digest[4] % 2 else -1.0)
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_batch(texts)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    CPU-only sentence-transformers model loaded from a local directory, run
+    in batches with NumPy outputs. No request leaves the machine.
+
+    Attributes:
+        path (str): Directory (or hub name, if cached locally) of the model.
+        batch_size (int): Texts encoded per forward pass.
+        dimension (int): Size of the vectors, read from the model.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32):
+        if SentenceTransformer is None:
+            raise ImportError(
+                'The local embedding backend needs sentence-transformers: '
+                '`pip install sentence-transformers`'
+            )
+        self.path = path
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(path, device='cpu')
+        self.dimension = self._model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        return self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        ).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+
+class StubRateLimitError(Exception):
+    """
+    Error raised by StubEmbeddings to mimic a quota error of the API.
+    """
+
+
+class StubEmbeddings(HashingEmbeddings):
+    """
+    Offline stand-in for the remote embedding model, used to test the
+    ingestion throughput without network access or quota.
+
+    Vectors come from HashingEmbeddings. Each call can sleep to simulate
+    the network round trip and randomly fail with a 429-like error to
+    exercise the retry logic.
+
+    Attributes:
+        dimension (int): Size of the vectors.
+        latency (float): Seconds slept on every call.
+        error_rate (float): Probability that a call raises
+        StubRateLimitError.
+    """
+
+    def __init__(
+        self,
+        dimension: int = 768,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        super().__init__(dimension)
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubRateLimitError('429 Resource has been exhausted')
+
+    def embed_query(self, text: str) -> List[float]:
+        self._call()
+        return super().embed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._call()
+        return super().embed_documents(texts)
+
+
+@dataclasses.dataclass(eq=False)
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches vectors in two tiers: an in-memory LRU
+    with size and TTL limits, and a persistent SQLite store.
+
+    Keys are built from the model name, the kind of embedding (query or
+    document, since the remote model uses a different task type for each)
+    and the normalized text.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding function.
+        model (str): The model name, part of every cache key.
+        dimension (Optional[int]): Size of the vectors, recorded in the
+        index to refuse mixing backends.
+        max_entries (int): Maximum number of vectors kept in memory.
+        ttl_seconds (float): How long a vector stays in the memory tier.
+        path (Optional[str]): SQLite file of the persistent tier, or None to
+        keep the cache in memory only.
     """
-    Creates and returns an instance of GoogleGenerativeAIEmbeddings with a
-    specified model.
+
+    embeddings: Embeddings
+    model: str
+    _: dataclasses.KW_ONLY
+    dimension: Optional[int] = None
+    max_entries: int = 2048
+    ttl_seconds: float = 3600
+    path: Optional[str] = EMBEDDING_CACHE_FILE
+
+    def __post_init__(self):
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, kind: str, text: str) -> str:
+        normalized = normalize_text(text, fold_case=kind == 'query')
+        raw = f'{self.model}\x00{kind}\x00{normalized}'
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'key TEXT PRIMARY KEY, model TEXT, vector BLOB, '
+                'created_at REAL)'
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is None:
+                    continue
+                expires_at, vector = entry
+                if expires_at < now:
+                    del self._memory[key]
+                    continue
+                self._memory.move_to_end(key)
+                found[key] = vector
+            self.memory_hits += len(found)
+
+            missing = [key for key in keys if key not in found]
+            # Stay below SQLite's limit of bound parameters per statement
+            for start in range(0, len(missing) if self.path else 0, 500):
+                batch = missing[start : start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = (
+                    self._get_connection()
+                    .execute(
+                        'SELECT key, vector FROM embeddings '
+                        f'WHERE key IN ({placeholders})',
+                        batch,
+                    )
+                    .fetchall()
+                )
+                for key, blob in rows:
+                    vector = array('f', blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector, now)
+                self.disk_hits += len(rows)
+        return found
+
+    def _remember(self, key: str, vector: List[float], now: float):
+        self._memory[key] = (now + self.ttl_seconds, vector)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _store(self, items: Dict[str, List[float]]):
+        now = time.monotonic()
+        with self._lock:
+            self.misses += len(items)
+            for key, vector in items.items():
+                self._remember(key, vector, now)
+            if self.path:
+                connection = self._get_connection()
+                connection.executemany(
+                    'INSERT OR REPLACE INTO embeddings '
+                    '(key, model, vector, created_at) VALUES (?, ?, ?, ?)',
+                    [
+                        (key, self.model, array('f', vector).tobytes(),
+                         time.time())
+                        for key, vector in items.items()
+                    ],
+                )
+                connection.commit()
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query, using the cache when possible.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        with get_tracer().span('embedding.query') as span:
+            key = self._key('query', text)
+            found = self._lookup([key])
+            span['cache_hit'] = key in found
+            if key in found:
+                return found[key]
+            vector = self.embeddings.embed_query(text)
+            self._store({key: vector})
+            return vector
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # The remote model embeds queries with their own task type
+        if hasattr(self.embeddings, 'task_type'):
+            return self.embeddings.embed_documents(
+                texts, task_type='retrieval_query'
+            )
+        return self.embeddings.embed_documents(texts)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds several queries. The queries missing from both cache tiers
+        are sent to the wrapped embedding function in a single call.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One embedding per query, in order.
+        """
+        tracer = get_tracer()
+        with tracer.span('embedding.queries', texts=len(texts)) as span:
+            keys = [self._key('query', text) for text in texts]
+            found = self._lookup(list(dict.fromkeys(keys)))
+
+            pending = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in pending:
+                    pending[key] = text
+            span['cache_misses'] = len(pending)
+            if pending:
+                vectors = self._embed_queries(list(pending.values()))
+                computed = dict(zip(pending.keys(), vectors))
+                self._store(computed)
+                found.update(computed)
+
+            return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of documents. Only the texts missing from both cache
+        tiers are sent, in a single call, to the wrapped embedding function.
+
+        Args:
+            texts (List[str]): The documents to embed.
+
+        Returns:
+            List[List[float]]: One embedding per document, in order.
+        """
+        tracer = get_tracer()
+        with tracer.span('embedding.documents', texts=len(texts)) as span:
+            keys = [self._key('document', text) for text in texts]
+            found = self._lookup(list(dict.fromkeys(keys)))
+
+            pending = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in pending:
+                    pending[key] = text
+            span['cache_misses'] = len(pending)
+            if pending:
+                vectors = self.embeddings.embed_documents(
+                    list(pending.values())
+                )
+                computed = dict(zip(pending.keys(), vectors))
+                self._store(computed)
+                found.update(computed)
+
+            return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit and miss counters of the cache.
+        """
+        with self._lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+            }
+
+
+def build_embeddings(settings: Dict) -> Tuple[Embeddings, str, int]:
+    """
+    Creates the embedding backend selected by the `embeddings` settings.
+
+    Args:
+        settings (Dict): The `embeddings` settings. `backend` is one of
+        'google' (the remote text-embedding-004 model, called through the
+        model gateway), 'local' (a
+        sentence-transformers model loaded from `local_path`), 'hashing'
+        (HashingEmbeddings) or 'stub' (StubEmbeddings sleeping `latency`
+        seconds per call, for offline benchmarks).
 
     Returns:
-        GoogleGenerativeAIEmbeddings: An instance of the
-        GoogleGenerativeAIEmbeddings class initialized with the
-        'embedding-004' model.
+        Tuple[Embeddings, str, int]: The backend, the model name recorded
+        in the index and the vector dimension.
+
+    Raises:
+        ValueError: If the backend is unknown.
     """
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model='models/text-embedding-004'
+    backend = settings.get('backend', 'google')
+    if backend == 'google':
+        model = settings.get('model', EMBEDDING_MODEL)
+        return (
+            get_gateway().embeddings(model),
+            model,
+            settings.get('dimension', 768),
+        )
+    if backend == 'local':
+        path = settings['local_path']
+        embeddings = LocalEmbeddings(
+            path, batch_size=settings.get('batch_size', 32)
+        )
+        model = f'local:{os.path.basename(os.path.normpath(path))}'
+        return embeddings, model, embeddings.dimension
+    if backend == 'hashing':
+        dimension = settings.get('dimension', 768)
+        return HashingEmbeddings(dimension), f'hashing-{dimension}', dimension
+    if backend == 'stub':
+        dimension = settings.get('dimension', 768)
+        embeddings = StubEmbeddings(
+            dimension, latency=settings.get('latency', 0.0)
+        )
+        return embeddings, f'stub-{dimension}', dimension
+    raise ValueError(f'Invalid embedding backend: {backend}')
+
+
+_shared_embeddings = Shared()
+
+
+def get_embedding_function() -> CachedEmbeddings:
+    """
+    Returns the process-wide embedding function: the backend chosen by the
+    `embeddings` settings (see `build_embeddings`), wrapped in a
+    CachedEmbeddings configured by the `embedding_cache` settings.
+
+    Returns:
+        CachedEmbeddings: The shared, cached embedding function.
+    """
+    return _shared_embeddings.get(_create_embedding_function)
+
+
+def _create_embedding_function() -> CachedEmbeddings:
+    settings = get_settings('embedding_cache')
+    embeddings, model, dimension = build_embeddings(get_settings('embeddings'))
+    return CachedEmbeddings(
+        embeddings,
+        model=model,
+        dimension=dimension,
+        max_entries=settings.get('max_entries', 2048),
+        ttl_seconds=settings.get('ttl_seconds', 3600),
+        path=EMBEDDING_CACHE_FILE if settings.get('persist', True) else None,
     )
-    return embeddings
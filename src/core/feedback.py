@@ -0,0 +1,264 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import gspread
+
+from src.core.embeddings import CACHE_PATH
+from src.core.utils import Shared, get_settings
+
+FEEDBACK_QUEUE_FILE = os.path.join(CACHE_PATH, 'feedback_queue.sqlite3')
+FEEDBACK_FILE = os.path.join(CACHE_PATH, 'feedback.jsonl')
+
+# Column order of the feedback worksheet
+FEEDBACK_COLUMNS = (
+    'session_id',
+    'inserted_at',
+    'user_message',
+    'assistant_message',
+    'feedback_score',
+    'feedback_text',
+)
+
+
+class JsonlFeedbackBackend:
+    """
+    Appends feedback rows to a local JSON lines file. Used for development
+    and tests, and as a fallback when the spreadsheet is not configured.
+
+    Attributes:
+        path (str): The JSON lines file.
+    """
+
+    def __init__(self, path: str = FEEDBACK_FILE):
+        self.path = path
+
+    def append(self, rows: List[Dict[str, Any]]):
+        """
+        Appends rows to the file.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+class GSheetsFeedbackBackend:
+    """
+    Appends feedback rows to a Google Sheets worksheet with one
+    `append_rows` call per batch, without reading the sheet.
+
+    Attributes:
+        credentials (Dict[str, Any]): Service account credentials, as in the
+        `connections.gsheets` Streamlit secrets.
+        spreadsheet (str): URL of the spreadsheet.
+        worksheet (str): Name of the worksheet.
+    """
+
+    def __init__(
+        self,
+        credentials: Dict[str, Any],
+        spreadsheet: str,
+        worksheet: str = 'feedback',
+    ):
+        self.credentials = credentials
+        self.spreadsheet = spreadsheet
+        self.worksheet = worksheet
+        self._worksheet = None
+
+    def _get_worksheet(self):
+        if self._worksheet is None:
+            client = gspread.service_account_from_dict(self.credentials)
+            self._worksheet = client.open_by_url(self.spreadsheet).worksheet(
+                self.worksheet
+            )
+        return self._worksheet
+
+    def append(self, rows: List[Dict[str, Any]]):
+        """
+        Appends rows to the worksheet, in the order of FEEDBACK_COLUMNS.
+        """
+        self._get_worksheet().append_rows(
+            [[row.get(column) for column in FEEDBACK_COLUMNS] for row in rows],
+            value_input_option='USER_ENTERED',
+        )
+
+
+class FeedbackLogger:
+    """
+    Durable, buffered feedback sink.
+
+    `log` only inserts the row in a local SQLite queue and returns, so the
+    UI never waits on the network. Every `flush_interval` seconds a
+    background thread sends the queued rows to the backend in batches with
+    append-only writes; a batch is
+    removed from the queue only after the backend accepted it, and failed
+    batches are retried with exponential backoff. Rows queued by a previous
+    process are sent when the next one starts.
+
+    Attributes:
+        backend: Object with an `append(rows)` method.
+        path (str): SQLite file of the queue.
+        batch_size (int): Maximum number of rows sent per call.
+        flush_interval (float): Seconds between two background flushes.
+        max_backoff (float): Longest wait between two retries, in seconds.
+    """
+
+    def __init__(
+        self,
+        backend,
+        path: str = FEEDBACK_QUEUE_FILE,
+        batch_size: int = 50,
+        flush_interval: float = 5.0,
+        max_backoff: float = 300.0,
+    ):
+        self.backend = backend
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._failures = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS feedback ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT, created_at REAL)'
+        )
+        self._connection.commit()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, row: Dict[str, Any]):
+        """
+        Queues one feedback row and returns immediately.
+
+        Args:
+            row (Dict[str, Any]): The feedback, keyed by FEEDBACK_COLUMNS.
+        """
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO feedback (row, created_at) VALUES (?, ?)',
+                (json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            self._connection.commit()
+
+    def pending(self) -> int:
+        """
+        Returns how many rows are waiting to be sent.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM feedback'
+            ).fetchone()[0]
+
+    def flush(self) -> int:
+        """
+        Sends every queued row to the backend, batch by batch.
+
+        Returns:
+            int: Number of rows sent.
+
+        Raises:
+            Exception: The backend error; the failed batch stays queued.
+        """
+        sent = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._connection.execute(
+                        'SELECT id, row FROM feedback ORDER BY id LIMIT ?',
+                        (self.batch_size,),
+                    ).fetchall()
+                if not batch:
+                    return sent
+                self.backend.append([json.loads(row) for _, row in batch])
+                with self._lock:
+                    self._connection.execute(
+                        'DELETE FROM feedback WHERE id <= ?', (batch[-1][0],)
+                    )
+                    self._connection.commit()
+                sent += len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.flush()
+                self._failures = 0
+                timeout = self.flush_interval
+            except Exception as e:
+                self._failures += 1
+                timeout = min(self.max_backoff, 2**self._failures)
+                print(
+                    f'Failed to send feedback, retrying in {timeout}s: {e}'
+                )
+            # Rows logged meanwhile are sent together in the next flush
+            self._stop.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """
+        Stops the background thread after a last flush attempt. Rows that
+        could not be sent stay queued for the next process.
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f'Feedback kept in the local queue: {e}')
+
+
+_shared_logger = Shared()
+
+
+def get_feedback_logger(
+    credentials: Optional[Dict[str, Any]] = None,
+) -> FeedbackLogger:
+    """
+    Returns the process-wide FeedbackLogger configured by the `feedback`
+    settings. The 'gsheets' backend needs the service account
+    `credentials`, which must include the `spreadsheet` URL; without them
+    rows go to the local JSON lines file.
+
+    Args:
+        credentials (Optional[Dict[str, Any]]): The `connections.gsheets`
+        Streamlit secrets.
+
+    Returns:
+        FeedbackLogger: The shared feedback logger.
+    """
+    return _shared_logger.get(lambda: _create_feedback_logger(credentials))
+
+
+def _create_feedback_logger(
+    credentials: Optional[Dict[str, Any]],
+) -> FeedbackLogger:
+    settings = get_settings('feedback')
+    if settings.get('backend', 'gsheets') == 'gsheets' and credentials:
+        credentials = dict(credentials)
+        spreadsheet = credentials.pop('spreadsheet')
+        credentials.pop('worksheet', None)
+        backend = GSheetsFeedbackBackend(
+            credentials,
+            spreadsheet=spreadsheet,
+            worksheet=settings.get('worksheet', 'feedback'),
+        )
+    else:
+        backend = JsonlFeedbackBackend(settings.get('path', FEEDBACK_FILE))
+    logger = FeedbackLogger(
+        backend,
+        batch_size=settings.get('batch_size', 50),
+        flush_interval=settings.get('flush_interval', 5.0),
+        max_backoff=settings.get('max_backoff', 300.0),
+    )
+    atexit.register(logger.close)
+    return logger
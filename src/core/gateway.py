@@ -0,0 +1,728 @@
+import asyncio
+import contextlib
+import dataclasses
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_google_genai import (
+    ChatGoogleGenerativeAI,
+    GoogleGenerativeAIEmbeddings,
+)
+from langchain_google_genai.embeddings import (
+    build_generative_service,
+    get_client_info,
+)
+from pydantic import Field
+from requests.adapters import HTTPAdapter
+
+from src.core.context import estimate_tokens
+from src.core.tracing import get_tracer
+from src.core.utils import Shared, get_settings
+
+# Lower values are admitted first
+PRIORITIES = {'interactive': 0, 'ingestion': 1}
+
+_RATE_LIMIT_MARKERS = (
+    '429',
+    'resourceexhausted',
+    'resource has been exhausted',
+    'quota',
+)
+
+
+class GatewayOverloadedError(RuntimeError):
+    """
+    Raised when the model gateway refuses a call because its queue is full
+    or the call waited longer than `max_wait` seconds.
+
+    Attributes:
+        retry_after (float): Suggested seconds to wait before retrying.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    Whether an exception raised by a model call is a quota error, or the
+    gateway refusing the call, either of which is worth retrying later.
+    """
+    if isinstance(error, GatewayOverloadedError):
+        return True
+    text = f'{type(error).__name__} {error}'.lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep the model calls under the
+    per-minute quotas of the API.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens kept in the bucket.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated_at) * self.rate,
+        )
+        self._updated_at = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """
+        Returns how many seconds until `tokens` tokens are available, 0 if
+        they are. Requests larger than the capacity wait for a full bucket.
+        """
+        with self._lock:
+            self._refill()
+            missing = min(tokens, self.capacity) - self._tokens
+            return max(0.0, missing / self.rate)
+
+    def take(self, tokens: float = 1):
+        """
+        Takes `tokens` tokens without waiting; the bucket may go negative,
+        which delays the next callers instead.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= min(tokens, self.capacity)
+
+    def acquire(self, tokens: float = 1):
+        """
+        Blocks until `tokens` tokens are available and takes them.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                wanted = min(tokens, self.capacity)
+                if self._tokens >= wanted:
+                    self._tokens -= wanted
+                    return
+                wait_for = (wanted - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class _Ticket:
+    """
+    A call waiting for admission, woken through a threading.Event or, for
+    coroutines, a future of their event loop.
+    """
+
+    def __init__(
+        self,
+        priority: int,
+        sequence: int,
+        tokens: int,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        self.key = (priority, sequence)
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        return self.key < other.key
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+            return
+        # The loop may be closed if the caller went away
+        with contextlib.suppress(RuntimeError):
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+@dataclasses.dataclass(kw_only=True, eq=False)
+class ModelGateway:
+    """
+    Process-wide gateway that every Gemini call goes through.
+
+    It keeps one client per model (and temperature), so all sessions share
+    their kept-alive connections; with the REST transport the connection
+    pool is sized to `max_concurrency`. Calls are admitted in priority
+    order, interactive chat before ingestion, while fewer than
+    `max_concurrency` are running and the request and token buckets allow
+    it. A call that finds `max_queue` calls waiting, or waits longer than
+    `max_wait` seconds, fails at once with GatewayOverloadedError. A quota
+    error from the API pauses every call for `throttle_seconds`.
+
+    Attributes:
+        max_concurrency (int): Calls running at the same time.
+        max_queue (int): Calls waiting before new ones are refused.
+        max_wait (float): Seconds a call may wait for admission.
+        requests_per_minute (Optional[float]): Calls admitted per minute,
+        unlimited if None.
+        tokens_per_minute (Optional[float]): Estimated prompt tokens
+        admitted per minute, unlimited if None.
+        throttle_seconds (float): Pause after a quota error.
+        transport (Optional[str]): 'rest' or 'grpc', the SDK's default if
+        None.
+        endpoint (Optional[str]): API endpoint, e.g. a local stub server.
+    """
+
+    max_concurrency: int = 8
+    max_queue: int = 64
+    max_wait: float = 30.0
+    requests_per_minute: Optional[float] = 1000
+    tokens_per_minute: Optional[float] = None
+    throttle_seconds: float = 10.0
+    transport: Optional[str] = None
+    endpoint: Optional[str] = None
+
+    def __post_init__(self):
+        self._requests = (
+            TokenBucket(self.requests_per_minute)
+            if self.requests_per_minute
+            else None
+        )
+        self._tokens = (
+            TokenBucket(self.tokens_per_minute)
+            if self.tokens_per_minute
+            else None
+        )
+        self._lock = threading.Lock()
+        self._queue: List[_Ticket] = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._counters = {
+            'admitted': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'throttled': 0,
+        }
+        self._max_queued = 0
+        self._wait_seconds = 0.0
+        self._clients: Dict[tuple, Any] = {}
+        self._clients_lock = threading.Lock()
+
+    def _buckets(self, ticket: _Ticket) -> List[Tuple[TokenBucket, int]]:
+        buckets = []
+        if self._requests is not None:
+            buckets.append((self._requests, 1))
+        if self._tokens is not None:
+            buckets.append((self._tokens, ticket.tokens))
+        return buckets
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Admits the calls at the head of the queue while there is room. Must
+        be called with the lock held.
+
+        Returns:
+            Optional[float]: Seconds until the rate limits may admit the
+            next call, or None if nothing is waiting on them.
+        """
+        while self._queue and self._active < self.max_concurrency:
+            now = time.monotonic()
+            if self._paused_until > now:
+                return self._paused_until - now
+            ticket = self._queue[0]
+            buckets = self._buckets(ticket)
+            wait = max(
+                (bucket.wait_time(amount) for bucket, amount in buckets),
+                default=0.0,
+            )
+            if wait > 0:
+                return wait
+            for bucket, amount in buckets:
+                bucket.take(amount)
+            heapq.heappop(self._queue)
+            self._active += 1
+            self._counters['admitted'] += 1
+            self._wait_seconds += now - ticket.enqueued_at
+            ticket.grant()
+        return None
+
+    def retry_after(self) -> float:
+        """
+        Returns the seconds a refused caller should wait before retrying.
+        """
+        return max(1.0, self._paused_until - time.monotonic())
+
+    def _enqueue(
+        self,
+        priority: str,
+        tokens: int,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> Tuple[_Ticket, Optional[float]]:
+        if priority not in PRIORITIES:
+            raise ValueError(f'Invalid priority: {priority}')
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise GatewayOverloadedError(
+                    f'Model gateway queue is full ({self.max_queue} calls '
+                    'waiting)',
+                    self.retry_after(),
+                )
+            ticket = _Ticket(
+                PRIORITIES[priority], next(self._sequence), tokens, loop
+            )
+            heapq.heappush(self._queue, ticket)
+            self._max_queued = max(self._max_queued, len(self._queue))
+            return ticket, self._dispatch()
+
+    def _poll(self, ticket: _Ticket) -> Tuple[bool, Optional[float]]:
+        """
+        Dispatches again after a waiter woke up without being admitted.
+        Gives up on the ticket once its deadline has passed.
+        """
+        with self._lock:
+            retry_in = self._dispatch()
+            if ticket.granted:
+                return True, None
+            if time.monotonic() < ticket.enqueued_at + self.max_wait:
+                return False, retry_in
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._counters['timed_out'] += 1
+        raise GatewayOverloadedError(
+            f'Model call waited more than {self.max_wait}s for admission',
+            self.retry_after(),
+        )
+
+    def _timeout(self, ticket: _Ticket, retry_in: Optional[float]) -> float:
+        remaining = ticket.enqueued_at + self.max_wait - time.monotonic()
+        if retry_in is not None:
+            remaining = min(remaining, retry_in)
+        return max(0.0, remaining)
+
+    def _abandon(self, ticket: _Ticket):
+        with self._lock:
+            if ticket.granted:
+                self._active -= 1
+                self._dispatch()
+            elif ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+
+    def acquire(self, priority: str = 'interactive', tokens: int = 1):
+        """
+        Blocks until a call is admitted. Every successful `acquire` must be
+        followed by a `release` of the returned ticket.
+
+        Args:
+            priority (str): 'interactive' or 'ingestion'.
+            tokens (int): Estimated tokens of the call.
+
+        Raises:
+            GatewayOverloadedError: If the queue is full or the wait times
+            out.
+        """
+        ticket, retry_in = self._enqueue(priority, tokens)
+        try:
+            while not ticket.event.wait(self._timeout(ticket, retry_in)):
+                granted, retry_in = self._poll(ticket)
+                if granted:
+                    break
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return ticket
+
+    async def aacquire(self, priority: str = 'interactive', tokens: int = 1):
+        """
+        Asynchronous version of `acquire`; waiting does not block the event
+        loop, and a cancelled waiter leaves the queue.
+        """
+        ticket, retry_in = self._enqueue(
+            priority, tokens, asyncio.get_running_loop()
+        )
+        try:
+            await self._wait_granted(ticket, retry_in)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return ticket
+
+    async def _wait_granted(self, ticket: _Ticket, retry_in: Optional[float]):
+        while not ticket.future.done():
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(ticket.future),
+                    self._timeout(ticket, retry_in),
+                )
+            except asyncio.TimeoutError:
+                granted, retry_in = self._poll(ticket)
+                if granted:
+                    return
+
+    def release(self, ticket: _Ticket):
+        """
+        Frees the slot of a finished call and admits the next one.
+        """
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def throttle(self):
+        """
+        Pauses the admission of every call after a quota error.
+        """
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + self.throttle_seconds
+            )
+            self._counters['throttled'] += 1
+
+    def _failed(self, error: Exception):
+        if is_rate_limit_error(error) and not isinstance(
+            error, GatewayOverloadedError
+        ):
+            print(f'Model quota exceeded, pausing calls: {error}')
+            self.throttle()
+
+    @contextlib.contextmanager
+    def admit(
+        self, priority: str = 'interactive', tokens: int = 1
+    ) -> Iterator[None]:
+        """
+        Runs the body as one admitted model call.
+        """
+        with get_tracer().span('gateway.wait', priority=priority):
+            ticket = self.acquire(priority, tokens)
+        try:
+            yield
+        except Exception as e:
+            self._failed(e)
+            raise
+        finally:
+            self.release(ticket)
+
+    @contextlib.asynccontextmanager
+    async def aadmit(
+        self, priority: str = 'interactive', tokens: int = 1
+    ) -> AsyncIterator[None]:
+        """
+        Asynchronous version of `admit`.
+        """
+        with get_tracer().span('gateway.wait', priority=priority):
+            ticket = await self.aacquire(priority, tokens)
+        try:
+            yield
+        except Exception as e:
+            self._failed(e)
+            raise
+        finally:
+            self.release(ticket)
+
+    def saturated(self) -> bool:
+        """
+        Whether new calls are being refused because the queue is full.
+        """
+        with self._lock:
+            return len(self._queue) >= self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the queue depth per priority, the running calls and the
+        admission counters.
+        """
+        names = {value: name for name, value in PRIORITIES.items()}
+        with self._lock:
+            queued = {name: 0 for name in PRIORITIES}
+            for ticket in self._queue:
+                queued[names[ticket.priority]] += 1
+            admitted = self._counters['admitted']
+            return {
+                'active': self._active,
+                'queued': queued,
+                'max_queued': self._max_queued,
+                **self._counters,
+                'mean_wait_seconds': self._wait_seconds / max(1, admitted),
+            }
+
+    def to_prometheus(self, prefix: str = 'iracema') -> str:
+        """
+        Exports the gateway metrics in the Prometheus text format.
+        """
+        stats = self.stats()
+        metric = f'{prefix}_gateway'
+        lines = [
+            f'# HELP {metric}_queue_depth Model calls waiting for admission.',
+            f'# TYPE {metric}_queue_depth gauge',
+        ]
+        for priority, count in stats['queued'].items():
+            lines.append(
+                f'{metric}_queue_depth{{priority="{priority}"}} {count}'
+            )
+        lines += [
+            f'# HELP {metric}_active_calls Model calls running.',
+            f'# TYPE {metric}_active_calls gauge',
+            f'{metric}_active_calls {stats["active"]}',
+            f'# HELP {metric}_calls_total Model calls by admission outcome.',
+            f'# TYPE {metric}_calls_total counter',
+        ]
+        for outcome in ('admitted', 'rejected', 'timed_out'):
+            lines.append(
+                f'{metric}_calls_total{{outcome="{outcome}"}} {stats[outcome]}'
+            )
+        lines += [
+            f'# HELP {metric}_throttled_total Quota errors from the API.',
+            f'# TYPE {metric}_throttled_total counter',
+            f'{metric}_throttled_total {stats["throttled"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        kwargs = {}
+        if self.transport:
+            kwargs['transport'] = self.transport
+        if self.endpoint:
+            kwargs['client_options'] = {'api_endpoint': self.endpoint}
+        return kwargs
+
+    def _size_pool(self, client: Any):
+        # The REST transport keeps its connections in a requests Session
+        session = getattr(getattr(client, 'transport', None), '_session', None)
+        if session is None:
+            return
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_concurrency
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    def chat_model(self, model: str, temperature: float) -> 'GatewayChatModel':
+        """
+        Returns the shared chat model for a Gemini model and temperature.
+        """
+        key = ('chat', model, temperature)
+        with self._clients_lock:
+            if key not in self._clients:
+                llm = ChatGoogleGenerativeAI(
+                    model=model,
+                    temperature=temperature,
+                    **self._client_kwargs(),
+                )
+                self._size_pool(llm.client)
+                self._clients[key] = GatewayChatModel(llm=llm, gateway=self)
+            return self._clients[key]
+
+    def embeddings(self, model: str) -> 'GatewayEmbeddings':
+        """
+        Returns the shared embedding function for a Gemini model.
+        """
+        key = ('embeddings', model)
+        with self._clients_lock:
+            if key not in self._clients:
+                embeddings = GoogleGenerativeAIEmbeddings(
+                    model=model, **self._client_kwargs()
+                )
+                if self.transport:
+                    # The embeddings wrapper does not pass `transport` on
+                    embeddings.client = _rebuild_client(
+                        embeddings, self.transport
+                    )
+                self._size_pool(embeddings.client)
+                self._clients[key] = GatewayEmbeddings(embeddings, self)
+            return self._clients[key]
+
+
+def _rebuild_client(embeddings: Any, transport: str) -> Any:
+    # Built with the helpers the wrapper's own validator uses
+    return build_generative_service(
+        credentials=embeddings.credentials,
+        api_key=embeddings.google_api_key.get_secret_value()
+        if embeddings.google_api_key
+        else None,
+        client_info=get_client_info('GoogleGenerativeAIEmbeddings'),
+        client_options=embeddings.client_options,
+        transport=transport,
+    )
+
+
+def _messages_tokens(messages: List[BaseMessage]) -> int:
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    Chat model whose calls are admitted by a ModelGateway. A streamed
+    answer holds its slot until the last chunk.
+
+    Attributes:
+        llm (BaseChatModel): The wrapped model.
+        gateway (ModelGateway): The gateway admitting the calls.
+        priority (str): Priority of the calls.
+    """
+
+    llm: BaseChatModel
+    gateway: Any = Field(exclude=True)
+    priority: str = 'interactive'
+
+    @property
+    def _llm_type(self) -> str:
+        return f'gateway-{self.llm._llm_type}'
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.llm._identifying_params
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        with self.gateway.admit(self.priority, _messages_tokens(messages)):
+            return self.llm._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        async with self.gateway.aadmit(
+            self.priority, _messages_tokens(messages)
+        ):
+            if self.gateway.transport == 'rest':
+                return await asyncio.to_thread(
+                    self.llm._generate, messages, stop, None, **kwargs
+                )
+            return await self.llm._agenerate(
+                messages, stop, run_manager, **kwargs
+            )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        with self.gateway.admit(self.priority, _messages_tokens(messages)):
+            yield from self.llm._stream(messages, stop, run_manager, **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.gateway.aadmit(
+            self.priority, _messages_tokens(messages)
+        ):
+            if self.gateway.transport == 'rest':
+                chunks = self._stream_in_thread(messages, stop, **kwargs)
+            else:
+                chunks = self.llm._astream(
+                    messages, stop, run_manager, **kwargs
+                )
+            async for chunk in chunks:
+                yield chunk
+
+    async def _stream_in_thread(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        # The SDK's async client only speaks gRPC, so REST streams are read
+        # by worker threads
+        iterator = self.llm._stream(messages, stop, None, **kwargs)
+        done = object()
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, iterator, done)
+                if chunk is done:
+                    return
+                yield chunk
+        finally:
+            await asyncio.to_thread(iterator.close)
+
+
+class GatewayEmbeddings(Embeddings):
+    """
+    Embedding function whose calls are admitted by a ModelGateway. Query
+    embeddings are interactive; document embeddings are ingestion, unless
+    they are queries embedded in a batch (task type 'retrieval_query').
+    Other attributes are read from the wrapped embedding function.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding function.
+        gateway (ModelGateway): The gateway admitting the calls.
+    """
+
+    def __init__(self, embeddings: Embeddings, gateway: ModelGateway):
+        self.embeddings = embeddings
+        self.gateway = gateway
+
+    def __getattr__(self, name: str) -> Any:
+        if name in {'embeddings', 'gateway'}:
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.gateway.admit('interactive', estimate_tokens(text)):
+            return self.embeddings.embed_query(text)
+
+    def embed_documents(
+        self, texts: List[str], **kwargs: Any
+    ) -> List[List[float]]:
+        priority = (
+            'interactive'
+            if kwargs.get('task_type') == 'retrieval_query'
+            else 'ingestion'
+        )
+        tokens = sum(estimate_tokens(text) for text in texts)
+        with self.gateway.admit(priority, tokens):
+            return self.embeddings.embed_documents(texts, **kwargs)
+
+
+_shared_gateway = Shared()
+
+
+def get_gateway() -> ModelGateway:
+    """
+    Returns the process-wide model gateway configured by the `gateway`
+    settings.
+    """
+    return _shared_gateway.get(_create_gateway)
+
+
+def _create_gateway() -> ModelGateway:
+    settings = get_settings('gateway')
+    return ModelGateway(
+        max_concurrency=settings.get('max_concurrency', 8),
+        max_queue=settings.get('max_queue', 64),
+        max_wait=settings.get('max_wait', 30.0),
+        requests_per_minute=settings.get('requests_per_minute', 1000),
+        tokens_per_minute=settings.get('tokens_per_minute'),
+        throttle_seconds=settings.get('throttle_seconds', 10.0),
+        transport=settings.get('transport'),
+        endpoint=settings.get('endpoint'),
+    )
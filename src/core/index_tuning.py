@@ -0,0 +1,201 @@
+import dataclasses
+import itertools
+import math
+import time
+import uuid
+from typing import Any, Dict, List, Sequence, Tuple
+
+import chromadb
+import numpy as np
+
+SPACES = ('l2', 'cosine', 'ip')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def load_vectors(
+    collection, batch_size: int = 1000
+) -> Tuple[List[str], np.ndarray]:
+    """
+    Reads every ID and stored vector of a Chroma collection.
+
+    Args:
+        collection (Collection): The chromadb collection.
+        batch_size (int): Vectors read per call.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The IDs and a float32 matrix with one
+        row per ID.
+    """
+    ids, vectors = [], []
+    for offset in range(0, collection.count(), batch_size):
+        items = collection.get(
+            limit=batch_size, offset=offset, include=['embeddings']
+        )
+        ids.extend(items['ids'])
+        vectors.extend(items['embeddings'])
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def sample_queries(
+    vectors: np.ndarray, count: int, seed: int = 0
+) -> np.ndarray:
+    """
+    Builds query vectors offline as midpoints of random pairs of stored
+    vectors, so they fall between chunks like real questions do and no
+    embedding call is needed.
+    """
+    generator = np.random.default_rng(seed)
+    first = generator.integers(0, len(vectors), count)
+    second = generator.integers(0, len(vectors), count)
+    return (vectors[first] + vectors[second]) / 2
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(
+        np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12
+    )
+
+
+def exact_neighbours(
+    vectors: np.ndarray, queries: np.ndarray, k: int, space: str
+) -> np.ndarray:
+    """
+    Brute-force nearest neighbours in the given HNSW space.
+
+    Returns:
+        np.ndarray: Row indices of the `k` nearest vectors of every query,
+        closest first.
+    """
+    if space not in SPACES:
+        raise ValueError(f'Invalid HNSW space: {space}')
+    if space == 'cosine':
+        vectors, queries = _unit_rows(vectors), _unit_rows(queries)
+    scores = queries @ vectors.T
+    if space == 'l2':
+        # Smaller distance is better: rank by -|v|^2 + 2 q.v
+        scores = 2 * scores - np.sum(vectors * vectors, axis=1)
+    k = min(k, len(vectors))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _latency(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        f'p{int(quantile * 100)}_ms': 1000
+        * values[max(0, math.ceil(quantile * len(values)) - 1)]
+        for quantile in QUANTILES
+    }
+
+
+def evaluate(
+    collection,
+    ids: List[str],
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+) -> Dict[str, Any]:
+    """
+    Measures the recall@k of a collection against exact search and its
+    single-query latency, as in the serving path.
+
+    Args:
+        collection (Collection): The chromadb collection.
+        ids (List[str]): The IDs, in the row order used by `truth`.
+        queries (np.ndarray): The query vectors.
+        truth (np.ndarray): The exact neighbours (see `exact_neighbours`).
+        k (int): Number of results per query.
+
+    Returns:
+        Dict[str, Any]: `recall` and p50/p95/p99 latencies in ms.
+    """
+    hits = 0
+    latencies = []
+    for query, expected in zip(queries, truth):
+        started_at = time.perf_counter()
+        result = collection.query(
+            query_embeddings=[query.tolist()], n_results=k, include=[]
+        )
+        latencies.append(time.perf_counter() - started_at)
+        hits += len(set(result['ids'][0]) & {ids[i] for i in expected})
+    return {
+        'recall': hits / max(1, truth.size),
+        **_latency(latencies),
+    }
+
+
+@dataclasses.dataclass(frozen=True)
+class SweepGrid:
+    """
+    SweepGrid holds the HNSW parameters `sweep` builds in-memory copies
+    with; every combination of them is evaluated.
+
+    Attributes:
+        space (str): Distance function of the copies ('l2', 'cosine' or
+        'ip'), normally the one of the stored collection.
+        m_values (Sequence[int]): Values of `hnsw:M`.
+        construction_efs (Sequence[int]): Values of `hnsw:construction_ef`.
+        search_efs (Sequence[int]): Values of `hnsw:search_ef`.
+        batch_size (int): Vectors added per call while building a copy.
+    """
+
+    space: str
+    m_values: Sequence[int]
+    construction_efs: Sequence[int]
+    search_efs: Sequence[int]
+    batch_size: int = 1000
+
+
+def sweep(
+    ids: List[str],
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    grid: SweepGrid,
+) -> List[Dict[str, Any]]:
+    """
+    Builds an in-memory copy of the vectors for every combination of HNSW
+    parameters and evaluates it, without touching the stored collection.
+
+    Returns:
+        List[Dict[str, Any]]: One row per combination with the parameters,
+        the build time in seconds, the recall and the latencies.
+    """
+    client = chromadb.EphemeralClient()
+    space = grid.space
+    batch_size = grid.batch_size
+    truth = exact_neighbours(vectors, queries, k, space)
+    rows = []
+    for m, construction_ef, search_ef in itertools.product(
+        grid.m_values, grid.construction_efs, grid.search_efs
+    ):
+        name = f'sweep-{uuid.uuid4().hex}'
+        collection = client.create_collection(
+            name,
+            metadata={
+                'hnsw:space': space,
+                'hnsw:M': m,
+                'hnsw:construction_ef': construction_ef,
+                'hnsw:search_ef': search_ef,
+            },
+        )
+        try:
+            started_at = time.perf_counter()
+            for start in range(0, len(ids), batch_size):
+                collection.add(
+                    ids=ids[start : start + batch_size],
+                    embeddings=vectors[start : start + batch_size],
+                )
+            build_seconds = time.perf_counter() - started_at
+            rows.append({
+                'space': space,
+                'M': m,
+                'construction_ef': construction_ef,
+                'search_ef': search_ef,
+                'build_seconds': build_seconds,
+                **evaluate(collection, ids, queries, truth, k),
+            })
+        finally:
+            client.delete_collection(name)
+    return rows
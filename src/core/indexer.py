@@ -0,0 +1,495 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+from src.core.chunker import get_chunker
+from src.core.database import (
+    CHROMA_PATH,
+    LEXICAL_INDEX_FILE,
+    Database,
+    assign_chunk_ids,
+    bump_corpus_version,
+    load_lexical_index,
+)
+from src.core.dedupe import DuplicateIndex, update_occurrences
+from src.core.docstore import PAGE_STORE_FILE, PageStore, load_page_store
+from src.core.embedding_pipeline import (
+    EmbeddingCheckpoint,
+    embed_and_upsert,
+    embedding_stages,
+)
+from src.core.loader import (
+    PDFS_PATH,
+    iter_pdf_pages,
+    list_pdf_files,
+    split_documents,
+)
+from src.core.pipeline import Stage, run_pipeline
+from src.core.router import build_router
+from src.core.tracing import traced
+from src.core.utils import get_settings
+
+MANIFEST_FILE = os.path.join(CHROMA_PATH, 'index_manifest.json')
+DUPLICATE_INDEX_FILE = os.path.join(CHROMA_PATH, 'duplicate_index.json.gz')
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the SHA-256 digest of a file's bytes.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """
+    Returns the SHA-256 digest of a page's text.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def load_manifest() -> Dict[str, Any]:
+    """
+    Loads the index manifest, which records, for every indexed file, its
+    content hash and the hash and chunk IDs of each of its pages.
+
+    Returns:
+        Dict[str, Any]: The manifest, empty if the collection has not been
+        indexed incrementally yet.
+    """
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'files': {}}
+
+
+def save_manifest(manifest: Dict[str, Any]):
+    """
+    Atomically writes the index manifest next to the collection.
+    """
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    tmp_path = f'{MANIFEST_FILE}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def load_duplicate_index(db: Database) -> Optional[DuplicateIndex]:
+    """
+    Loads the near-duplicate index kept beside the collection, configured by
+    the `dedupe` settings. A collection indexed without it has every stored
+    chunk registered as a canonical chunk. Members that no longer reach the
+    threshold are left as orphans for `_store_orphans`.
+
+    Returns:
+        Optional[DuplicateIndex]: The index, or None if deduplication is
+        disabled.
+    """
+    settings = get_settings('dedupe')
+    if not settings.get('enabled', False):
+        # Chunks stored from now on would be missing from an old index
+        if os.path.exists(DUPLICATE_INDEX_FILE):
+            os.remove(DUPLICATE_INDEX_FILE)
+        return None
+    duplicates = DuplicateIndex(
+        threshold=settings.get('threshold', 0.9),
+        num_perm=settings.get('num_perm', 128),
+        bands=settings.get('bands', 32),
+        shingle_size=settings.get('shingle_size', 3),
+    )
+    if not duplicates.load(DUPLICATE_INDEX_FILE):
+        duplicates.add_collection(db)
+    released = duplicates.check_members()
+    if released:
+        print(f'👉 Duplicates below the threshold: {released}')
+    return duplicates
+
+
+def open_page_store() -> Optional[PageStore]:
+    """
+    Loads the page store kept beside the collection, or returns None if the
+    `docstore` settings disable it.
+    """
+    if not get_settings('docstore').get('enabled', True):
+        # Pages indexed from now on would be missing from an old store
+        if os.path.exists(PAGE_STORE_FILE):
+            os.remove(PAGE_STORE_FILE)
+        return None
+    return load_page_store()
+
+
+def _chunk_index(chunk_id: str) -> int:
+    return int(chunk_id.rsplit(':', 1)[1])
+
+
+@traced('ingest.split_page')
+def split_page(page: Document) -> List[Tuple[Document, Optional[list]]]:
+    """
+    Splits one page into chunks with positional IDs, using the chunking
+    mode of the `chunking` settings: 'semantic' embeds the chunks after
+    SemanticChunker, 'reuse' keeps the vectors pooled from the sentence
+    embeddings computed while chunking.
+
+    Args:
+        page (Document): The page to split.
+
+    Returns:
+        List[Tuple[Document, Optional[list]]]: The chunks, each with its
+        precomputed vector or None.
+    """
+    if get_settings('chunking').get('mode', 'semantic') == 'reuse':
+        pairs = get_chunker().split_documents([page])
+        assign_chunk_ids([chunk for chunk, _ in pairs])
+        return pairs
+    return [
+        (chunk, None)
+        for chunk in assign_chunk_ids(split_documents([page]))
+    ]
+
+
+def split_stage(page_store: Optional[PageStore] = None) -> Stage:
+    """
+    Builds the stage that splits one page into chunks with positional IDs.
+    Pages are split one at a time, which yields the same chunks and IDs as
+    splitting a whole document, since chunks never span pages. The chunks
+    are passed on in page order, whatever the number of workers. Each page
+    is also recorded in the `page_store`, if given, with the spans of its
+    chunks.
+
+    Returns:
+        Stage: The split stage of the ingestion pipeline.
+    """
+
+    def split(page: Document) -> List[Tuple[Document, Optional[list]]]:
+        pairs = split_page(page)
+        page_store.add_page(page, [chunk for chunk, _ in pairs])
+        return pairs
+
+    return Stage(
+        'split',
+        split_page if page_store is None else split,
+        workers=get_settings('ingestion').get('split_workers', 2),
+        ordered=True,
+    )
+
+
+def dedupe_stage(duplicates: DuplicateIndex, stats: Dict[str, int]) -> Stage:
+    """
+    Builds the stage that drops the chunks that are near duplicates of a
+    stored chunk, after recording them as its occurrences. It runs in a
+    single thread after the ordered split stage, so the chunk stored for a
+    cluster is always its first one in file and page order.
+
+    Returns:
+        Stage: The dedupe stage of the ingestion pipeline.
+    """
+
+    def dedupe(pair: Tuple[Document, Optional[list]]):
+        if duplicates.assign(pair[0]) is None:
+            return [pair]
+        stats['duplicate_chunks'] += 1
+        return []
+
+    return Stage('dedupe', dedupe)
+
+
+def _changed_pages(
+    files: Dict[str, Any],
+    changed_files: Dict[str, str],
+    stale_ids: Set[str],
+    stats: Dict[str, int],
+    duplicates: Optional[DuplicateIndex] = None,
+) -> Iterator[Document]:
+    """
+    Streams the pages of the changed files whose text changed, updating the
+    manifest entries, collecting the chunk IDs that became stale and
+    discarding the stale pages from the near-duplicate index.
+    """
+    old_pages = {
+        source: files[source]['pages'] if source in files else {}
+        for source in changed_files
+    }
+    for source, file_digest in changed_files.items():
+        files[source] = {'hash': file_digest, 'pages': {}}
+
+    for page in iter_pdf_pages(list(changed_files)):
+        source = page.metadata['source']
+        page_key = str(page.metadata['page'])
+        page_digest = hash_text(page.page_content)
+        old_page = old_pages[source].pop(page_key, None)
+        if old_page is not None and old_page['hash'] == page_digest:
+            files[source]['pages'][page_key] = old_page
+            continue
+        if old_page is not None:
+            stale_ids.update(old_page['chunk_ids'])
+        if duplicates is not None:
+            duplicates.discard_page(source, page_key)
+        files[source]['pages'][page_key] = {
+            'hash': page_digest,
+            'chunk_ids': [],
+        }
+        stats['changed_pages'] += 1
+        yield page
+
+    # Whatever is left belongs to pages that no longer exist
+    for source, pages in old_pages.items():
+        for page_key, old_page in pages.items():
+            stale_ids.update(old_page['chunk_ids'])
+            if duplicates is not None:
+                duplicates.discard_page(source, page_key)
+
+
+def _record_chunk(
+    files: Dict[str, Any], chunk: Document, new_ids: Set[str], lexical_index
+):
+    source = chunk.metadata['source']
+    page_key = str(chunk.metadata['page'])
+    files[source]['pages'][page_key]['chunk_ids'].append(chunk.metadata['id'])
+    new_ids.add(chunk.metadata['id'])
+    lexical_index.add([chunk])
+
+
+def _scan_files(
+    files: Dict[str, Any], current_files: List[str], stats: Dict[str, int]
+) -> Tuple[Dict[str, str], Set[str], List[Tuple[str, str]]]:
+    """
+    Drops the removed files from the manifest and hashes the current ones.
+
+    Returns:
+        Tuple[Dict[str, str], Set[str], List[Tuple[str, str]]]: The digest
+        of every new or changed file, the chunk IDs of the removed files
+        and their (source, page) pairs.
+    """
+    stale_ids = set()
+    removed_pages = []
+    for source in set(files) - set(current_files):
+        print(f'🗑️ Removing {source}')
+        for page_key, page in files.pop(source)['pages'].items():
+            stale_ids.update(page['chunk_ids'])
+            removed_pages.append((source, page_key))
+
+    changed_files = {}
+    for source in current_files:
+        file_digest = hash_file(source)
+        entry = files.get(source)
+        if entry is not None and entry['hash'] == file_digest:
+            stats['skipped_files'] += 1
+            continue
+        changed_files[source] = file_digest
+    return changed_files, stale_ids, removed_pages
+
+
+def _unrecorded_ids(
+    db: Database, files: Dict[str, Any], changed_files: Dict[str, str]
+) -> Set[str]:
+    """
+    Returns the chunk IDs stored for changed files the manifest has no entry
+    for, e.g. in a collection built before the manifest existed. Nothing
+    records which of them are still current, so they are all treated as
+    stale.
+    """
+    stale_ids = set()
+    for source in changed_files:
+        if source in files:
+            continue
+        stale_ids.update(
+            db.database.get(where={'source': source}, include=[])['ids']
+        )
+    return stale_ids
+
+
+def _backfill_pages(
+    page_store: PageStore,
+    files: Dict[str, Any],
+    db: Database,
+    changed_files: Dict[str, str],
+):
+    """
+    Fills the page store of a collection indexed before it existed: the
+    unchanged files are parsed again and matched with their stored chunks,
+    without splitting or embedding anything.
+    """
+    sources = [source for source in files if source not in changed_files]
+    if not sources:
+        return
+    print(f'📄 Filling the page store: {len(sources)} files')
+    for page in iter_pdf_pages(sources):
+        entry = files[page.metadata['source']]['pages'].get(
+            str(page.metadata['page'])
+        )
+        chunk_ids = entry['chunk_ids'] if entry else []
+        items = (
+            db.database.get(ids=chunk_ids, include=['documents'])
+            if chunk_ids
+            else {'ids': [], 'documents': []}
+        )
+        chunks = sorted(
+            (
+                Document(page_content=text, metadata={'id': chunk_id})
+                for chunk_id, text in zip(items['ids'], items['documents'])
+            ),
+            key=lambda chunk: _chunk_index(chunk.metadata['id']),
+        )
+        page_store.add_page(page, chunks)
+
+
+def _save_derived_indexes(
+    db: Database,
+    files: Dict[str, Any],
+    page_store: Optional[PageStore],
+    backfill: Optional[Dict[str, str]],
+):
+    """
+    Saves the page store, after filling it if `backfill` holds the changed
+    files of a run that found it empty, and rebuilds the document router.
+    """
+    if page_store is not None:
+        if backfill is not None:
+            _backfill_pages(page_store, files, db, backfill)
+        page_store.retain(
+            f'{source}:{page_key}'
+            for source, entry in files.items()
+            for page_key in entry['pages']
+        )
+        page_store.save(PAGE_STORE_FILE)
+    if get_settings('router').get('enabled', True):
+        build_router(db)
+
+
+def _store_orphans(
+    duplicates: DuplicateIndex,
+    db: Database,
+    record: Callable[[Document], None],
+    stats: Dict[str, int],
+):
+    """
+    Assigns again the copies whose stored chunk went stale, and embeds and
+    stores those that no longer duplicate any stored chunk, passing each of
+    them to `record`.
+    """
+    orphans = duplicates.take_orphans()
+    promoted = [
+        orphan for orphan in orphans if duplicates.assign(orphan) is None
+    ]
+    stats['duplicate_chunks'] += len(orphans) - len(promoted)
+    if promoted:
+        print(f'👉 Storing former duplicates: {len(promoted)}')
+        embed_and_upsert(promoted, db)
+        for chunk in promoted:
+            record(chunk)
+
+
+@traced('ingest.index_directory')
+def index_directory(path: str = PDFS_PATH) -> Dict[str, int]:
+    """
+    Incrementally indexes the PDF files of a directory into Chroma.
+
+    Files whose bytes did not change since the last run are skipped without
+    being parsed. For changed files, only the pages whose text changed are
+    chunked and embedded again. Pages stream through the load, split, embed
+    and upsert stages of the ingestion pipeline, so memory use does not grow
+    with the corpus. The chunks of changed or removed pages that were not
+    overwritten are deleted in one batch at the end, and so are the stored
+    chunks of files missing from the manifest. The BM25 index kept
+    beside the collection receives the same upserts and deletions, and the
+    document router is rebuilt from the stored vectors. The page store
+    records the text of every split page and the spans of its chunks, for
+    small-to-big retrieval.
+
+    When the `dedupe` settings enable it, near-duplicate chunks are stored
+    once: the other copies are not embedded, and their sources and pages
+    are recorded in the 'occurrences' metadata of the stored chunk. Copies
+    whose stored chunk went stale are assigned again, and stored if nothing
+    else matches them.
+
+    Args:
+        path (str): Directory containing the PDF files.
+
+    Returns:
+        Dict[str, int]: Counters of skipped files, changed pages, upserted
+        chunks, duplicate chunks that were not stored and deleted chunks.
+    """
+    manifest = load_manifest()
+    files = manifest.setdefault('files', {})
+    current_files = list_pdf_files(path)
+    stats = {
+        'skipped_files': 0,
+        'changed_pages': 0,
+        'upserted_chunks': 0,
+        'duplicate_chunks': 0,
+        'deleted_chunks': 0,
+    }
+
+    changed_files, stale_ids, removed_pages = _scan_files(
+        files, current_files, stats
+    )
+    page_store = open_page_store()
+    backfill = page_store is not None and not len(page_store) and files
+    # Removed pages may hold only duplicates, which have no stored chunk
+    if not changed_files and not removed_pages and not backfill:
+        print('✅ Index is up to date')
+        return stats
+
+    new_ids = set()
+    db = Database()
+    try:
+        lexical_index = load_lexical_index(db)
+        stale_ids.update(_unrecorded_ids(db, files, changed_files))
+
+        def record(chunk: Document):
+            _record_chunk(files, chunk, new_ids, lexical_index)
+
+        duplicates = load_duplicate_index(db)
+        if duplicates is not None:
+            for source, page_key in removed_pages:
+                duplicates.discard_page(source, page_key)
+        if changed_files:
+            print(f'👉 Indexing changed files: {len(changed_files)}')
+            pages = _changed_pages(
+                files, changed_files, stale_ids, stats, duplicates
+            )
+            stages = [split_stage(page_store), *embedding_stages(db)]
+            if duplicates is not None:
+                stages.insert(1, dedupe_stage(duplicates, stats))
+            for chunk in run_pipeline(
+                pages, stages, get_settings('ingestion').get('queue_size', 8)
+            ):
+                record(chunk)
+            EmbeddingCheckpoint().clear()
+
+        if duplicates is not None:
+            _store_orphans(duplicates, db, record, stats)
+
+        # Upserts overwrite reused IDs, so only IDs that vanished are deleted
+        stale_ids.difference_update(new_ids)
+        if stale_ids:
+            print(f'🗑️ Deleting stale chunks: {len(stale_ids)}')
+            db.database.delete(ids=sorted(stale_ids))
+            lexical_index.remove(stale_ids)
+        if duplicates is not None:
+            update_occurrences(
+                duplicates, duplicates.take_touched(), db, lexical_index
+            )
+            duplicates.save(DUPLICATE_INDEX_FILE)
+        lexical_index.save(LEXICAL_INDEX_FILE)
+        _save_derived_indexes(
+            db, files, page_store, changed_files if backfill else None
+        )
+    finally:
+        db.close()
+
+    for entry in files.values():
+        for page in entry['pages'].values():
+            page['chunk_ids'].sort(key=_chunk_index)
+    bump_corpus_version()
+    save_manifest(manifest)
+    stats['upserted_chunks'] = len(new_ids)
+    stats['deleted_chunks'] = len(stale_ids)
+    return stats
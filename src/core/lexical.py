@@ -0,0 +1,271 @@
+import gzip
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+# Metadata keys flagging the other sources a deduplicated chunk appears in
+OCCURRENCE_KEY_PREFIX = 'occurs_in:'
+_ORDINALS = str.maketrans({'º': ' ', 'ª': ' ', '°': ' ', '§': ' paragrafo '})
+
+# Accent-folded Portuguese stopwords
+STOPWORDS = frozenset(
+    'a ao aos as ate com como da das de dela dele deles do dos e ela ele '
+    'eles em entre era essa esse esta este eu foi for ha isso isto ja la '
+    'lhe mais mas me mesmo meu minha muito na nas nem no nos nossa nosso '
+    'num numa o os ou para pela pelas pelo pelos por qual quais quando que '
+    'quem se sem ser seu seus sua suas sao so tambem te tem todo todos tu '
+    'um uma umas uns voce vos'.split()
+)
+
+
+def fold_accents(text: str) -> str:
+    """
+    Removes diacritics, so "Capítulo" and "capitulo" share a token.
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Turns a text into BM25 terms: ordinal markers are dropped, '§' becomes
+    'paragrafo', accents are folded, case is folded and Portuguese
+    stopwords are removed. Numbers, roman numerals and acronyms such as
+    'ras', 'wie' or 'sight' are kept as terms.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The terms, in order.
+    """
+    text = fold_accents(text.translate(_ORDINALS)).casefold()
+    return [term for term in _TOKEN.findall(text) if term not in STOPWORDS]
+
+
+def occurrence_key(source: str) -> str:
+    """
+    Returns the metadata key that is True on a stored chunk whose text also
+    appears in `source`, e.g. 'occurs_in:docs/Estatuto_RAS_2024_1.pdf'.
+    """
+    return f'{OCCURRENCE_KEY_PREFIX}{source}'
+
+
+def in_sources(metadata: dict, sources: Set[str]) -> bool:
+    """
+    Whether a chunk appears in one of some sources: its own 'source', or
+    one of the sources its 'occurrences' were recorded in.
+    """
+    return metadata.get('source') in sources or any(
+        metadata.get(occurrence_key(source)) for source in sources
+    )
+
+
+class LexicalIndex:
+    """
+    Compact in-process BM25 index over the chunks of the collection, keyed
+    by the same chunk IDs as Chroma.
+
+    Only the chunk texts, metadata and term frequencies are persisted; the
+    inverted index is rebuilt in memory when the file is loaded.
+
+    Attributes:
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 length normalization.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._chunks: Dict[str, Tuple[str, dict]] = {}
+        self._terms: Dict[str, Counter] = {}
+        self._lengths: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add(self, chunks: Iterable[Document]):
+        """
+        Adds chunks to the index, replacing chunks with the same ID.
+
+        Args:
+            chunks (Iterable[Document]): Chunks with an 'id' metadata key.
+        """
+        for chunk in chunks:
+            chunk_id = chunk.metadata['id']
+            self.remove([chunk_id])
+            terms = Counter(tokenize(chunk.page_content))
+            self._chunks[chunk_id] = (chunk.page_content, chunk.metadata)
+            self._index_terms(chunk_id, terms)
+
+    def _index_terms(self, chunk_id: str, terms: Counter):
+        self._terms[chunk_id] = terms
+        self._lengths[chunk_id] = sum(terms.values())
+        self._total_length += self._lengths[chunk_id]
+        for term, count in terms.items():
+            self._postings[term][chunk_id] = count
+
+    def remove(self, chunk_ids: Iterable[str]):
+        """
+        Removes chunks from the index. Unknown IDs are ignored.
+        """
+        for chunk_id in chunk_ids:
+            terms = self._terms.pop(chunk_id, None)
+            if terms is None:
+                continue
+            del self._chunks[chunk_id]
+            self._total_length -= self._lengths.pop(chunk_id)
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(
+        self, query: str, k: int = 6, sources: Optional[Set[str]] = None
+    ) -> Tuple[List[Tuple[Document, float]], float]:
+        """
+        Ranks the chunks against a query with BM25.
+
+        Args:
+            query (str): The query.
+            k (int): Number of chunks to return.
+            sources (Optional[Set[str]]): If given, only chunks that
+            appear in one of them are ranked (see `in_sources`).
+
+        Returns:
+            Tuple[List[Tuple[Document, float]], float]: The best chunks with
+            their scores, and the fraction of the query terms found in the
+            best chunk.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self._chunks:
+            return [], 0.0
+
+        total = len(self._chunks)
+        average_length = self._total_length / total
+        scores = defaultdict(float)
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (total - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for chunk_id, count in postings.items():
+                if sources is not None and not in_sources(
+                    self._chunks[chunk_id][1], sources
+                ):
+                    continue
+                length = self._lengths[chunk_id]
+                scores[chunk_id] += idf * (
+                    count
+                    * (self.k1 + 1)
+                    / (
+                        count
+                        + self.k1
+                        * (1 - self.b + self.b * length / average_length)
+                    )
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        results = [
+            (
+                Document(
+                    page_content=self._chunks[chunk_id][0],
+                    metadata=dict(self._chunks[chunk_id][1]),
+                ),
+                score,
+            )
+            for chunk_id, score in ranked
+        ]
+        coverage = 0.0
+        if ranked:
+            best_terms = self._terms[ranked[0][0]]
+            coverage = sum(term in best_terms for term in terms) / len(terms)
+        return results, coverage
+
+    def save(self, path: str):
+        """
+        Atomically writes the index as compressed JSON.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        payload = {
+            chunk_id: [text, metadata, self._terms[chunk_id]]
+            for chunk_id, (text, metadata) in self._chunks.items()
+        }
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['LexicalIndex']:
+        """
+        Loads an index written by `save`.
+
+        Returns:
+            Optional[LexicalIndex]: The index, or None if the file does not
+            exist.
+        """
+        if not os.path.exists(path):
+            return None
+        index = cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            payload = json.load(file)
+        for chunk_id, (text, metadata, terms) in payload.items():
+            index._chunks[chunk_id] = (text, metadata)
+            index._index_terms(chunk_id, Counter(terms))
+        return index
+
+    @classmethod
+    def from_collection(cls, db) -> 'LexicalIndex':
+        """
+        Builds an index from every chunk stored in a Database.
+        """
+        index = cls()
+        items = db.database.get(include=['documents', 'metadatas'])
+        index.add(
+            Document(page_content=text, metadata={**metadata, 'id': chunk_id})
+            for chunk_id, text, metadata in zip(
+                items['ids'], items['documents'], items['metadatas']
+            )
+        )
+        return index
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Document]], k: int = 6, rrf_k: int = 60
+) -> List[Document]:
+    """
+    Fuses several rankings of chunks with reciprocal rank fusion.
+
+    Args:
+        rankings (List[List[Document]]): Rankings, best chunk first. Chunks
+        are identified by their 'id' metadata key.
+        k (int): Number of chunks to return.
+        rrf_k (int): Rank offset of the fusion formula.
+
+    Returns:
+        List[Document]: The fused ranking.
+    """
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            chunk_id = document.metadata.get('id') or document.page_content
+            scores[chunk_id] += 1 / (rrf_k + rank + 1)
+            documents.setdefault(chunk_id, document)
+    ranked = sorted(scores, key=lambda chunk_id: -scores[chunk_id])
+    return [documents[chunk_id] for chunk_id in ranked[:k]]
@@ -1,11 +1,19 @@
-from typing import List
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 
+import pypdf
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain_core.documents import Document
 from langchain_experimental.text_splitter import SemanticChunker
 
 from src.core.embeddings import get_embedding_function
+from src.core.tracing import get_tracer, traced
+from src.core.utils import get_settings
 
 PDFS_PATH = 'docs/'
 
@@ -13,22 +21,136 @@ PDFS_PATH = 'docs/'
 load_dotenv()
 
 
+def list_pdf_files(path: str = PDFS_PATH) -> List[str]:
+    """
+    Lists the PDF files of a directory in a stable order. The paths have the
+    same format as the 'source' metadata of the loaded pages.
+    """
+    return sorted(str(item) for item in Path(path).glob('*.pdf'))
+
+
+def _count_pages(file_path: str) -> int:
+    return len(pypdf.PdfReader(file_path).pages)
+
+
+def _extract_pages(task: Tuple[str, int, int]) -> List[str]:
+    file_path, start, stop = task
+    reader = pypdf.PdfReader(file_path)
+    return [
+        reader.pages[number].extract_text(extraction_mode='plain')
+        for number in range(start, stop)
+    ]
+
+
+def _to_documents(task: Tuple[str, int, int], future) -> List[Document]:
+    file_path, start, _ = task
+    return [
+        Document(
+            page_content=text,
+            metadata={'source': file_path, 'page': start + offset},
+        )
+        for offset, text in enumerate(future.result())
+    ]
+
+
+def _page_ranges(
+    executor: Executor, file_paths: List[str], pages_per_task: int, ahead: int
+) -> Iterator[Tuple[str, int, int]]:
+    """
+    Yields the (file, start, stop) page ranges of the files, in order. The
+    pages of a file are counted on the pool only when the file is at most
+    `ahead` files away from the one being split.
+    """
+    paths = iter(file_paths)
+    counts = deque(
+        (file_path, executor.submit(_count_pages, file_path))
+        for file_path in itertools.islice(paths, ahead)
+    )
+    while counts:
+        file_path, count = counts.popleft()
+        for next_path in itertools.islice(paths, 1):
+            counts.append(
+                (next_path, executor.submit(_count_pages, next_path))
+            )
+        count = count.result()
+        for start in range(0, count, pages_per_task):
+            yield file_path, start, min(start + pages_per_task, count)
+
+
+def iter_pdf_pages(
+    file_paths: List[str],
+    max_workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+) -> Iterator[Document]:
+    """
+    Parses PDF files on a process pool and yields one Document per page.
+
+    Files are split in ranges of `pages_per_task` pages, so large files are
+    also parsed in parallel. Pages are yielded in a stable order (files in
+    the given order, pages in ascending order) as soon as they are ready,
+    and only a bounded number of files is counted and of ranges is parsed
+    ahead of the consumer, so the first pages arrive before the last files
+    are opened.
+
+    Args:
+        file_paths (List[str]): The PDF files to parse.
+        max_workers (Optional[int]): Number of parser processes, defaults to
+        the `pdf_workers` setting or the number of CPUs.
+        pages_per_task (Optional[int]): Pages parsed per task, defaults to
+        the `pages_per_task` setting.
+
+    Yields:
+        Document: A page, with 'source' and 'page' metadata.
+    """
+    settings = get_settings('ingestion')
+    max_workers = (
+        max_workers or settings.get('pdf_workers') or os.cpu_count()
+    )
+    pages_per_task = pages_per_task or settings.get('pages_per_task', 16)
+
+    started_at = time.perf_counter()
+    parsed = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for task in _page_ranges(
+            executor, file_paths, pages_per_task, max_workers
+        ):
+            in_flight.append((task, executor.submit(_extract_pages, task)))
+            if len(in_flight) < 2 * max_workers:
+                continue
+            pages = _to_documents(*in_flight.popleft())
+            parsed += len(pages)
+            yield from pages
+        while in_flight:
+            pages = _to_documents(*in_flight.popleft())
+            parsed += len(pages)
+            yield from pages
+
+    elapsed = time.perf_counter() - started_at
+    get_tracer().record('ingest.load_pdfs', elapsed, pages=parsed)
+    if parsed:
+        print(
+            f'Parsed {parsed} pages in {elapsed:.1f}s '
+            f'({parsed / elapsed:.1f} pages/s)'
+        )
+
+
 # TODO: Add a google drive loader
 def load_pdf_directory() -> List[Document]:
     """
     Loads all PDF documents from a specified directory.
 
-    This function uses the PyPDFDirectoryLoader to load all PDF files
-    from the directory specified by the PDFS_PATH constant.
+    This function parses every PDF file in the directory specified by the
+    PDFS_PATH constant with `iter_pdf_pages`.
 
     Returns:
         List[Document]: A list of Document objects representing the loaded
         PDF files.
     """
-    loader = PyPDFDirectoryLoader(PDFS_PATH)
-    return loader.load()
+    return list(iter_pdf_pages(list_pdf_files(PDFS_PATH)))
 
 
+@traced('ingest.split')
 def split_documents(documents: List[Document]) -> List[Document]:
     """
     Splits a list of documents into smaller chunks using a semantic chunker.
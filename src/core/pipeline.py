@@ -0,0 +1,313 @@
+import dataclasses
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+@dataclasses.dataclass
+class Stage:
+    """
+    Stage is one step of a streaming pipeline.
+
+    Attributes:
+        name (str): Name of the stage, used in the timing report.
+        function (Callable[[Any], Iterable[Any]]): Called with one input
+        item (or a list of items when `batch_size` is set) and returns the
+        items passed on to the next stage.
+        workers (int): Number of threads running the stage.
+        batch_size (Optional[int]): If set, inputs are grouped in lists of up
+        to this many items before calling `function`.
+        ordered (bool): If True, the outputs are passed on in the order of
+        the inputs, even when several workers run the stage.
+    """
+
+    name: str
+    function: Callable[[Any], Iterable[Any]]
+    workers: int = 1
+    batch_size: Optional[int] = None
+    ordered: bool = False
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Channel:
+    """
+    Bounded queue between two stages. `put` blocks while the queue is full,
+    which is what propagates back-pressure to the upstream stages.
+    """
+
+    def __init__(self, maxsize: int, producers: int, stop: threading.Event):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._producers = producers
+        self._lock = threading.Lock()
+        self._stop = stop
+
+    def put(self, item: Any):
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def get(self) -> Any:
+        while True:
+            if self._stop.is_set():
+                raise _Cancelled()
+            try:
+                return self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def producer_done(self):
+        with self._lock:
+            self._producers -= 1
+            last = self._producers == 0
+        if last:
+            self.put(_DONE)
+
+    def consumer_done(self):
+        # Leave the end marker for the other consumers of this channel
+        self.put(_DONE)
+
+
+class _Sequencer:
+    """
+    Numbers the inputs of an ordered stage as its workers read them, and
+    lets each worker pass its outputs on only after the workers that read
+    the previous inputs did.
+    """
+
+    def __init__(self, stop: threading.Event):
+        self._read_lock = threading.Lock()
+        self._turn = threading.Condition()
+        self._next_read = 0
+        self._next_write = 0
+        self._stop = stop
+
+    def read(self, read: Callable[[], Any]) -> Tuple[int, Any]:
+        with self._read_lock:
+            sequence = self._next_read
+            self._next_read += 1
+            return sequence, read()
+
+    def wait(self, sequence: int):
+        with self._turn:
+            while self._next_write != sequence:
+                if self._stop.is_set():
+                    raise _Cancelled()
+                self._turn.wait(_POLL_SECONDS)
+
+    def done(self, sequence: int):
+        with self._turn:
+            self._next_write = sequence + 1
+            self._turn.notify_all()
+
+
+class _Pipeline:
+    """
+    The threads and queues of one `run_pipeline` call.
+    """
+
+    def __init__(self, source: Iterable[Any], stages: List[Stage], size: int):
+        self.source = source
+        self.stages = stages
+        self.stop = threading.Event()
+        self.errors = []
+        self.channels = [_Channel(size, 1, self.stop)]
+        for stage in stages:
+            self.channels.append(_Channel(size, stage.workers, self.stop))
+        self.timings = {stage.name: 0.0 for stage in stages}
+        self._timings_lock = threading.Lock()
+
+    def fail(self, error: BaseException):
+        self.errors.append(error)
+        self.stop.set()
+
+    def feed(self):
+        items = iter(self.source)
+        try:
+            for item in items:
+                self.channels[0].put(item)
+            self.channels[0].producer_done()
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            self.fail(e)
+        finally:
+            # Lets generator sources release their resources on cancellation
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+    @staticmethod
+    def read_batch(inbox: _Channel, size: Optional[int]):
+        if size is None:
+            item = inbox.get()
+            return item is _DONE, item
+        batch = []
+        while len(batch) < size:
+            item = inbox.get()
+            if item is _DONE:
+                return True, batch
+            batch.append(item)
+        return False, batch
+
+    def run(self, stage: Stage, item: Any, outbox: _Channel):
+        # Only the stage's own work counts as busy time, not the time
+        # blocked on a full outbox
+        started_at = time.perf_counter()
+        outputs = iter(stage.function(item))
+        busy = time.perf_counter() - started_at
+        while True:
+            started_at = time.perf_counter()
+            output = next(outputs, _DONE)
+            busy += time.perf_counter() - started_at
+            if output is _DONE:
+                break
+            outbox.put(output)
+        with self._timings_lock:
+            self.timings[stage.name] += busy
+
+    def run_ordered(
+        self,
+        stage: Stage,
+        item: Any,
+        outbox: _Channel,
+        sequencer: _Sequencer,
+        sequence: int,
+    ):
+        started_at = time.perf_counter()
+        outputs = list(stage.function(item))
+        with self._timings_lock:
+            self.timings[stage.name] += time.perf_counter() - started_at
+        sequencer.wait(sequence)
+        for output in outputs:
+            outbox.put(output)
+        sequencer.done(sequence)
+
+    def drain(
+        self,
+        stage: Stage,
+        inbox: _Channel,
+        outbox: _Channel,
+        sequencer: Optional[_Sequencer],
+    ):
+        def read():
+            return self.read_batch(inbox, stage.batch_size)
+
+        while True:
+            if sequencer is None:
+                done, item = read()
+            else:
+                sequence, (done, item) = sequencer.read(read)
+            has_item = bool(item) if stage.batch_size else not done
+            if has_item:
+                if sequencer is None:
+                    self.run(stage, item, outbox)
+                else:
+                    self.run_ordered(stage, item, outbox, sequencer, sequence)
+            elif sequencer is not None:
+                # The end marker also takes its turn
+                sequencer.wait(sequence)
+                sequencer.done(sequence)
+            if done:
+                break
+        inbox.consumer_done()
+        outbox.producer_done()
+
+    def work(
+        self,
+        stage: Stage,
+        inbox: _Channel,
+        outbox: _Channel,
+        sequencer: Optional[_Sequencer],
+    ):
+        try:
+            self.drain(stage, inbox, outbox, sequencer)
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            self.fail(e)
+
+    def threads(self) -> List[threading.Thread]:
+        threads = [threading.Thread(target=self.feed, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            sequencer = _Sequencer(self.stop) if stage.ordered else None
+            for _ in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self.work,
+                        args=(
+                            stage,
+                            self.channels[index],
+                            self.channels[index + 1],
+                            sequencer,
+                        ),
+                        daemon=True,
+                    )
+                )
+        return threads
+
+    def results(self) -> Iterator[Any]:
+        while True:
+            try:
+                item = self.channels[-1].get()
+            except _Cancelled:
+                return
+            if item is _DONE:
+                return
+            yield item
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    stages: List[Stage],
+    queue_size: int = 8,
+) -> Iterator[Any]:
+    """
+    Runs `source` through `stages`, each on its own threads, connected by
+    bounded queues. Every stage starts working as soon as the first item
+    reaches it, and a slow stage makes the faster ones upstream wait instead
+    of buffering the whole corpus in memory.
+
+    The first error raised by any stage stops the pipeline and is raised
+    again by the returned iterator. Closing the iterator early also stops
+    every thread.
+
+    Args:
+        source (Iterable[Any]): Input items, consumed on a dedicated thread.
+        stages (List[Stage]): The stages, in order.
+        queue_size (int): Capacity of the queue in front of each stage.
+
+    Yields:
+        Any: The items produced by the last stage.
+    """
+    pipeline = _Pipeline(source, stages, queue_size)
+    threads = pipeline.threads()
+    for thread in threads:
+        thread.start()
+
+    started_at = time.perf_counter()
+    try:
+        yield from pipeline.results()
+    finally:
+        pipeline.stop.set()
+        for thread in threads:
+            thread.join()
+
+    if pipeline.errors:
+        raise pipeline.errors[0]
+    elapsed = time.perf_counter() - started_at
+    busy = ', '.join(
+        f'{name} {seconds:.1f}s' for name, seconds in pipeline.timings.items()
+    )
+    print(f'Pipeline finished in {elapsed:.1f}s (busy time: {busy})')
@@ -1,14 +1,28 @@
+import asyncio
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import List, Optional, Tuple
 
 from dotenv import load_dotenv
 from langchain_core.documents import Document
 
-from src.core.database import Database
+from src.core.database import Database, load_lexical_index
+from src.core.docstore import load_page_store
+from src.core.gateway import GatewayOverloadedError
+from src.core.lexical import in_sources, reciprocal_rank_fusion
+from src.core.router import load_router, where_filter
+from src.core.tracing import get_tracer
+from src.core.utils import Shared, get_settings
 
 load_dotenv()
 
 CHROMA_PATH = os.getenv('CHROMA_PATH')
 
+SEARCH_K = 6
+WARM_UP_QUERY = 'Ramo Estudantil IEEE UFC Fortaleza'
+BATCH_MODES = ('thread', 'process')
+
 
 class Retriever:
     """
@@ -16,35 +30,337 @@ class Retriever:
 
     Attributes
     ----------
-    database : DB
-        An instance of the database to be used for retrieving documents.
+    database : Chroma
+        The Chroma vector store used for retrieving documents.
+    retriever : VectorStoreRetriever
+        The retriever built once on top of the vector store.
+    lexical_index : LexicalIndex
+        The BM25 index over the same chunks, fused with the vector results.
+    router : DocumentRouter
+        Restricts both searches to the documents a question targets, or
+        None if routing is disabled.
+    page_store : PageStore
+        Expands the retrieved chunks to their page or neighbours, or None
+        if the docstore is disabled.
 
     Methods
     -------
-    query_rag(query_text: str) -> str
+    query_rag(query_text: str) -> list[Document]
         Queries the RAG model with the given text and returns the retrieved
         documents.
+    aquery_rag(query_text: str) -> list[Document]
+        Asynchronous version of `query_rag`.
+    query_rag_batch(queries: list[str], k: int) -> list[list[tuple]]
+        Embeds and searches many queries at once and returns the documents
+        of each one with their scores.
+    warm_up()
+        Loads the index and runs one embedding so the first real query does
+        not pay for it.
+    close()
+        Releases the underlying database client.
     """
 
     def __init__(self):
-        self.database = Database().database
+        with get_tracer().span('retriever.init'):
+            self._db = Database()
+            self.database = self._db.database
+            self.retriever = self.database.as_retriever(
+                search_kwargs={'k': SEARCH_K}
+            )
+            self.lexical_index = load_lexical_index(self._db)
+            self.router = (
+                load_router(self._db)
+                if get_settings('router').get('enabled', True)
+                else None
+            )
+            self.page_store = (
+                load_page_store(SEARCH_K)
+                if get_settings('docstore').get('enabled', True)
+                else None
+            )
+        self.settings = get_settings('lexical')
+        self._warm = False
+
+    def warm_up(self):
+        """
+        Runs a dummy query through the retriever, which opens the SQLite
+        backend, loads the HNSW segment and creates the embedding client.
+        Calling it more than once is a no-op.
+        """
+        if self._warm:
+            return
+        try:
+            self.retriever.invoke(WARM_UP_QUERY)
+        except Exception as e:
+            print(f'An error occurred while warming up the retriever: {e}')
+            return
+        self._warm = True
+
+    def _lexical_is_confident(self, results: list, coverage: float) -> bool:
+        """
+        Whether the BM25 results alone are good enough: the best chunk
+        contains every query term and clearly outscores the second one.
+        """
+        if not results or coverage < 1.0:
+            return False
+        best = results[0][1]
+        second = results[1][1] if len(results) > 1 else 0.0
+        return best >= self.settings.get(
+            'fast_path_min_score', 5.0
+        ) and best >= second * self.settings.get('fast_path_ratio', 1.5)
 
     def query_rag(self, query_text: str) -> list[Document]:
         """
         Queries the retriever with the given query text and returns the
         retrieved documents.
+
+        The router first picks the documents the query names, if any, and
+        the query is ranked against their chunks in the BM25 index. If the
+        lexical match is confident, its results are returned without
+        embedding the query; otherwise they are fused with the vector search
+        results by reciprocal rank fusion. Without a named document, the
+        query embedding may still be routed to the closest document, and
+        the vector search is restricted to it with a `where` filter.
+        Finally, the page store replaces each retrieved chunk with its
+        page or its adjacent chunks, under the `docstore` size cap.
         Args:
             query_text (str): The text to query the retriever with.
         Returns:
-            str: The retrieved documents as a string. If an error occurs,
+            list[Document]: The retrieved documents. If an error occurs,
             returns None.
+        Raises:
+            GatewayOverloadedError: If the model gateway refused to embed
+            the query, so the caller can ask the user to retry.
         """
-        retriever = self.database.as_retriever(search_kwargs={'k': 6})
-
         try:
-            docs = retriever.invoke(query_text)
+            with get_tracer().span('retriever.query') as span:
+                docs = self._search(query_text, span)
+                if docs and self.page_store:
+                    docs = self.page_store.expand(docs)
+        except GatewayOverloadedError:
+            raise
         except Exception as e:
             print(f'An error occurred while invoking the retriever: {e}')
             docs = None
 
         return docs
+
+    def _search(self, query_text: str, span: dict) -> list[Document]:
+        """
+        Runs the lexical and vector searches, recording the path taken in
+        the tracing `span`.
+        """
+        tracer = get_tracer()
+        sources = (
+            self.router.route_keywords(query_text) if self.router else None
+        )
+        span['route'] = 'keywords' if sources else 'global'
+        lexical_docs = []
+        if self.settings.get('enabled', True) and len(self.lexical_index):
+            with tracer.span('retriever.lexical'):
+                results, coverage = self.lexical_index.search(
+                    query_text, SEARCH_K, set(sources) if sources else None
+                )
+            lexical_docs = [doc for doc, _ in results]
+            if self._lexical_is_confident(results, coverage):
+                span['path'] = 'lexical'
+                return lexical_docs
+
+        # Query embedding plus the HNSW search
+        with tracer.span('retriever.vector'):
+            docs, sources = self._vector_search(query_text, sources, span)
+        if sources:
+            routed = set(sources)
+            lexical_docs = [
+                doc for doc in lexical_docs if in_sources(doc.metadata, routed)
+            ]
+        span['path'] = 'dense'
+        if lexical_docs:
+            span['path'] = 'hybrid'
+            docs = reciprocal_rank_fusion(
+                [docs, lexical_docs],
+                k=SEARCH_K,
+                rrf_k=self.settings.get('rrf_k', 60),
+            )
+        return docs
+
+    def _vector_search(
+        self, query_text: str, sources: Optional[List[str]], span: dict
+    ) -> Tuple[list[Document], Optional[List[str]]]:
+        """
+        Runs the vector search, restricted to the routed sources. Without a
+        keyword route, the query embedding is routed by the document
+        centroids. A route that finds nothing falls back to the whole
+        collection.
+        """
+        if not self.router:
+            return self.retriever.invoke(query_text), None
+        if sources:
+            docs = self.database.similarity_search(
+                query_text, k=SEARCH_K, filter=where_filter(sources)
+            )
+            vector = None
+        else:
+            vector = self._db.embedding_function.embed_query(query_text)
+            sources = self.router.route_vector(vector)
+            if sources:
+                span['route'] = 'centroid'
+            docs = self.database.similarity_search_by_vector(
+                vector,
+                k=SEARCH_K,
+                filter=where_filter(sources) if sources else None,
+            )
+        if docs or not sources:
+            return docs, sources
+        span['route'] = 'global'
+        if vector is None:
+            return self.retriever.invoke(query_text), None
+        return self.database.similarity_search_by_vector(
+            vector, k=SEARCH_K
+        ), None
+
+    async def aquery_rag(self, query_text: str) -> list[Document]:
+        """
+        Asynchronous version of `query_rag`. The lookup runs on a worker
+        thread, so the event loop keeps serving other requests meanwhile.
+        """
+        return await asyncio.to_thread(self.query_rag, query_text)
+
+    def _search_batch(
+        self, queries: List[str], k: int
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Embeds the queries in one call and runs one batched vector search.
+        """
+        embedding_function = self._db.embedding_function
+        with get_tracer().span(
+            'retriever.query_batch', queries=len(queries)
+        ):
+            if hasattr(embedding_function, 'embed_queries'):
+                vectors = embedding_function.embed_queries(queries)
+            else:
+                vectors = embedding_function.embed_documents(queries)
+            return self._db.search_by_vectors(vectors, k)
+
+    def query_rag_batch(
+        self,
+        queries: List[str],
+        k: int = SEARCH_K,
+        batch_size: Optional[int] = None,
+        workers: Optional[int] = None,
+        mode: Optional[str] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Queries the vector store with many texts at once, e.g. to replay
+        logged questions or to pre-warm the caches.
+
+        The queries are split in batches of `batch_size`; each batch is
+        embedded in a single call and searched with a single batched
+        nearest-neighbour lookup. Unlike `query_rag`, the BM25 fast path and
+        the fusion are skipped, so the scores of every query are comparable.
+        With more than one worker, the batches run in parallel on threads
+        or, for very large files, on processes that open their own
+        retriever.
+        Args:
+            queries (List[str]): The texts to query the retriever with.
+            k (int): Number of documents per query.
+            batch_size (Optional[int]): Queries per embedding call.
+            workers (Optional[int]): Number of batches run in parallel.
+            mode (Optional[str]): 'thread' or 'process'.
+        Returns:
+            List[List[Tuple[Document, float]]]: For every query, in order,
+            the retrieved documents with their relevance score (higher is
+            closer). If an error occurs, returns None.
+        """
+        settings = get_settings('batch_query')
+        batch_size = batch_size or settings.get('batch_size', 100)
+        workers = workers or settings.get('workers', 1)
+        mode = mode or settings.get('mode', 'thread')
+        if mode not in BATCH_MODES:
+            raise ValueError(
+                f'Unknown batch mode {mode!r}, expected one of {BATCH_MODES}'
+            )
+
+        batches = [
+            list(queries[start : start + batch_size])
+            for start in range(0, len(queries), batch_size)
+        ]
+        try:
+            results = self._map_batches(batches, k, workers, mode)
+        except Exception as e:
+            print(f'An error occurred while invoking the retriever: {e}')
+            return None
+
+        return [documents for batch in results for documents in batch]
+
+    def _map_batches(
+        self, batches: List[List[str]], k: int, workers: int, mode: str
+    ) -> List[List[List[Tuple[Document, float]]]]:
+        if workers <= 1 or len(batches) <= 1:
+            return [self._search_batch(batch, k) for batch in batches]
+        if mode == 'thread':
+            with ThreadPoolExecutor(workers) as executor:
+                return list(
+                    executor.map(self._search_batch, batches, repeat(k))
+                )
+        with ProcessPoolExecutor(workers) as executor:
+            return list(executor.map(_search_batch_worker, batches, repeat(k)))
+
+    def close(self):
+        """
+        Releases the database client held by this retriever.
+        """
+        self._db.close()
+
+
+_worker_retriever = Shared()
+
+
+def _search_batch_worker(
+    queries: List[str], k: int
+) -> List[List[Tuple[Document, float]]]:
+    # Runs in a child process of `query_rag_batch`, with its own retriever
+    return _worker_retriever.get(Retriever)._search_batch(queries, k)
+
+
+_shared_retriever = Shared()
+
+
+def get_retriever() -> Retriever:
+    """
+    Returns the process-wide Retriever, creating and warming it up on first
+    use. The same instance is shared by every caller (and every Streamlit
+    session), so the Chroma client is opened only once per process.
+
+    Returns:
+        Retriever: The shared retriever instance.
+    """
+    return _shared_retriever.get(_create_retriever)
+
+
+def reload_retriever() -> Retriever:
+    """
+    Replaces the shared Retriever with a fresh one. Should be called after
+    the collection changes on disk (e.g. after `add_to_chroma`). Queries
+    already running keep using the previous instance until they finish: it
+    is not closed here, and its database client is released when the last
+    caller drops it and it is garbage collected.
+
+    Returns:
+        Retriever: The new shared retriever instance.
+    """
+    _shared_retriever.replace(_create_retriever)
+    return _shared_retriever.instance
+
+
+def _create_retriever() -> Retriever:
+    retriever = Retriever()
+    retriever.warm_up()
+    return retriever
+
+
+def open_clients() -> int:
+    """
+    Returns how many Chroma clients are currently open in this process.
+    """
+    return Database.open_clients()
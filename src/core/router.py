@@ -0,0 +1,278 @@
+import base64
+import gzip
+import json
+import math
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from src.core.database import CHROMA_PATH
+from src.core.lexical import occurrence_key, tokenize
+from src.core.utils import get_settings
+
+ROUTER_FILE = os.path.join(CHROMA_PATH, 'router.json.gz')
+
+# Title words that name the organization rather than one document
+GENERIC_TITLE_TERMS = frozenset(
+    'ieee ufc fortaleza ramo estudantil pdf'.split()
+)
+
+
+def title_terms(source: str) -> List[str]:
+    """
+    Returns the distinctive words of a document's file name, e.g.
+    ['regimento', 'wie'] for "docs/Regimento_IEEE_WIE_UFC_2024_1.pdf".
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return sorted({
+        term
+        for term in tokenize(stem.replace('_', ' '))
+        if not term.isdigit() and term not in GENERIC_TITLE_TERMS
+    })
+
+
+def where_filter(sources: Iterable[str]) -> Dict[str, object]:
+    """
+    Returns the metadata filter restricting a search to the chunks that
+    appear in some sources: their own 'source', or the occurrence flag
+    (see `occurrence_key`) of a chunk stored once for several documents.
+    """
+    sources = sorted(sources)
+    return {
+        '$or': [
+            {'source': {'$in': sources}},
+            *({occurrence_key(source): True} for source in sources),
+        ]
+    }
+
+
+class DocumentRouter:
+    """
+    Maps a question to the documents it targets, before the vector search.
+
+    A question is first matched against the terms of every document's
+    title, plus the phrases of `aliases`; each matched term weighs its
+    inverse document frequency among the titles, so "regimento do WIE"
+    picks the WIE statute over the other 'regimento'. The documents within
+    `tie_ratio` of the best score are chosen when it reaches `min_score`.
+    Otherwise the query embedding is compared with the centroid of every
+    document's chunk vectors, and the closest document is chosen when it
+    leads the second one by `centroid_margin`. When neither is confident,
+    or more than `max_sources` documents tie, no route is returned and the
+    whole collection is searched.
+
+    Chunks stored once for several documents (see `dedupe`) keep the source
+    of their first occurrence, and are flagged with the other ones, so a
+    routed search finds them in every document they appear in.
+
+    Attributes:
+        min_score (float): Minimum title score of a keyword route.
+        tie_ratio (float): Fraction of the best score that also routes.
+        centroid_margin (float): Cosine lead of a centroid route.
+        max_sources (int): Maximum number of documents of a route.
+        aliases (Dict[str, List[str]]): Extra phrases per source.
+    """
+
+    def __init__(
+        self,
+        min_score: float = 0.5,
+        tie_ratio: float = 0.99,
+        centroid_margin: float = 0.05,
+        max_sources: int = 2,
+        aliases: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.min_score = min_score
+        self.tie_ratio = tie_ratio
+        self.centroid_margin = centroid_margin
+        self.max_sources = max_sources
+        self.aliases = aliases or {}
+        self.sources: List[str] = []
+        self._terms: Dict[str, List[str]] = {}
+        self._weights: Dict[str, float] = {}
+        self._phrases: Dict[str, List[str]] = {}
+        self._centroids: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def _index_titles(self, sources: List[str]):
+        self.sources = sorted(sources)
+        self._terms = {source: title_terms(source) for source in self.sources}
+        frequencies = defaultdict(int)
+        for terms in self._terms.values():
+            for term in terms:
+                frequencies[term] += 1
+        self._weights = {
+            term: math.log(len(self.sources) / frequency)
+            for term, frequency in frequencies.items()
+        }
+        self._phrases = {
+            source: [' '.join(tokenize(alias)) for alias in aliases]
+            for source, aliases in self.aliases.items()
+        }
+
+    def fit(
+        self,
+        metadatas: List[dict],
+        vectors: Optional[np.ndarray] = None,
+    ) -> 'DocumentRouter':
+        """
+        Builds the title terms and, if the chunk vectors are given, the
+        normalized centroid of every source.
+
+        Args:
+            metadatas (List[dict]): Metadata of every stored chunk.
+            vectors (Optional[np.ndarray]): Their vectors, row by row.
+
+        Returns:
+            DocumentRouter: This router.
+        """
+        positions = defaultdict(list)
+        for index, metadata in enumerate(metadatas):
+            if metadata.get('source'):
+                positions[metadata['source']].append(index)
+        self._index_titles(list(positions))
+        self._centroids = None
+        if vectors is not None and len(vectors) and self.sources:
+            vectors = np.array(vectors, dtype=np.float32)
+            vectors /= np.maximum(
+                np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+            )
+            centroids = np.stack([
+                vectors[positions[source]].mean(axis=0)
+                for source in self.sources
+            ])
+            self._centroids = centroids / np.maximum(
+                np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12
+            )
+        return self
+
+    def _choose(self, scores: Dict[str, float]) -> Optional[List[str]]:
+        best = max(scores.values(), default=0.0)
+        if best < self.min_score:
+            return None
+        chosen = [
+            source
+            for source, score in scores.items()
+            if score >= best * self.tie_ratio
+        ]
+        return sorted(chosen) if len(chosen) <= self.max_sources else None
+
+    def route_keywords(self, query: str) -> Optional[List[str]]:
+        """
+        Routes a question by the titles and aliases it mentions.
+
+        Returns:
+            Optional[List[str]]: The targeted sources, or None.
+        """
+        if len(self.sources) <= 1:
+            return None
+        query_terms = tokenize(query)
+        terms = set(query_terms)
+        folded = f' {" ".join(query_terms)} '
+        scores = {}
+        for source in self.sources:
+            score = sum(
+                self._weights[term]
+                for term in self._terms[source]
+                if term in terms
+            )
+            # An alias names its document outright
+            for phrase in self._phrases.get(source, ()):
+                if phrase and f' {phrase} ' in folded:
+                    score += math.log(len(self.sources))
+            if score:
+                scores[source] = score
+        return self._choose(scores)
+
+    def route_vector(self, vector: List[float]) -> Optional[List[str]]:
+        """
+        Routes a question by the document centroid closest to its
+        embedding.
+
+        Returns:
+            Optional[List[str]]: The closest source, or None.
+        """
+        if self._centroids is None or len(self.sources) <= 1:
+            return None
+        vector = np.array(vector, dtype=np.float32)
+        if vector.shape[-1] != self._centroids.shape[1]:
+            return None
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        similarities = self._centroids @ vector
+        second, best = np.argsort(similarities)[-2:]
+        if similarities[best] - similarities[second] < self.centroid_margin:
+            return None
+        return [self.sources[best]]
+
+    def save(self, path: str):
+        """
+        Atomically writes the title terms and centroids as compressed JSON.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        payload = {
+            'sources': self.sources,
+            'centroids': None
+            if self._centroids is None
+            else base64.b64encode(self._centroids.tobytes()).decode(),
+        }
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(payload, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Loads the sources and centroids saved by `save`.
+
+        Returns:
+            bool: False if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return False
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            payload = json.load(file)
+        self._index_titles(payload['sources'])
+        self._centroids = None
+        if payload['centroids'] and self.sources:
+            self._centroids = np.frombuffer(
+                base64.b64decode(payload['centroids']), dtype=np.float32
+            ).reshape(len(self.sources), -1)
+        return True
+
+
+def _from_settings() -> DocumentRouter:
+    settings = get_settings('router')
+    return DocumentRouter(
+        min_score=settings.get('min_score', 0.5),
+        tie_ratio=settings.get('tie_ratio', 0.99),
+        centroid_margin=settings.get('centroid_margin', 0.05),
+        max_sources=settings.get('max_sources', 2),
+        aliases=settings.get('aliases') or {},
+    )
+
+
+def build_router(db) -> DocumentRouter:
+    """
+    Builds the router from every chunk stored in a Database and saves it
+    beside the collection. Called by the indexer after the collection
+    changes.
+    """
+    _, vectors, _, metadatas = db.read_all()
+    router = _from_settings().fit(metadatas, vectors)
+    router.save(ROUTER_FILE)
+    return router
+
+
+def load_router(db=None) -> DocumentRouter:
+    """
+    Loads the router kept beside the collection, configured by the `router`
+    settings. If it does not exist yet and a Database is given, it is built
+    from the stored chunks.
+    """
+    router = _from_settings()
+    if not router.load(ROUTER_FILE) and db is not None and db.count():
+        router = build_router(db)
+    return router
@@ -0,0 +1,308 @@
+import dataclasses
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from src.core.embeddings import CACHE_PATH
+from src.core.utils import Shared, get_settings
+
+SESSIONS_FILE = os.path.join(CACHE_PATH, 'sessions.sqlite3')
+
+_ROLES = {'human': HumanMessage, 'ai': AIMessage}
+# Memory of the (role, text) tuple and list slot of one message, on top of
+# the text itself
+_MESSAGE_OVERHEAD = sys.getsizeof(('human', '')) + 8
+
+
+def _message_size(text: str) -> int:
+    return sys.getsizeof(text) + _MESSAGE_OVERHEAD
+
+
+class SessionHistory(list):
+    """
+    The messages of a session, as LangChain messages.
+
+    Attributes:
+        dropped (int): Number of older messages of the conversation that are
+        no longer stored, so positions in the list are `dropped` behind
+        positions in the conversation.
+    """
+
+    def __init__(self, messages: List[BaseMessage] = (), dropped: int = 0):
+        super().__init__(messages)
+        self.dropped = dropped
+
+
+class _Session:
+    __slots__ = ('messages', 'dropped', 'size', 'last_seen')
+
+    def __init__(self, messages: List[Tuple[str, str]] = (), dropped=0):
+        # One (role, text) tuple per message instead of message objects
+        self.messages = list(messages)
+        self.dropped = dropped
+        self.size = sum(_message_size(text) for _, text in self.messages)
+        self.last_seen = time.monotonic()
+
+
+@dataclasses.dataclass(kw_only=True, eq=False)
+class SessionStore:
+    """
+    Server-side chat histories with bounded memory.
+
+    Every session keeps at most `max_messages` messages; older turns are
+    dropped first, and their count is kept so the rolling summary of the
+    ContextAssembler stays aligned. Sessions are kept in LRU order: the
+    least recently used ones are evicted when there are more than
+    `max_sessions`, when the histories take more than `max_memory_mb`, or
+    when they were idle for `idle_seconds`. With a `spill_path`, evicted
+    sessions are written to SQLite and loaded back on their next request
+    instead of being forgotten; spilled sessions idle for `spill_max_age`
+    seconds are deleted.
+
+    Attributes:
+        max_messages (int): Messages kept per session.
+        max_sessions (int): Sessions kept in memory.
+        max_memory_mb (float): Ceiling of the memory taken by the histories,
+        in megabytes.
+        idle_seconds (float): Idle time after which a session is evicted.
+        spill_path (Optional[str]): SQLite file of the evicted sessions.
+        spill_max_age (float): Idle time after which a spilled session is
+        deleted.
+    """
+
+    max_messages: int = 100
+    max_sessions: int = 1000
+    max_memory_mb: float = 64
+    idle_seconds: float = 3600
+    spill_path: Optional[str] = None
+    spill_max_age: float = 7 * 24 * 3600
+
+    def __post_init__(self):
+        self.max_bytes = int(self.max_memory_mb * 1024 * 1024)
+        self._sessions: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.spilled = 0
+
+        self._connection = None
+        if self.spill_path:
+            os.makedirs(
+                os.path.dirname(self.spill_path) or '.', exist_ok=True
+            )
+            self._connection = sqlite3.connect(
+                self.spill_path, check_same_thread=False
+            )
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'session_id TEXT PRIMARY KEY, messages TEXT, '
+                'dropped INTEGER, updated_at REAL)'
+            )
+            self._connection.commit()
+
+    def _get(self, session_id: str, create: bool) -> Optional[_Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+            if session is None and not create:
+                return None
+            session = session or _Session()
+            self._sessions[session_id] = session
+            self._bytes += session.size
+        self._sessions.move_to_end(session_id)
+        session.last_seen = time.monotonic()
+        self._enforce(session_id)
+        return session
+
+    def _load(self, session_id: str) -> Optional[_Session]:
+        if self._connection is None:
+            return None
+        row = self._connection.execute(
+            'SELECT messages, dropped FROM sessions WHERE session_id = ?',
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        self._connection.execute(
+            'DELETE FROM sessions WHERE session_id = ?', (session_id,)
+        )
+        self._connection.commit()
+        return _Session(map(tuple, json.loads(row[0])), row[1])
+
+    def _evict(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.size
+        self.evicted += 1
+        if self._connection is None or not session.messages:
+            return
+        now = time.time()
+        self._connection.execute(
+            'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)',
+            (
+                session_id,
+                json.dumps(session.messages, ensure_ascii=False),
+                session.dropped,
+                now,
+            ),
+        )
+        self._connection.execute(
+            'DELETE FROM sessions WHERE updated_at < ?',
+            (now - self.spill_max_age,),
+        )
+        self._connection.commit()
+        self.spilled += 1
+
+    def _trim(self, session: _Session):
+        messages = session.messages
+        drop = 0
+        size = session.size
+        while drop < len(messages) - 1 and (
+            len(messages) - drop > self.max_messages or size > self.max_bytes
+        ):
+            size -= _message_size(messages[drop][1])
+            drop += 1
+        # Keep whole turns: the history starts with a question
+        while drop < len(messages) - 1 and messages[drop][0] != 'human':
+            size -= _message_size(messages[drop][1])
+            drop += 1
+        if drop:
+            del messages[:drop]
+            session.dropped += drop
+            self._bytes -= session.size - size
+            session.size = size
+
+    def _enforce(self, current: str):
+        idle_since = time.monotonic() - self.idle_seconds
+        for session_id in list(self._sessions):
+            if session_id == current:
+                continue
+            if not (
+                len(self._sessions) > self.max_sessions
+                or self._bytes > self.max_bytes
+                or self._sessions[session_id].last_seen < idle_since
+            ):
+                break
+            self._evict(session_id)
+
+    def append(self, session_id: str, role: str, text: str):
+        """
+        Adds a message to the end of a session's history.
+
+        Args:
+            session_id (str): The session.
+            role (str): 'human' or 'ai'.
+            text (str): The message.
+        """
+        if role not in _ROLES:
+            raise ValueError(f'Invalid message role: {role}')
+        with self._lock:
+            session = self._get(session_id, create=True)
+            session.messages.append((role, text))
+            size = _message_size(text)
+            session.size += size
+            self._bytes += size
+            self._trim(session)
+            self._enforce(session_id)
+
+    def length(self, session_id: str) -> int:
+        """
+        Returns the number of messages of the conversation, counting the
+        ones no longer stored.
+        """
+        with self._lock:
+            session = self._get(session_id, create=False)
+            return (
+                0
+                if session is None
+                else session.dropped + len(session.messages)
+            )
+
+    def history(self, session_id: str, start: int = 0) -> SessionHistory:
+        """
+        Returns the stored messages of a session as LangChain messages.
+
+        Args:
+            session_id (str): The session.
+            start (int): Position in the conversation of the first message
+            to return, so callers can convert only the latest messages.
+
+        Returns:
+            SessionHistory: The messages, with the number of older messages
+            that were dropped or skipped.
+        """
+        with self._lock:
+            session = self._get(session_id, create=False)
+            if session is None:
+                return SessionHistory()
+            offset = max(0, start - session.dropped)
+            messages = session.messages[offset:]
+            dropped = session.dropped + offset
+        return SessionHistory(
+            [_ROLES[role](content=text) for role, text in messages], dropped
+        )
+
+    def clear(self, session_id: str):
+        """
+        Forgets a session, in memory and in the spill file.
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._bytes -= session.size
+            if self._connection is not None:
+                self._connection.execute(
+                    'DELETE FROM sessions WHERE session_id = ?', (session_id,)
+                )
+                self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the sessions and messages held in memory, their size in
+        bytes and how many sessions were evicted and spilled.
+        """
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'messages': sum(
+                    len(session.messages)
+                    for session in self._sessions.values()
+                ),
+                'bytes': self._bytes,
+                'evicted': self.evicted,
+                'spilled': self.spilled,
+            }
+
+
+_shared_store = Shared()
+
+
+def get_session_store() -> SessionStore:
+    """
+    Returns the process-wide SessionStore configured by the `sessions`
+    settings.
+    """
+    return _shared_store.get(_create_session_store)
+
+
+def _create_session_store() -> SessionStore:
+    settings = get_settings('sessions')
+    return SessionStore(
+        max_messages=settings.get('max_messages', 100),
+        max_sessions=settings.get('max_sessions', 1000),
+        max_memory_mb=settings.get('max_memory_mb', 64),
+        idle_seconds=settings.get('idle_seconds', 3600),
+        spill_path=(
+            settings.get('spill_path', SESSIONS_FILE)
+            if settings.get('spill', False)
+            else None
+        ),
+        spill_max_age=settings.get('spill_max_age', 7 * 24 * 3600),
+    )
@@ -0,0 +1,306 @@
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import json
+import math
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+from src.core.context import estimate_tokens
+from src.core.utils import Shared, get_settings
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+
+@dataclasses.dataclass
+class SpanRecord:
+    """
+    SpanRecord is the timing of one stage of a request or ingestion.
+
+    Attributes:
+        name (str): The stage, e.g. 'retriever.query' or 'llm.first_token'.
+        duration (float): Seconds spent in the stage.
+        started_at (float): Unix time at which the stage started.
+        trace_id (Optional[str]): Groups the stages of one request.
+        attributes (Dict[str, Any]): Extra data such as token counts or
+        cache hits.
+    """
+
+    name: str
+    duration: float
+    started_at: float
+    trace_id: Optional[str] = None
+    attributes: Dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+def _percentile(values: List[float], quantile: float) -> float:
+    # Nearest-rank percentile over sorted values
+    index = max(0, math.ceil(quantile * len(values)) - 1)
+    return values[index]
+
+
+class Tracer:
+    """
+    In-process tracer that keeps the last `capacity` spans in a ring buffer.
+
+    Spans are recorded with the `span` context manager, the module's
+    `traced` decorator or `trace_stream` for streamed answers. They can be
+    summarized as percentiles and exported as JSON lines or in the
+    Prometheus text format.
+
+    Attributes:
+        capacity (int): Number of spans kept in memory.
+        enabled (bool): When False, spans are not recorded.
+    """
+
+    def __init__(self, capacity: int = 2048, enabled: bool = True):
+        self.capacity = capacity
+        self.enabled = enabled
+        self._spans = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float, **attributes):
+        """
+        Adds a span that was timed by the caller.
+        """
+        if not self.enabled:
+            return
+        span = SpanRecord(
+            name=name,
+            duration=duration,
+            started_at=time.time() - duration,
+            trace_id=_trace_id.get(),
+            attributes=attributes,
+        )
+        with self._lock:
+            self._spans.append(span)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict[str, Any]]:
+        """
+        Times the enclosed block. The yielded dict can be filled with
+        attributes known only inside the block; a raised exception is
+        recorded as the `error` attribute.
+
+        Args:
+            name (str): Name of the stage.
+            **attributes: Initial attributes of the span.
+
+        Yields:
+            Dict[str, Any]: The attributes of the span.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes['error'] = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started_at, **attributes)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def trace() -> Iterator[str]:
+        """
+        Groups the spans recorded inside the block under a new trace ID.
+        """
+        token = _trace_id.set(uuid.uuid4().hex)
+        try:
+            yield _trace_id.get()
+        finally:
+            _trace_id.reset(token)
+
+    def trace_stream(
+        self, stream: Iterator[str], started_at: float
+    ) -> Iterator[str]:
+        """
+        Passes a response stream through and records the time to its first
+        piece (`llm.first_token`), its duration and size (`llm.stream`) and
+        the total time since `started_at` (`assistant.request`).
+
+        The trace ID is captured now, since the stream is usually consumed
+        after the request's context has been left.
+        """
+        return self._trace_stream(stream, started_at, _trace_id.get())
+
+    def _trace_stream(
+        self, stream: Iterator[str], started_at: float, trace_id: str
+    ) -> Iterator[str]:
+        stream_started_at = time.perf_counter()
+        pieces = []
+        for piece in stream:
+            if not pieces:
+                self._record_first_token(stream_started_at, trace_id)
+            pieces.append(piece)
+            yield piece
+        self._record_stream(started_at, stream_started_at, pieces, trace_id)
+
+    def atrace_stream(
+        self, stream: AsyncIterator[str], started_at: float
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronous version of `trace_stream`.
+        """
+        return self._atrace_stream(stream, started_at, _trace_id.get())
+
+    async def _atrace_stream(
+        self, stream: AsyncIterator[str], started_at: float, trace_id: str
+    ) -> AsyncIterator[str]:
+        stream_started_at = time.perf_counter()
+        pieces = []
+        async for piece in stream:
+            if not pieces:
+                self._record_first_token(stream_started_at, trace_id)
+            pieces.append(piece)
+            yield piece
+        self._record_stream(started_at, stream_started_at, pieces, trace_id)
+
+    def _record_first_token(self, started_at: float, trace_id: str):
+        token = _trace_id.set(trace_id)
+        try:
+            self.record('llm.first_token', time.perf_counter() - started_at)
+        finally:
+            _trace_id.reset(token)
+
+    def _record_stream(
+        self,
+        started_at: float,
+        stream_started_at: float,
+        pieces: List[str],
+        trace_id: str,
+    ):
+        now = time.perf_counter()
+        token = _trace_id.set(trace_id)
+        try:
+            self.record(
+                'llm.stream',
+                now - stream_started_at,
+                output_tokens=estimate_tokens(''.join(pieces)),
+            )
+            self.record('assistant.request', now - started_at)
+        finally:
+            _trace_id.reset(token)
+
+    def spans(self, name: Optional[str] = None) -> List[SpanRecord]:
+        """
+        Returns the buffered spans, oldest first, optionally of one stage.
+        """
+        with self._lock:
+            spans = list(self._spans)
+        if name is not None:
+            spans = [span for span in spans if span.name == name]
+        return spans
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the count, total and p50/p95/p99 durations of every stage.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Statistics in seconds, by stage.
+        """
+        durations: Dict[str, List[float]] = {}
+        for span in self.spans():
+            durations.setdefault(span.name, []).append(span.duration)
+        summary = {}
+        for name, values in sorted(durations.items()):
+            values.sort()
+            summary[name] = {
+                'count': len(values),
+                'sum': sum(values),
+                **{
+                    f'p{int(quantile * 100)}': _percentile(values, quantile)
+                    for quantile in QUANTILES
+                },
+            }
+        return summary
+
+    def to_jsonl(self) -> str:
+        """
+        Exports the buffered spans as JSON lines.
+        """
+        return ''.join(
+            json.dumps(dataclasses.asdict(span), ensure_ascii=False) + '\n'
+            for span in self.spans()
+        )
+
+    def to_prometheus(self, prefix: str = 'iracema') -> str:
+        """
+        Exports the stage durations as Prometheus summaries.
+        """
+        metric = f'{prefix}_stage_duration_seconds'
+        lines = [
+            f'# HELP {metric} Duration of the RAG and ingestion stages.',
+            f'# TYPE {metric} summary',
+        ]
+        for name, stats in self.summary().items():
+            stage = _METRIC_NAME.sub('_', name)
+            for quantile in QUANTILES:
+                value = stats[f'p{int(quantile * 100)}']
+                lines.append(
+                    f'{metric}{{stage="{stage}",quantile="{quantile}"}} '
+                    f'{value:.6f}'
+                )
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """
+        Empties the ring buffer.
+        """
+        with self._lock:
+            self._spans.clear()
+
+
+_shared_tracer = Shared()
+
+
+def get_tracer() -> Tracer:
+    """
+    Returns the process-wide tracer configured by the `tracing` settings.
+    """
+    return _shared_tracer.get(_create_tracer)
+
+
+def _create_tracer() -> Tracer:
+    settings = get_settings('tracing')
+    return Tracer(
+        capacity=settings.get('capacity', 2048),
+        enabled=settings.get('enabled', True),
+    )
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator that records every call of a function as a span of the
+    shared tracer.
+
+    Args:
+        name (str): Name of the stage.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,7 +1,13 @@
-from typing import Any, Dict
+import functools
+import threading
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
 
 import yaml
 
+SETTINGS_PATH = 'src/config/ieee_assistant.yaml'
+
+T = TypeVar('T')
+
 
 def read_yaml_file(file_name: str) -> Dict[str, Any]:
     """
@@ -20,3 +26,60 @@ def read_yaml_file(file_name: str) -> Dict[str, Any]:
         except yaml.YAMLError as exc:
             print(exc)
             return {}
+
+
+@functools.lru_cache(maxsize=1)
+def _read_settings_file(file_name: str) -> Dict[str, Any]:
+    return read_yaml_file(file_name) or {}
+
+
+def get_settings(section: str) -> Dict[str, Any]:
+    """
+    Returns one top-level section of the settings file (SETTINGS_PATH).
+
+    The file is parsed only once per process. Missing sections yield an
+    empty dictionary, so callers can rely on `.get()` with their defaults.
+
+    Args:
+        section (str): Name of the top-level key, e.g. 'embedding_cache'.
+
+    Returns:
+        Dict[str, Any]: A copy of the section contents.
+    """
+    return dict(_read_settings_file(SETTINGS_PATH).get(section) or {})
+
+
+class Shared(Generic[T]):
+    """
+    Holds a process-wide instance that is created on first use. Concurrent
+    first calls create it only once: the lock is taken only while the
+    instance is missing.
+
+    Attributes:
+        instance (Optional[T]): The shared instance, or None before first use.
+    """
+
+    def __init__(self, instance: Optional[T] = None):
+        self.instance = instance
+        self._lock = threading.Lock()
+
+    def get(self, factory: Callable[[], T]) -> T:
+        """
+        Returns the shared instance, creating it with `factory` if needed.
+        """
+        if self.instance is None:
+            with self._lock:
+                if self.instance is None:
+                    self.instance = factory()
+        return self.instance
+
+    def replace(self, factory: Callable[[], T]) -> Optional[T]:
+        """
+        Replaces the shared instance with a new one created by `factory`.
+
+        Returns:
+            Optional[T]: The previous instance, which the caller releases.
+        """
+        with self._lock:
+            previous, self.instance = self.instance, factory()
+        return previous
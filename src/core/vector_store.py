@@ -0,0 +1,481 @@
+import gzip
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_FILE = 'vectors.npy'
+SCALES_FILE = 'scales.npy'
+RECORDS_FILE = 'records.json.gz'
+
+# Rows multiplied per block, to bound the float32 copy of int8 vectors
+_SEARCH_BLOCK = 4096
+
+
+def _matches(metadata: dict, where: Optional[dict]) -> bool:
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$or':
+            if not any(_matches(metadata, branch) for branch in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if '$eq' in condition and value != condition['$eq']:
+                return False
+            if '$in' in condition and value not in condition['$in']:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact nearest-neighbour vector store kept in a directory of NumPy files.
+
+    Normalized vectors are stored as one contiguous float32 matrix (or an
+    int8 matrix plus one float32 scale per row when `quantize` is set) in
+    `vectors.npy`, memory-mapped when the store is opened. IDs, texts and
+    metadata live in a gzip JSON sidecar. A search is one matrix product
+    against the query vectors followed by a partial sort, which at a few
+    thousand chunks is faster than an approximate index and exact.
+
+    Writes rewrite the files atomically, so readers in other processes keep
+    their mapping of the previous version until they reopen the store.
+
+    The `get`, `delete` and `upsert` methods mirror the subset of the Chroma
+    API used by Database.
+
+    Attributes:
+        path (str): Directory of the store.
+        embedding_function (Embeddings): Embeds queries and added texts.
+        quantize (bool): Whether vectors are stored as int8.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function: Embeddings,
+        quantize: bool = False,
+    ):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.quantize = quantize
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[dict] = []
+        self._positions: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def _load(self):
+        records_path = os.path.join(self.path, RECORDS_FILE)
+        if not os.path.exists(records_path):
+            return
+        with gzip.open(records_path, 'rt', encoding='utf-8') as file:
+            records = json.load(file)
+        self.quantize = records.get('quantize', self.quantize)
+        self._ids = records['ids']
+        self._documents = records['documents']
+        self._metadatas = records['metadatas']
+        self._positions = {key: index for index, key in enumerate(self._ids)}
+        self._vectors = np.load(
+            os.path.join(self.path, VECTORS_FILE), mmap_mode='r'
+        )
+        if self.quantize:
+            self._scales = np.load(os.path.join(self.path, SCALES_FILE))
+
+    def _save(
+        self,
+        vectors: np.ndarray,
+        scales: Optional[np.ndarray],
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[dict],
+    ):
+        os.makedirs(self.path, exist_ok=True)
+        files = [(VECTORS_FILE, vectors)]
+        if scales is not None:
+            files.append((SCALES_FILE, scales))
+        for name, array in files:
+            tmp_path = os.path.join(self.path, f'{name}.tmp')
+            with open(tmp_path, 'wb') as file:
+                np.save(file, array)
+            os.replace(tmp_path, os.path.join(self.path, name))
+        self._save_records(ids, documents, metadatas)
+        self._vectors = np.load(
+            os.path.join(self.path, VECTORS_FILE), mmap_mode='r'
+        )
+        self._scales = scales
+
+    def _save_records(
+        self, ids: List[str], documents: List[str], metadatas: List[dict]
+    ):
+        tmp_path = os.path.join(self.path, f'{RECORDS_FILE}.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+            json.dump(
+                {
+                    'quantize': self.quantize,
+                    'ids': ids,
+                    'documents': documents,
+                    'metadatas': metadatas,
+                },
+                file,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, os.path.join(self.path, RECORDS_FILE))
+
+        # Searches take a snapshot of these, so they are swapped, not edited
+        self._ids = ids
+        self._documents = documents
+        self._metadatas = metadatas
+        self._positions = {key: index for index, key in enumerate(ids)}
+
+    def _encode(
+        self, vectors: np.ndarray
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        vectors = np.array(vectors, dtype=np.float32)
+        vectors /= np.maximum(
+            np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12
+        )
+        if not self.quantize:
+            return vectors, None
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _stored(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self._vectors is None:
+            return None, None
+        return np.array(self._vectors), (
+            None if self._scales is None else np.array(self._scales)
+        )
+
+    def count(self) -> int:
+        """
+        Returns the number of stored chunks.
+        """
+        return len(self._ids)
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[dict],
+    ):
+        """
+        Inserts or replaces chunks with precomputed embeddings.
+        """
+        if not ids:
+            return
+        encoded, encoded_scales = self._encode(embeddings)
+        # The last occurrence of an ID repeated in the batch wins
+        rows = sorted(
+            {chunk_id: row for row, chunk_id in enumerate(ids)}.values()
+        )
+        with self._lock:
+            vectors, scales = self._stored()
+            all_ids = list(self._ids)
+            all_documents = list(self._documents)
+            all_metadatas = list(self._metadatas)
+            new_rows = []
+            for row in rows:
+                position = self._positions.get(ids[row])
+                if position is None:
+                    all_ids.append(ids[row])
+                    all_documents.append(documents[row])
+                    all_metadatas.append(metadatas[row])
+                    new_rows.append(row)
+                    continue
+                all_documents[position] = documents[row]
+                all_metadatas[position] = metadatas[row]
+                vectors[position] = encoded[row]
+                if scales is not None:
+                    scales[position] = encoded_scales[row]
+
+            if new_rows:
+                added = encoded[new_rows]
+                vectors = (
+                    added if vectors is None else np.vstack([vectors, added])
+                )
+                if self.quantize:
+                    added_scales = encoded_scales[new_rows]
+                    scales = (
+                        added_scales
+                        if scales is None
+                        else np.concatenate([scales, added_scales])
+                    )
+            self._save(vectors, scales, all_ids, all_documents, all_metadatas)
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        """
+        Merges new metadata into stored chunks, like Chroma's `update`,
+        without touching their vectors. Unknown IDs are ignored.
+        """
+        with self._lock:
+            all_metadatas = list(self._metadatas)
+            changed = False
+            for chunk_id, metadata in zip(ids, metadatas):
+                position = self._positions.get(chunk_id)
+                if position is not None:
+                    all_metadatas[position] = {
+                        **all_metadatas[position],
+                        **metadata,
+                    }
+                    changed = True
+            if changed:
+                self._save_records(
+                    list(self._ids), list(self._documents), all_metadatas
+                )
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any):
+        """
+        Deletes chunks by ID. Unknown IDs are ignored.
+        """
+        with self._lock:
+            doomed = {
+                self._positions[chunk_id]
+                for chunk_id in ids or []
+                if chunk_id in self._positions
+            }
+            if not doomed:
+                return
+            keep = [
+                index for index in range(len(self._ids)) if index not in doomed
+            ]
+            vectors, scales = self._stored()
+            self._save(
+                vectors[keep],
+                None if scales is None else scales[keep],
+                [self._ids[index] for index in keep],
+                [self._documents[index] for index in keep],
+                [self._metadatas[index] for index in keep],
+            )
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[dict] = None,
+        include: Iterable[str] = ('documents', 'metadatas'),
+    ) -> Dict[str, list]:
+        """
+        Returns stored chunks in the format of Chroma's `get`.
+
+        Args:
+            ids (Optional[List[str]]): IDs to fetch; all chunks if None.
+            where (Optional[dict]): Metadata equality filter.
+            include (Iterable[str]): 'documents', 'metadatas' and/or
+            'embeddings'.
+
+        Returns:
+            Dict[str, list]: 'ids', 'documents' and 'metadatas' lists, and
+            'embeddings', a float32 matrix of the stored (normalized,
+            dequantized) vectors.
+        """
+        with self._lock:
+            if ids is None:
+                positions = range(len(self._ids))
+            else:
+                positions = [
+                    self._positions[chunk_id]
+                    for chunk_id in ids
+                    if chunk_id in self._positions
+                ]
+            positions = [
+                index
+                for index in positions
+                if _matches(self._metadatas[index], where)
+            ]
+            include = set(include)
+            embeddings = None
+            if 'embeddings' in include and self._vectors is None:
+                embeddings = np.zeros((0, 0), dtype=np.float32)
+            elif 'embeddings' in include:
+                embeddings = np.asarray(
+                    self._vectors[positions], dtype=np.float32
+                ).reshape(len(positions), -1)
+                if self._scales is not None:
+                    embeddings *= self._scales[positions][:, None]
+            return {
+                'ids': [self._ids[index] for index in positions],
+                'documents': [self._documents[index] for index in positions]
+                if 'documents' in include
+                else None,
+                'metadatas': [self._metadatas[index] for index in positions]
+                if 'metadatas' in include
+                else None,
+                'embeddings': embeddings,
+            }
+
+    def search_by_vectors(
+        self,
+        queries: List[List[float]],
+        k: int = 4,
+        filter: Optional[dict] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Exact top-k cosine search for several query vectors at once.
+
+        Args:
+            queries (List[List[float]]): The query embeddings.
+            k (int): Number of chunks per query.
+            filter (Optional[dict]): Metadata equality filter.
+
+        Returns:
+            List[List[Tuple[Document, float]]]: For every query, the chunks
+            with their cosine similarity, best first.
+        """
+        with self._lock:
+            vectors, scales = self._vectors, self._scales
+            ids, documents = self._ids, self._documents
+            metadatas = self._metadatas
+        # The lock is not held while multiplying, so searches run in parallel
+        if vectors is None or not ids:
+            return [[] for _ in queries]
+
+        queries = np.asarray(queries, dtype=np.float32)
+        queries /= np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+        scores = np.empty((len(queries), len(ids)), dtype=np.float32)
+        for start in range(0, len(ids), _SEARCH_BLOCK):
+            block = np.asarray(
+                vectors[start : start + _SEARCH_BLOCK], dtype=np.float32
+            )
+            scores[:, start : start + len(block)] = queries @ block.T
+        if scales is not None:
+            scores *= scales[None, :]
+        if filter:
+            allowed = np.array([_matches(m, filter) for m in metadatas])
+            scores[:, ~allowed] = -np.inf
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-scores[row, candidates])]
+            results.append([
+                (
+                    Document(
+                        page_content=documents[index],
+                        metadata=dict(metadatas[index]),
+                    ),
+                    float(scores[row, index]),
+                )
+                for index in ranked
+                if np.isfinite(scores[row, index])
+            ])
+        return results
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the `k` chunks closest to the query, with their cosine
+        distance (lower is closer, as with Chroma).
+        """
+        vector = self.embedding_function.embed_query(query)
+        (results,) = self.search_by_vectors([vector], k, filter)
+        return [(document, 1 - score) for document, score in results]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs
+    ) -> List[Document]:
+        return [
+            document
+            for document, _ in self.similarity_search_with_score(
+                query, k, filter
+            )
+        ]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        **kwargs,
+    ) -> List[Document]:
+        (results,) = self.search_by_vectors([embedding], k, filter)
+        return [document for document, _ in results]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [
+            metadata.get('id') or str(len(self._ids) + index)
+            for index, metadata in enumerate(metadatas)
+        ]
+        self.upsert(
+            ids,
+            self.embedding_function.embed_documents(texts),
+            texts,
+            metadatas,
+        )
+        return ids
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        path: str = 'vectors/',
+        **kwargs: Any,
+    ) -> 'NumpyVectorStore':
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+def convert_chroma_collection(
+    chroma, path: str, embedding_function: Embeddings, quantize: bool = False
+) -> NumpyVectorStore:
+    """
+    Copies every chunk and vector of a Chroma collection into a
+    NumpyVectorStore, without embedding anything again.
+
+    Args:
+        chroma (Chroma): The source LangChain Chroma store.
+        path (str): Directory of the new store; it is replaced.
+        embedding_function (Embeddings): The embedding function of the
+        store.
+        quantize (bool): Whether to store int8 vectors.
+
+    Returns:
+        NumpyVectorStore: The new store.
+    """
+    items = chroma.get(include=['documents', 'metadatas', 'embeddings'])
+    for name in (VECTORS_FILE, SCALES_FILE, RECORDS_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    store = NumpyVectorStore(path, embedding_function, quantize=quantize)
+    store.upsert(
+        list(items['ids']),
+        np.asarray(items['embeddings'], dtype=np.float32),
+        list(items['documents']),
+        list(items['metadatas']),
+    )
+    return store
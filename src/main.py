@@ -1,34 +1,108 @@
+import argparse
+import subprocess
+import sys
+import time
+
 from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.config.assistant_config import get_shared_assistant
+from src.core.indexer import index_directory
+from src.core.retriever import get_retriever
 
 load_dotenv()
-from src.config.assistant_config import IeeeAssistant
-from src.core.database import add_to_chroma
-from src.core.loader import load_pdf_directory, split_documents
 
 LOAD = False
+PROFILE_QUESTION = 'O que é o Ramo Estudantil IEEE UFC Fortaleza?'
 
-if __name__ == '__main__':
-    if LOAD:
-        documents = load_pdf_directory()
-        print(f'Loaded {len(documents)} documents')
-        print(documents[0])
 
-        print('Splitting documents...')
-        chunks = split_documents(documents)
-        print(f'Split {len(documents)} documents into {len(chunks)} chunks')
-        print(chunks[0])
+def profile_startup(question: str):
+    """
+    Reports how long each startup step takes: the imports (timed in a new
+    interpreter, since this one already has them), building the shared
+    assistant, opening the retriever, a second session and the first answer
+    (time to first token and total).
+    """
+    timings = []
+
+    def step(name, function):
+        started_at = time.perf_counter()
+        result = function()
+        timings.append((name, time.perf_counter() - started_at))
+        return result
+
+    step(
+        'imports (new interpreter)',
+        lambda: subprocess.run(
+            [
+                sys.executable,
+                '-c',
+                'import src.config.assistant_config, src.core.retriever',
+            ],
+            check=True,
+        ),
+    )
+    step('shared assistant', get_shared_assistant)
+    step('retriever (open + warm up)', get_retriever)
+    assistant = step('second session', get_shared_assistant)
+
+    started_at = time.perf_counter()
+    first_token = None
+    try:
+        for _ in assistant.run_assistant(
+            question, [HumanMessage(content=question)], 'profile-startup'
+        ):
+            if first_token is None:
+                first_token = time.perf_counter() - started_at
+        timings.append(('first answer: first token', first_token or 0.0))
+        timings.append(
+            ('first answer: total', time.perf_counter() - started_at)
+        )
+    except Exception as e:
+        print(f'An error occurred while answering: {e}')
 
-        print('Done!')
+    print('\nStartup profile:')
+    for name, seconds in timings:
+        print(f'  {name:<30} {seconds * 1000:>9.1f} ms')
+    print('Run `python -X importtime -m src.main` for a per-module breakdown.')
 
-        print('Adding chunks to Chroma...')
-        add_to_chroma(chunks)
-        print('Done!')
 
-    assistant = IeeeAssistant()
-    assistant.get_assistant()
+def chat():
+    if LOAD:
+        print('Indexing documents...')
+        stats = index_directory()
+        print(f'Done! {stats}')
+
+    assistant = get_shared_assistant()
     print('Assistant initialized!')
 
+    chat_history = []
     while True:
         query = input('Ask me anything: ')
-        resposta = assistant.run_assistant(query)
-        print(resposta)
+        chat_history.append(HumanMessage(content=query))
+        resposta = ''
+        for piece in assistant.run_assistant(query, chat_history):
+            print(piece, end='', flush=True)
+            resposta += piece
+        print()
+        chat_history.append(AIMessage(content=resposta))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Chat with Iracema.AI.')
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help='report import and first-answer timings, then exit',
+    )
+    parser.add_argument(
+        '--question',
+        default=PROFILE_QUESTION,
+        help='question answered by --profile-startup',
+    )
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        profile_startup(args.question)
+    else:
+        chat()
@@ -0,0 +1,77 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+from langchain_core.documents import Document
+
+import src.core.embeddings
+import src.core.indexer
+import src.core.tracing
+import src.core.utils
+from src.core.utils import Shared
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def write_pdf(path: Path, pages):
+    """
+    Writes a fake PDF: the pages are stored as JSON, so the file hash still
+    changes with the text and `fake_pdf_pages` can read them back.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(pages, ensure_ascii=False), encoding='utf-8')
+
+
+def fake_pdf_pages(file_paths, *args, **kwargs):
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            pages = json.load(file)
+        for number, text in enumerate(pages):
+            yield Document(
+                page_content=text,
+                metadata={'source': file_path, 'page': number},
+            )
+
+
+@pytest.fixture
+def settings():
+    """
+    The repository settings with offline embeddings and the NumPy vector
+    store. Tests may change them before the `workspace` fixture is used.
+    """
+    values = src.core.utils.read_yaml_file(
+        str(ROOT / src.core.utils.SETTINGS_PATH)
+    )
+    values['embeddings'] = {'backend': 'hashing', 'dimension': 64}
+    values['vector_store'] = {'backend': 'numpy', 'quantize': False}
+    values['embedding_cache']['persist'] = False
+    values['ingestion'].update(
+        max_workers=1,
+        batch_size=4,
+        upsert_batch_size=4,
+        queue_size=2,
+    )
+    values['chunking'].update(min_segment_chars=40, max_segment_chars=300)
+    values['tracing']['enabled'] = False
+    return values
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, settings):
+    """
+    Runs a test in an empty directory, with the `settings` fixture as the
+    settings file, fake PDFs and fresh process-wide singletons.
+    """
+    settings_path = tmp_path / 'settings.yaml'
+    settings_path.write_text(
+        yaml.safe_dump(settings, allow_unicode=True), encoding='utf-8'
+    )
+    monkeypatch.setattr(src.core.utils, 'SETTINGS_PATH', str(settings_path))
+    monkeypatch.setattr(src.core.embeddings, '_shared_embeddings', Shared())
+    monkeypatch.setattr(src.core.tracing, '_shared_tracer', Shared())
+    monkeypatch.setattr(src.core.indexer, 'iter_pdf_pages', fake_pdf_pages)
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('docs', exist_ok=True)
+    return tmp_path
@@ -1,27 +1,20 @@
-import os
+from src.core.retriever import get_retriever
 
-from dotenv import load_dotenv
 
-from core.database import DB
-
-load_dotenv()
-
-CHROMA_PATH = os.getenv('CHROMA_PATH')
-
-
-def query_rag(query_text: str) -> str:
+def query_rag(query_text: str) -> list:
     """Query the RAG model with the given text."""
 
-    retriever = DB.as_retriever(search_kwargs={'k': 6})
-
-    docs = retriever.invoke(query_text)
+    docs = get_retriever().query_rag(query_text)
 
-    # result = DB.similarity_search_with_score(query_text, k=5)
+    # result = get_retriever().database.similarity_search_with_score(
+    #     query_text, k=6
+    # )
 
-    for res in docs:
+    for res in docs or []:
         print(res)
         print('\n')
     return docs
 
 
-query_rag('abertura capitulo estudantil')
+if __name__ == '__main__':
+    query_rag('abertura capitulo estudantil')
@@ -0,0 +1,149 @@
+import os
+
+import pytest
+import yaml
+from langchain_core.documents import Document
+
+import src.core.answer_cache
+import src.core.embeddings
+from src.config.assistant_config import AssistantRegistry, IeeeAssistant
+from src.core.answer_cache import AnswerCache
+from src.core.embeddings import HashingEmbeddings
+from src.core.utils import Shared
+
+CHUNKS = ['docs/a.pdf:0:0', 'docs/a.pdf:1:0']
+ANSWER = 'O presidente convoca a assembleia geral.'
+PIECES = ['O presidente ', 'convoca a ', 'assembleia geral.']
+LOOKUPS = 2
+ASSISTANT_VERSIONS = 2
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def answered(cache: AnswerCache, query: str, chunk_ids=CHUNKS):
+    return ''.join(cache.record(query, chunk_ids, iter(PIECES), 0.0))
+
+
+def test_recording_an_answer_does_not_embed(workspace):
+    cache = AnswerCache()
+    embeddings = CountingEmbeddings()
+
+    assert answered(cache, 'Quem convoca a assembleia?') == ANSWER
+    assert cache.lookup('Quem vota?', embeddings.embed_query, ['x']) is None
+
+    assert embeddings.queries == []
+    assert cache.stats()['entries'] == 1
+
+
+def test_lookup_embeds_only_entries_for_the_same_chunks(workspace):
+    cache = AnswerCache()
+    embeddings = CountingEmbeddings()
+    answered(cache, 'Quem convoca a assembleia?')
+    answered(cache, 'Quem vota?', ['docs/b.pdf:0:0'])
+
+    question = 'Quem convoca a assembleia?'
+    hit = cache.lookup(question, embeddings.embed_query, CHUNKS)
+    cache.lookup(question, embeddings.embed_query, CHUNKS)
+
+    assert hit.answer == ANSWER
+    # The cached question is embedded once and then kept
+    assert embeddings.queries.count('Quem vota?') == 0
+    assert embeddings.queries.count(question) == LOOKUPS + 1
+    assert cache.stats()['hits'] == LOOKUPS
+
+
+class FakeChain:
+    def __init__(self):
+        self.calls = 0
+
+    def stream(self, inputs):
+        self.calls += 1
+        yield from PIECES
+
+
+@pytest.fixture
+def assistant(workspace, monkeypatch):
+    embeddings = CountingEmbeddings()
+    monkeypatch.setattr(
+        src.core.embeddings, '_shared_embeddings', Shared(embeddings)
+    )
+    monkeypatch.setattr(src.core.answer_cache, '_shared_cache', Shared())
+    assistant = IeeeAssistant(configs=[{'config': {}}])
+    assistant.assistant = FakeChain()
+    # Chunks found by the lexical fast path, without embedding the query
+    assistant.documents_retriever = lambda query: [
+        Document(
+            page_content='Art. 5 O presidente convoca.',
+            metadata={'id': chunk_id, 'source': 'docs/a.pdf', 'page': 0},
+        )
+        for chunk_id in CHUNKS
+    ]
+    return assistant, embeddings
+
+
+def test_fast_path_answers_are_cached_without_embedding(assistant):
+    assistant, embeddings = assistant
+    question = 'Quem convoca a assembleia?'
+
+    first = ''.join(assistant.run_assistant(question, []))
+    assert embeddings.queries == []
+
+    second = ''.join(assistant.run_assistant(question, []))
+    assert second == first
+    assert assistant.assistant.calls == 1
+
+
+def write_assistant(path, system_message: str, mtime: float):
+    path.write_text(
+        yaml.safe_dump({
+            'config': {
+                'system_message': system_message,
+                'model': 'gemini-1.5-flash',
+                'temperature': 0,
+            }
+        }),
+        encoding='utf-8',
+    )
+    os.utime(path, (mtime, mtime))
+
+
+def test_reloaded_prompt_does_not_replay_cached_answers(
+    assistant, monkeypatch, tmp_path
+):
+    fast_path = assistant[0].documents_retriever
+    monkeypatch.setattr(
+        IeeeAssistant, 'documents_retriever', staticmethod(fast_path)
+    )
+    monkeypatch.setattr(
+        IeeeAssistant,
+        'get_assistant',
+        lambda self, llm=None: setattr(self, 'assistant', FakeChain()),
+    )
+    monkeypatch.setattr(AssistantRegistry, '_llm_for', lambda self, _: None)
+    config_dir = tmp_path / 'assistants'
+    config_dir.mkdir()
+    path = config_dir / 'iracema.yaml'
+    write_assistant(path, 'Responda em português.', mtime=1)
+    registry = AssistantRegistry(str(config_dir), str(path), 0)
+    question = 'Quem convoca a assembleia?'
+
+    ''.join(registry.get().run_assistant(question, []))
+    ''.join(registry.get().run_assistant(question, []))
+    assert registry.get().assistant.calls == 1
+
+    write_assistant(path, 'Responda em inglês.', mtime=2)
+    reloaded = registry.get()
+    ''.join(reloaded.run_assistant(question, []))
+
+    assert reloaded.assistant.calls == 1
+    stats = src.core.answer_cache.get_answer_cache().stats()
+    assert stats['hits'] == 1
+    assert stats['entries'] == ASSISTANT_VERSIONS
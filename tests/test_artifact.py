@@ -0,0 +1,93 @@
+import io
+import tarfile
+from pathlib import Path
+
+import pytest
+
+import src.core.embeddings
+from src.core.artifact import (
+    RECORDS_MEMBER,
+    InvalidArtifactError,
+    corpus_hash,
+    export_index,
+    import_index,
+)
+from src.core.database import Database, EmbeddingModelMismatchError
+from src.core.embeddings import HashingEmbeddings
+from src.core.indexer import index_directory
+from src.core.utils import Shared
+from tests.conftest import write_pdf
+
+PAGES = [
+    'Art. 1º A assembleia geral elege a diretoria do ramo a cada ano.',
+    'Art. 2º A tesouraria presta contas ao conselho no fim do mandato.',
+]
+OTHER_DIMENSION = 32
+
+
+def read_corpus():
+    db = Database()
+    try:
+        ids, vectors, documents, metadatas = db.read_all(1000)
+    finally:
+        db.close()
+    return corpus_hash(ids, documents, metadatas), len(vectors)
+
+
+@pytest.fixture
+def artifact(workspace):
+    write_pdf(Path('docs') / 'estatuto.pdf', PAGES)
+    index_directory('docs')
+    path = str(workspace / 'artifacts' / 'index.tar.gz')
+    return path, export_index(path)
+
+
+def test_import_restores_the_exported_index(artifact):
+    path, exported = artifact
+    assert exported['chunks'] > 0
+    assert (
+        Path(f'{path}.sha256')
+        .read_text(encoding='utf-8')
+        .startswith(exported['sha256'])
+    )
+
+    imported = import_index(path)
+
+    assert imported['corpus_hash'] == exported['corpus_hash']
+    assert read_corpus() == (exported['corpus_hash'], exported['chunks'])
+
+
+def test_corrupted_artifact_is_refused(artifact):
+    path, _ = artifact
+    with tarfile.open(path, 'r:gz') as archive:
+        members = {
+            member.name: archive.extractfile(member).read()
+            for member in archive.getmembers()
+        }
+    members[RECORDS_MEMBER] = members[RECORDS_MEMBER].replace(
+        b'assembleia', b'diretoria'
+    )
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    with pytest.raises(InvalidArtifactError):
+        import_index(path)
+
+
+def test_artifact_of_another_model_is_refused(artifact, monkeypatch):
+    path, exported = artifact
+    configured = src.core.embeddings._shared_embeddings
+    monkeypatch.setattr(
+        src.core.embeddings,
+        '_shared_embeddings',
+        Shared(HashingEmbeddings(dimension=OTHER_DIMENSION)),
+    )
+
+    with pytest.raises(EmbeddingModelMismatchError):
+        import_index(path)
+    # Nothing was deleted
+    monkeypatch.setattr(src.core.embeddings, '_shared_embeddings', configured)
+    assert read_corpus()[0] == exported['corpus_hash']
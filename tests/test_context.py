@@ -0,0 +1,80 @@
+import re
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.core.context import ContextAssembler
+from src.core.sessions import SessionHistory
+
+SAVED = re.compile(r'\((\d+) saved\)')
+
+
+def conversation(turns: int):
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=f'Pergunta {turn} sobre o ramo?'))
+        messages.append(
+            AIMessage(content=f'Resposta {turn}. ' + 'Detalhes longos. ' * 20)
+        )
+    return messages
+
+
+def chunk(chunk_id: str, text: str):
+    source, page, _ = chunk_id.split(':')
+    return Document(
+        page_content=text,
+        metadata={'id': chunk_id, 'source': source, 'page': int(page)},
+    )
+
+
+def saved_tokens(output: str) -> int:
+    return int(SAVED.search(output).group(1))
+
+
+def test_nothing_is_saved_when_nothing_is_trimmed(capsys):
+    assembler = ContextAssembler()
+    history = [*conversation(1), HumanMessage(content='Quem vota?')]
+    documents = [
+        chunk('docs/a.pdf:0:0', 'Art. 1 Os membros votam.'),
+        chunk('docs/b.pdf:3:1', 'Art. 9 A diretoria convoca a assembleia.'),
+    ]
+
+    selected, rendered = assembler.assemble(
+        documents, history, 'Quem vota?', 'session'
+    )
+
+    assert selected == documents
+    assert 'Pergunta 0' in rendered
+    assert 'Quem vota?' not in rendered
+    assert saved_tokens(capsys.readouterr().out) == 0
+
+
+def test_trimmed_history_and_duplicates_are_saved(capsys):
+    assembler = ContextAssembler(history_turns=2, max_history_tokens=400)
+    text = 'Art. 3 O presidente representa o Ramo em todos os eventos.'
+    documents = [
+        chunk('docs/a.pdf:0:0', text),
+        chunk('docs/b.pdf:2:0', text),
+    ]
+
+    selected, rendered = assembler.assemble(
+        documents, conversation(8), 'Quem preside?', 'session'
+    )
+
+    assert len(selected) == 1
+    assert rendered.startswith('Resumo da conversa anterior:')
+    assert saved_tokens(capsys.readouterr().out) > 0
+
+
+def test_summary_stays_aligned_after_messages_are_dropped():
+    assembler = ContextAssembler(history_turns=1)
+    messages = conversation(6)
+    assembler.build_history(messages, '', 'session')
+
+    # The store dropped the first two turns; the summary keeps them
+    history = SessionHistory(messages[4:], dropped=4)
+    rendered = assembler.build_history(history, '', 'session')
+
+    assert rendered.count('Humano perguntou: Pergunta 0') == 1
+    assert 'Humano perguntou: Pergunta 4' in rendered
+    assert 'Humano: Pergunta 5' in rendered
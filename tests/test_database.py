@@ -0,0 +1,67 @@
+import gc
+from pathlib import Path
+
+import pytest
+
+import src.core.retriever
+from src.core.database import (
+    LEXICAL_INDEX_FILE,
+    Database,
+    load_lexical_index,
+)
+from src.core.indexer import index_directory
+from src.core.retriever import get_retriever, open_clients, reload_retriever
+from src.core.utils import Shared
+from tests.conftest import write_pdf
+
+QUERIES = ['Quem pode votar na assembleia?']
+
+
+@pytest.fixture
+def chroma_settings(settings):
+    settings['vector_store'] = {'backend': 'chroma'}
+    return settings
+
+
+def test_chroma_client_is_stopped_with_its_last_database(
+    chroma_settings, workspace
+):
+    first = Database()
+    second = Database()
+    assert open_clients() == 1
+
+    first.close()
+    assert open_clients() == 1
+    assert second.count() == 0
+
+    del second
+    gc.collect()
+    assert open_clients() == 0
+
+
+def test_reload_keeps_the_previous_retriever_usable(workspace, monkeypatch):
+    monkeypatch.setattr(src.core.retriever, '_shared_retriever', Shared())
+    previous = get_retriever()
+
+    current = reload_retriever()
+
+    assert current is not previous
+    assert previous.query_rag_batch(QUERIES) == [[]]
+
+
+def test_rebuilt_lexical_index_is_saved(workspace):
+    write_pdf(
+        Path('docs/estatuto.pdf'),
+        ['Art. 1 A assembleia geral elege a diretoria.'],
+    )
+    index_directory()
+    (workspace / LEXICAL_INDEX_FILE).unlink()
+
+    db = Database()
+    try:
+        rebuilt = load_lexical_index(db)
+    finally:
+        db.close()
+
+    assert len(rebuilt)
+    assert len(load_lexical_index()) == len(rebuilt)
@@ -0,0 +1,99 @@
+from langchain_core.documents import Document
+
+from src.core.dedupe import DuplicateIndex
+
+SIGHT_SOURCE = 'docs/Regimento_IEEE_SIGHT_UFC_Fortaleza_2023.pdf'
+WIE_SOURCE = 'docs/Regimento_IEEE_WIE_UFC_2024_1.pdf'
+LOW_THRESHOLD = 0.5
+
+# The same clause in two sibling regulations, which only differ in the
+# article number and the name of the group
+SIGHT_ARTICLE = (
+    'Art. 11 As comissões são sempre representadas por membros do Grupo '
+    'SIGHT no qual um deles é o(a) coor-\ndenador(a).\n§ 1º O(A) '
+    'coordenador(a) tem a função de liderar e ser responsável por todo o '
+    'comitê, de forma a\ndelegar tarefas e atividades para cada um dos '
+    'membros, bem como cobrar a entrega destas.\n§ 2º Os (as) '
+    'coordenadores (as) do comitê devem apresentar um relatório final '
+    'contendo uma análise\nde sua gestão, bem como indicadores, avaliação e '
+    'atividades.'
+)
+WIE_ARTICLE = (
+    'Art. 12 º As comissões são sempre representadas por membros do Grupo '
+    'de afinidade no qual um deles é o(a)\ncoordenador(a).\n§ 1º O(A) '
+    'coordenador(a) tem a função de liderar e ser responsável por todo o '
+    'comitê, de forma a\ndelegar tarefas e atividades para cada um dos '
+    'membros, bem como cobrar a entrega destas.\n§ 2º Os(as) '
+    'coordenadores(as) do comitê devem apresentar um relatório final '
+    'contendo uma análise de\nsua gestão, bem como indicadores, avaliação e '
+    'atividades.'
+)
+
+
+def chunk(text: str, source: str, page: int = 5, index: int = 0):
+    return Document(
+        page_content=text,
+        metadata={
+            'id': f'{source}:{page}:{index}',
+            'source': source,
+            'page': page,
+        },
+    )
+
+
+def test_sibling_clauses_are_not_merged():
+    duplicates = DuplicateIndex()
+    articles = [
+        chunk(SIGHT_ARTICLE, SIGHT_SOURCE),
+        chunk(WIE_ARTICLE, WIE_SOURCE),
+    ]
+
+    for article in articles:
+        assert duplicates.assign(article) is None
+    assert len(duplicates) == len(articles)
+    assert duplicates.duplicates() == 0
+
+
+def test_same_clause_in_another_document_is_merged():
+    duplicates = DuplicateIndex()
+    sight = chunk(SIGHT_ARTICLE, SIGHT_SOURCE)
+    # The same clause extracted without the hyphenation and line breaks
+    copy = chunk(
+        SIGHT_ARTICLE.replace('coor-\ndenador', 'coordenador').replace(
+            '\n', ' '
+        ),
+        WIE_SOURCE,
+        7,
+    )
+
+    duplicates.assign(sight)
+
+    assert duplicates.assign(copy) == sight.metadata['id']
+    assert duplicates.occurrences(sight.metadata['id']) == [
+        [SIGHT_SOURCE, 5],
+        [WIE_SOURCE, 7],
+    ]
+
+
+def test_members_below_the_threshold_become_orphans(tmp_path):
+    path = str(tmp_path / 'duplicates.json.gz')
+    sight = chunk(SIGHT_ARTICLE, SIGHT_SOURCE)
+    duplicates = DuplicateIndex(threshold=LOW_THRESHOLD)
+    duplicates.assign(sight)
+    # Merged under a lower threshold
+    assert (
+        duplicates.assign(chunk(WIE_ARTICLE, WIE_SOURCE))
+        == (sight.metadata['id'])
+    )
+    duplicates.save(path)
+
+    loaded = DuplicateIndex()
+    assert loaded.load(path)
+    released = loaded.check_members()
+
+    assert released == 1
+    assert [orphan.page_content for orphan in loaded.take_orphans()] == [
+        WIE_ARTICLE
+    ]
+    assert loaded.take_touched() == {sight.metadata['id']}
+    assert loaded.occurrences(sight.metadata['id']) == [[SIGHT_SOURCE, 5]]
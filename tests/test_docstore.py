@@ -0,0 +1,49 @@
+from langchain_core.documents import Document
+
+from src.core.context import get_context_assembler
+from src.core.docstore import load_page_store
+from src.core.retriever import SEARCH_K
+
+SOURCE = (
+    'docs/Manual_de_Conduta_e_Boas_Práticas_Ramo_Estudantil_IEEE_UFC_'
+    'Fortaleza_2024_2.pdf'
+)
+CHUNKS_PER_PAGE = 3
+WORDS_PER_CHUNK = 90
+
+
+def page_with_chunks(page: int):
+    chunks = [
+        Document(
+            page_content=' '.join(
+                f'termo{page}x{index}x{word}'
+                for word in range(WORDS_PER_CHUNK)
+            ),
+            metadata={
+                'id': f'{SOURCE}:{page}:{index}',
+                'source': SOURCE,
+                'page': page,
+            },
+        )
+        for index in range(CHUNKS_PER_PAGE)
+    ]
+    text = '\n'.join(chunk.page_content for chunk in chunks)
+    return Document(
+        page_content=text, metadata={'source': SOURCE, 'page': page}
+    ), chunks
+
+
+def test_every_expanded_hit_fits_the_context_budget(workspace):
+    store = load_page_store(SEARCH_K)
+    hits = []
+    for page in range(SEARCH_K):
+        document, chunks = page_with_chunks(page)
+        store.add_page(document, chunks)
+        hits.append(chunks[1])
+
+    expanded = store.expand(hits)
+    selected = get_context_assembler().select_documents(expanded)
+
+    assert len(expanded) == SEARCH_K
+    assert all(document.metadata['expanded'] for document in expanded)
+    assert len(selected) == SEARCH_K
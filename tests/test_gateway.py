@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from src.core.embeddings import StubRateLimitError
+from src.core.gateway import GatewayOverloadedError, ModelGateway
+
+WAIT_SECONDS = 5.0
+
+
+def queued(gateway: ModelGateway) -> int:
+    return sum(gateway.stats()['queued'].values())
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + WAIT_SECONDS
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def waiter(gateway: ModelGateway, priority: str, admitted: list):
+    def run():
+        ticket = gateway.acquire(priority)
+        admitted.append(priority)
+        gateway.release(ticket)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_interactive_calls_are_admitted_before_ingestion(workspace):
+    gateway = ModelGateway(max_concurrency=1, requests_per_minute=None)
+    running = gateway.acquire('ingestion')
+    admitted = []
+
+    threads = [waiter(gateway, 'ingestion', admitted)]
+    wait_until(lambda: queued(gateway) == 1)
+    threads.append(waiter(gateway, 'interactive', admitted))
+    wait_until(lambda: queued(gateway) == len(threads))
+    gateway.release(running)
+    for thread in threads:
+        thread.join(WAIT_SECONDS)
+
+    assert admitted == ['interactive', 'ingestion']
+
+
+def test_calls_are_refused_when_the_queue_is_full(workspace):
+    gateway = ModelGateway(
+        max_concurrency=1, max_queue=1, requests_per_minute=None
+    )
+    running = gateway.acquire()
+    admitted = []
+    thread = waiter(gateway, 'interactive', admitted)
+    wait_until(lambda: queued(gateway) == 1)
+
+    with pytest.raises(GatewayOverloadedError):
+        gateway.acquire()
+    assert gateway.saturated()
+
+    gateway.release(running)
+    thread.join(WAIT_SECONDS)
+    assert admitted == ['interactive']
+    assert gateway.stats()['rejected'] == 1
+
+
+def test_calls_give_up_after_max_wait(workspace):
+    gateway = ModelGateway(
+        max_concurrency=1, max_wait=0.05, requests_per_minute=None
+    )
+    gateway.acquire()
+
+    with pytest.raises(GatewayOverloadedError):
+        gateway.acquire()
+
+    assert gateway.stats()['timed_out'] == 1
+    assert queued(gateway) == 0
+
+
+def test_quota_error_pauses_every_call(workspace):
+    gateway = ModelGateway(throttle_seconds=WAIT_SECONDS)
+
+    with pytest.raises(StubRateLimitError), gateway.admit():
+        raise StubRateLimitError('429 Resource has been exhausted')
+
+    assert gateway.stats()['throttled'] == 1
+    assert gateway.stats()['active'] == 0
+    assert gateway.retry_after() > 1
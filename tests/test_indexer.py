@@ -0,0 +1,161 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src.core.database import CHROMA_PATH, Database, clear_database
+from src.core.embedding_pipeline import CHECKPOINT_FILE
+from src.core.indexer import MANIFEST_FILE, index_directory, load_manifest
+from tests.conftest import write_pdf
+
+TOPICS = [
+    'eleições da diretoria',
+    'assembleia geral',
+    'tesouraria do ramo',
+    'capítulos técnicos',
+    'desligamento de membros',
+    'eventos acadêmicos',
+]
+
+
+def article_page(document: int, page: int) -> str:
+    return ' '.join(
+        f'Art. {document * 100 + page * 10 + number}º O documento {document} '
+        f'trata de {TOPICS[(page + number) % len(TOPICS)]} na página {page}, '
+        f'parágrafo {number}, com regras próprias de prazo e quórum.'
+        for number in range(6)
+    )
+
+
+def write_corpus(documents: int = 3, pages: int = 3):
+    for document in range(documents):
+        write_pdf(
+            Path('docs') / f'doc{document}.pdf',
+            [article_page(document, page) for page in range(pages)],
+        )
+
+
+def manifest_ids():
+    return {
+        chunk_id
+        for entry in load_manifest()['files'].values()
+        for page in entry['pages'].values()
+        for chunk_id in page['chunk_ids']
+    }
+
+
+def stored_ids():
+    db = Database()
+    try:
+        return set(db.database.get(include=[])['ids'])
+    finally:
+        db.close()
+
+
+# Upsert call that fails in an interrupted run
+FAILING_UPSERT = 3
+
+
+class Interrupted(Exception):
+    pass
+
+
+def index_interrupted(monkeypatch):
+    """
+    Runs index_directory with its third upsert failing, as if the process
+    stopped after two committed batches.
+    """
+    upsert = Database.upsert
+    calls = []
+
+    def failing_upsert(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == FAILING_UPSERT:
+            raise Interrupted()
+        return upsert(self, *args, **kwargs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Database, 'upsert', failing_upsert)
+        with pytest.raises(Interrupted):
+            index_directory()
+
+
+def test_index_directory_records_every_chunk(workspace):
+    write_corpus()
+
+    stats = index_directory()
+
+    assert stats['upserted_chunks'] > FAILING_UPSERT * 4
+    assert manifest_ids() == stored_ids()
+
+
+def test_resume_records_chunks_committed_before_interruption(
+    workspace, monkeypatch
+):
+    write_corpus()
+    index_interrupted(monkeypatch)
+    committed = stored_ids()
+    assert committed
+
+    index_directory()
+
+    assert committed <= manifest_ids()
+    assert manifest_ids() == stored_ids()
+    assert not (workspace / CHECKPOINT_FILE).exists()
+
+
+def test_resume_then_remove_file_leaves_no_orphans(workspace, monkeypatch):
+    write_corpus()
+    index_interrupted(monkeypatch)
+    index_directory()
+
+    (workspace / 'docs' / 'doc0.pdf').unlink()
+    stats = index_directory()
+
+    assert stats['deleted_chunks'] > 0
+    assert manifest_ids() == stored_ids()
+    assert not any(
+        chunk_id.startswith('docs/doc0') for chunk_id in stored_ids()
+    )
+
+
+def test_rebuild_after_interruption_stores_every_chunk(workspace, monkeypatch):
+    write_corpus()
+    index_directory()
+    expected = stored_ids()
+    clear_database()
+    index_interrupted(monkeypatch)
+
+    clear_database()
+    index_directory()
+
+    assert stored_ids() == expected
+    assert manifest_ids() == expected
+
+
+def test_checkpoint_of_deleted_collection_is_not_trusted(
+    workspace, monkeypatch
+):
+    write_corpus()
+    index_interrupted(monkeypatch)
+    assert (workspace / CHECKPOINT_FILE).exists()
+
+    # The collection is deleted without clear_database
+    shutil.rmtree(workspace / CHROMA_PATH)
+    index_directory()
+
+    assert stored_ids() == manifest_ids()
+    assert len(stored_ids()) > FAILING_UPSERT * 4
+
+
+def test_collection_without_manifest_leaves_no_legacy_chunks(workspace):
+    write_corpus(pages=3)
+    index_directory()
+    # As in a collection indexed before the manifest existed
+    (workspace / MANIFEST_FILE).unlink()
+
+    write_corpus(pages=2)
+    index_directory()
+
+    assert manifest_ids() == stored_ids()
+    assert not any(':2:' in chunk_id for chunk_id in stored_ids())
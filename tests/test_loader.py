@@ -0,0 +1,24 @@
+import pypdf
+
+from src.core.loader import iter_pdf_pages, list_pdf_files
+from tests.conftest import ROOT
+
+PAGES_PER_TASK = 4
+WORKERS = 2
+
+
+def test_pages_are_yielded_in_file_and_page_order():
+    files = list_pdf_files(str(ROOT / 'docs'))
+    expected = [
+        (file_path, page)
+        for file_path in files
+        for page in range(len(pypdf.PdfReader(file_path).pages))
+    ]
+
+    pages = iter_pdf_pages(
+        files, max_workers=WORKERS, pages_per_task=PAGES_PER_TASK
+    )
+
+    assert [
+        (page.metadata['source'], page.metadata['page']) for page in pages
+    ] == expected
@@ -0,0 +1,160 @@
+import re
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+from src.core.embedding_pipeline import (
+    EmbeddingCheckpoint,
+    RetryPolicy,
+    embed_with_retry,
+)
+from src.core.embeddings import HashingEmbeddings, StubRateLimitError
+from src.core.gateway import TokenBucket
+from src.core.pipeline import Stage, run_pipeline
+
+BATCH_SIZE = 3
+ITEMS = 10
+FAILURES = 2
+TEXTS = ['Art. 1 Os membros votam.', 'Art. 2 A diretoria convoca.']
+SLOW_SECONDS = 0.05
+BUSY_TIME = re.compile(r'(\w+) ([\d.]+)s')
+
+
+class Failed(Exception):
+    pass
+
+
+def pipeline_threads():
+    return [
+        thread
+        for thread in threading.enumerate()
+        if thread is not threading.current_thread() and thread.daemon
+    ]
+
+
+def test_items_flow_through_every_stage():
+    stages = [
+        Stage('double', lambda item: [item * 2], workers=3),
+        Stage('sum', lambda batch: [sum(batch)], batch_size=BATCH_SIZE),
+    ]
+
+    sums = list(run_pipeline(range(ITEMS), stages, queue_size=2))
+
+    assert sum(sums) == sum(range(ITEMS)) * 2
+    assert len(sums) == -(-ITEMS // BATCH_SIZE)
+
+
+def test_ordered_stage_keeps_the_input_order():
+    def slow_first(item):
+        # Earlier items finish last
+        time.sleep((ITEMS - item) / 1000)
+        return [item, item]
+
+    stage = Stage('copy', slow_first, workers=4, ordered=True)
+
+    outputs = list(run_pipeline(range(ITEMS), [stage], queue_size=2))
+
+    assert outputs == [item for item in range(ITEMS) for _ in range(2)]
+
+
+def test_busy_time_leaves_out_waiting_for_the_next_stage(capsys):
+    def slow(item):
+        time.sleep(SLOW_SECONDS)
+        return [item]
+
+    stages = [Stage('fast', lambda item: [item]), Stage('slow', slow)]
+
+    list(run_pipeline(range(ITEMS), stages, queue_size=1))
+
+    report = capsys.readouterr().out.partition('busy time:')[2]
+    busy = dict(BUSY_TIME.findall(report))
+    assert float(busy['fast']) < float(busy['slow']) / 2
+
+
+def test_stage_error_is_raised_by_the_iterator():
+    def explode(item):
+        if item == BATCH_SIZE:
+            raise Failed()
+        return [item]
+
+    with pytest.raises(Failed):
+        list(run_pipeline(range(ITEMS), [Stage('explode', explode)]))
+
+
+def test_closing_early_stops_every_thread():
+    closed = threading.Event()
+
+    def source():
+        try:
+            yield from range(1000)
+        finally:
+            closed.set()
+
+    before = len(pipeline_threads())
+    results = run_pipeline(
+        source(), [Stage('copy', lambda item: [item], workers=2)], 1
+    )
+    assert next(results) == 0
+    results.close()
+
+    assert closed.is_set()
+    assert len(pipeline_threads()) == before
+
+
+def chunk(chunk_id: str, text: str) -> Document:
+    return Document(page_content=text, metadata={'id': chunk_id})
+
+
+def test_checkpoint_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    stored = chunk('a.pdf:0:0', 'Art. 1 Os membros votam.')
+    EmbeddingCheckpoint(path).commit([stored])
+
+    restarted = EmbeddingCheckpoint(path)
+
+    assert restarted.is_committed(stored)
+    # A chunk whose text changed must be embedded again
+    assert not restarted.is_committed(chunk('a.pdf:0:0', 'Art. 1 Texto.'))
+    restarted.clear()
+    assert not EmbeddingCheckpoint(path).is_committed(stored)
+
+
+class FlakyEmbeddings(HashingEmbeddings):
+    def __init__(self, failures: int):
+        super().__init__(dimension=8)
+        self.failures = failures
+
+    def embed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise StubRateLimitError('429 Resource has been exhausted')
+        return super().embed_documents(texts)
+
+
+def test_quota_errors_are_retried_with_backoff():
+    delays = []
+    embeddings = FlakyEmbeddings(failures=FAILURES)
+
+    vectors = embed_with_retry(
+        embeddings,
+        TEXTS,
+        TokenBucket(per_minute=6000),
+        RetryPolicy(base_delay=1.0, sleep=delays.append),
+    )
+
+    assert len(vectors) == len(TEXTS)
+    # The jitter never makes a retry wait less than the previous one
+    assert len(delays) == FAILURES
+    assert delays[0] < delays[1]
+
+
+def test_retries_give_up_after_max_retries():
+    with pytest.raises(StubRateLimitError):
+        embed_with_retry(
+            FlakyEmbeddings(failures=FAILURES),
+            TEXTS,
+            TokenBucket(per_minute=6000),
+            RetryPolicy(max_retries=1, sleep=lambda delay: None),
+        )
@@ -0,0 +1,124 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.core.database import Database, load_lexical_index
+from src.core.embeddings import HashingEmbeddings
+from src.core.indexer import index_directory
+from src.core.lexical import occurrence_key
+from src.core.retriever import Retriever
+from src.core.router import DocumentRouter, where_filter
+from src.core.vector_store import NumpyVectorStore
+from tests.conftest import write_pdf
+from tests.test_dedupe import SIGHT_ARTICLE, WIE_ARTICLE
+
+SIGHT = 'docs/Regimento_IEEE_SIGHT_UFC_Fortaleza_2023.pdf'
+WIE = 'docs/Regimento_IEEE_WIE_UFC_2024_1.pdf'
+RAS = 'docs/Estatuto_RAS_2024_1.pdf'
+
+# A clause both regulations have word for word
+SHARED_PAGE = (
+    'Art. 20 Os membros devem zelar pelo nome do Ramo Estudantil em todos os '
+    'eventos externos. Parágrafo único. O uso da marca IEEE segue o manual '
+    'de identidade visual vigente, aprovado pela diretoria do Ramo.'
+)
+
+
+def test_where_filter_matches_occurrence_flags(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), HashingEmbeddings(dimension=8))
+    metadatas = {
+        'wie': {'source': WIE},
+        'shared': {'source': SIGHT, occurrence_key(WIE): True},
+        'released': {'source': SIGHT, occurrence_key(WIE): False},
+        'ras': {'source': RAS},
+    }
+    store.upsert(
+        ids=list(metadatas),
+        embeddings=[[1.0] * 8] * len(metadatas),
+        documents=list(metadatas),
+        metadatas=list(metadatas.values()),
+    )
+
+    found = store.get(where=where_filter([WIE]), include=[])['ids']
+
+    assert sorted(found) == ['shared', 'wie']
+
+
+def test_router_picks_the_document_named_in_the_question():
+    router = DocumentRouter().fit([
+        {'source': SIGHT},
+        {'source': WIE},
+        {'source': RAS},
+    ])
+
+    assert router.route_keywords('comissões do regimento do WIE') == [WIE]
+    assert router.route_keywords('quem pode votar?') is None
+
+
+@pytest.fixture
+def sibling_corpus(workspace):
+    write_pdf(Path(SIGHT), [SIGHT_ARTICLE, SHARED_PAGE])
+    write_pdf(Path(WIE), [WIE_ARTICLE, SHARED_PAGE])
+    write_pdf(Path(RAS), ['Art. 1 A RAS é um capítulo técnico do Ramo.'])
+    index_directory()
+    return workspace
+
+
+def shared_chunk_ids():
+    db = Database()
+    try:
+        items = db.database.get(where={occurrence_key(WIE): True})
+    finally:
+        db.close()
+    return set(items['ids'])
+
+
+def test_routed_search_finds_chunks_stored_under_another_source(
+    sibling_corpus,
+):
+    shared = shared_chunk_ids()
+    assert shared
+    assert all(chunk_id.startswith(SIGHT) for chunk_id in shared)
+
+    db = Database()
+    try:
+        vector_ids = {
+            doc.metadata['id']
+            for doc in db.database.similarity_search(
+                SHARED_PAGE, k=10, filter=where_filter([WIE])
+            )
+        }
+        results, _ = load_lexical_index(db).search(
+            'uso da marca IEEE manual de identidade visual', 10, {WIE}
+        )
+    finally:
+        db.close()
+
+    assert shared <= vector_ids
+    assert shared & {doc.metadata['id'] for doc, _ in results}
+
+
+def test_sibling_clauses_are_both_stored(sibling_corpus):
+    db = Database()
+    try:
+        items = db.database.get(where={'source': WIE})
+    finally:
+        db.close()
+
+    texts = ' '.join(items['documents'])
+    assert 'Grupo de afinidade' in texts
+    assert 'Grupo SIGHT' not in texts
+
+
+def test_retriever_answers_routed_question_from_shared_chunk(sibling_corpus):
+    retriever = Retriever()
+    try:
+        docs = retriever.query_rag('regimento WIE uso da marca IEEE')
+    finally:
+        retriever.close()
+
+    assert docs
+    best = docs[0]
+    assert best.metadata['id'] in shared_chunk_ids()
+    assert [WIE, 1] in json.loads(best.metadata['occurrences'])
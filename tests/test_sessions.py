@@ -0,0 +1,67 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.core.sessions import SessionStore
+
+MAX_MESSAGES = 4
+TURNS = 5
+TURN_MESSAGES = 2
+
+
+def chat(store: SessionStore, session_id: str, turns: int):
+    for turn in range(turns):
+        store.append(session_id, 'human', f'Pergunta {turn}?')
+        store.append(session_id, 'ai', f'Resposta {turn}.')
+
+
+def test_history_keeps_the_latest_whole_turns():
+    store = SessionStore(max_messages=MAX_MESSAGES)
+    chat(store, 'a', TURNS)
+
+    history = store.history('a')
+
+    assert len(history) == MAX_MESSAGES
+    assert isinstance(history[0], HumanMessage)
+    assert isinstance(history[-1], AIMessage)
+    assert history[-1].content == f'Resposta {TURNS - 1}.'
+    assert history.dropped + len(history) == store.length('a')
+    assert store.length('a') == TURNS * TURN_MESSAGES
+
+
+def test_history_from_a_position_skips_older_messages():
+    store = SessionStore()
+    chat(store, 'a', TURNS)
+
+    history = store.history('a', start=TURNS * TURN_MESSAGES - 1)
+
+    assert [message.content for message in history] == [
+        f'Resposta {TURNS - 1}.'
+    ]
+    assert history.dropped == TURNS * TURN_MESSAGES - 1
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(max_sessions=2)
+    chat(store, 'a', 1)
+    chat(store, 'b', 1)
+    store.history('a')
+    chat(store, 'c', 1)
+
+    assert store.length('b') == 0
+    assert store.length('a') == store.length('c') == TURN_MESSAGES
+    assert store.stats()['evicted'] == 1
+
+
+def test_evicted_sessions_are_spilled_and_loaded_back(tmp_path):
+    store = SessionStore(
+        max_sessions=1, spill_path=str(tmp_path / 'sessions.sqlite3')
+    )
+    chat(store, 'a', TURNS)
+    chat(store, 'b', 1)
+
+    assert store.stats()['spilled'] == 1
+    assert store.length('a') == TURNS * TURN_MESSAGES
+    assert store.history('a')[0].content == 'Pergunta 0?'
+
+    store.clear('a')
+    chat(store, 'b', 1)
+    assert store.length('a') == 0